@@ -10,13 +10,17 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from .database import get_db
 from .logger import logger
-from . import schemas, crud, models
+from .metrics import JWT_LATENCY
+from . import schemas, crud, models, keys
 
-from .env import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from .env import ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, TOKEN_VERSION_CHECK
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+jwt_encode_latency = JWT_LATENCY.labels("encode")
+jwt_decode_latency = JWT_LATENCY.labels("decode")
+
 def create_access_token(
         data: dict,
         expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)) -> str:
@@ -32,7 +36,10 @@ def create_access_token(
 
     logger.debug("to_encode: %s", to_encode)
 
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    headers = {"kid": keys.key_id} if keys.key_id else None
+
+    with jwt_encode_latency.time():
+        encoded_jwt = jwt.encode(to_encode, keys.signing_key, algorithm=ALGORITHM, headers=headers)
 
     return encoded_jwt
 
@@ -50,7 +57,8 @@ async def get_current_user(
     )
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with jwt_decode_latency.time():
+            payload = jwt.decode(token, keys.verification_key, algorithms=[ALGORITHM])
 
         logger.debug("Payload: %s", payload)
 
@@ -67,7 +75,13 @@ async def get_current_user(
 
         raise credentials_exception from e
 
-    user = await crud.get_user(db, user_id=token_data.user_id)
+    # Токены, выданные до появления "ver", считаются токенами версии 0
+    token_version = payload.get("ver", 0)
+
+    user = await crud.get_cached_user(
+        db,
+        user_id=token_data.user_id,
+        min_token_version=token_version if TOKEN_VERSION_CHECK else 0)
     logger.debug("user: %s", user)
 
     if user is None:
@@ -75,4 +89,9 @@ async def get_current_user(
 
         raise credentials_exception
 
+    if TOKEN_VERSION_CHECK and token_version != user.token_version:
+        logger.warning("Токен пользователя %s выдан до смены пароля", user.username)
+
+        raise credentials_exception
+
     return user
@@ -1,15 +1,40 @@
 """ Модуль CRUD """
 
+import hashlib
+import secrets
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import String, any_, bindparam, delete, exists, func, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from passlib.context import CryptContext
 
-from . import models, schemas
+from . import models, schemas, hashing
+from .cache import TTLCache, MISSING
 from .logger import logger
+from .metrics import DB_QUERY_LATENCY, timed
+from .env import AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL, REFRESH_TOKEN_EXPIRE_DAYS
+
+
+class UserAlreadyExists(Exception):
+    """ Имя пользователя или email уже заняты """
+
+    def __init__(self, username_taken: bool, email_taken: bool):
+        super().__init__(f"username_taken={username_taken}, email_taken={email_taken}")
+
+        self.username_taken = username_taken
+        self.email_taken = email_taken
+
+class RefreshTokenReused(Exception):
+    """ Предъявлен уже использованный refresh токен: семейство отозвано """
 
+# Пользователи по id для get_current_user. Объекты отсоединены от сессии и
+# общие для всех запросов: их нельзя изменять или добавлять в сессию
+user_cache = TTLCache(maxsize=AUTH_USER_CACHE_SIZE, ttl=AUTH_USER_CACHE_TTL)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+@timed(DB_QUERY_LATENCY)
 async def get_user_by_username(db: AsyncSession, username: str) -> models.User | None:
     """ Возвращает пользователя по username """
 
@@ -19,6 +44,21 @@ async def get_user_by_username(db: AsyncSession, username: str) -> models.User |
 
     return result.scalars().first()
 
+@timed(DB_QUERY_LATENCY)
+async def get_users_by_usernames(db: AsyncSession, usernames: list[str]) -> list[models.User]:
+    """ Возвращает найденных пользователей по списку username (одним запросом) """
+
+    logger.debug("get_users_by_usernames: %d", len(usernames))
+
+    # Список передается одним параметром-массивом: WHERE username = ANY($1)
+    result = await db.execute(
+        select(models.User).where(
+            models.User.username == any_(
+                bindparam("usernames", usernames, type_=ARRAY(String)))))
+
+    return result.scalars().all()
+
+@timed(DB_QUERY_LATENCY)
 async def get_user_by_email(db: AsyncSession, email: str) -> models.User | None:
     """ Возвращает пользователя по email """
 
@@ -28,32 +68,92 @@ async def get_user_by_email(db: AsyncSession, email: str) -> models.User | None:
 
     return result.scalars().first()
 
-async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
-    """ Создает пользователя """
+@timed(DB_QUERY_LATENCY)
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str) -> models.User:
+    """ Создает пользователя одним запросом
+
+    INSERT ... ON CONFLICT DO NOTHING RETURNING в CTE, а в том же запросе
+    проверяется, заняты ли username и email. При конфликте бросает
+    UserAlreadyExists. Пароль хешируется вызывающим кодом, чтобы время
+    bcrypt не попадало в метрику запроса.
+    """
 
     logger.debug("create_user: %s", user.username)
 
-    hashed_password = pwd_context.hash(user.password)
+    new_user = (
+        insert(models.User)
+        .values(username=user.username, email=user.email, hashed_password=hashed_password)
+        .on_conflict_do_nothing()
+        .returning(models.User.id, models.User.created_at)
+        .cte("new_user"))
 
-    db_user = models.User(
+    # Запрос видит снимок до вставки: exists находит только уже существовавшие строки
+    result = await db.execute(select(
+        select(new_user.c.id).scalar_subquery().label("id"),
+        select(new_user.c.created_at).scalar_subquery().label("created_at"),
+        exists().where(models.User.username == user.username).label("username_taken"),
+        exists().where(models.User.email == user.email).label("email_taken")))
+
+    row = result.one()
+
+    await db.commit()
+
+    if row.id is None:
+        # Оба флага False, если конфликтующая строка вставлена параллельно после начала запроса
+        raise UserAlreadyExists(row.username_taken, row.email_taken)
+
+    return models.User(
+        id=row.id,
         username=user.username,
         email=user.email,
-        hashed_password=hashed_password)
+        hashed_password=hashed_password,
+        token_version=0,
+        created_at=row.created_at)
 
-    db.add(db_user)
+async def import_users(db: AsyncSession, rows: list[tuple[str, str, str]]) -> int:
+    """ Массовая загрузка пользователей (username, email, hashed_password)
 
-    await db.commit()
-    await db.refresh(db_user)
+    Строки загружаются через COPY во временную таблицу и переносятся в users
+    одним INSERT ... SELECT. Строки с занятыми username или email пропускаются.
+    Возвращает число добавленных пользователей.
+    """
+
+    logger.debug("import_users: %d", len(rows))
+
+    try:
+        await db.execute(text(
+            "CREATE TEMP TABLE users_import "
+            "(username varchar(50), email varchar(100), hashed_password varchar) "
+            "ON COMMIT DROP"))
+
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+
+        await raw.driver_connection.copy_records_to_table(
+            "users_import", records=rows, columns=["username", "email", "hashed_password"])
+
+        result = await db.execute(text(
+            "INSERT INTO users (username, email, hashed_password, token_version, created_at, updated_at) "
+            "SELECT username, email, hashed_password, 0, now(), now() FROM users_import "
+            "ON CONFLICT DO NOTHING"))
 
-    return db_user
+        await db.commit()
+
+    except BaseException:
+        await db.rollback()
+
+        raise
+
+    return result.rowcount
 
 async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """ Проверяет пароль """
 
     logger.debug("verify_password")
 
-    return pwd_context.verify(plain_password, hashed_password)
+    return await hashing.verify_password(plain_password, hashed_password)
 
+@timed(DB_QUERY_LATENCY)
 async def get_user(db: AsyncSession, user_id: int) -> models.User | None:
     """ Возвращает пользователя по user_id"""
 
@@ -63,16 +163,186 @@ async def get_user(db: AsyncSession, user_id: int) -> models.User | None:
 
     return result.scalars().first()
 
-async def update_password(db: AsyncSession, user: models.User, new_password: str) -> models.User:
-    """ Обновляет пароль """
-    
+async def get_cached_user(db: AsyncSession, user_id: int, min_token_version: int = 0) -> models.User | None:
+    """ Возвращает пользователя по user_id из кеша или из базы
+
+    Если в кеше версия токенов меньше min_token_version, пароль сменили в
+    другом процессе: запись устарела и пользователь перечитывается из базы.
+    """
+
+    user = user_cache.get(user_id)
+
+    if user is not MISSING and user is not None and user.token_version < min_token_version:
+        user_cache.invalidate(user_id)
+        user = MISSING
+
+    if user is MISSING:
+        user = await get_user(db, user_id)
+
+        if user is not None:
+            user_cache.set(user_id, user)
+
+    return user
+
+@timed(DB_QUERY_LATENCY)
+async def update_password(db: AsyncSession, user: models.User, hashed_password: str) -> models.User:
+    """ Обновляет пароль и версию токенов пользователя
+
+    Объект user может быть из кеша, поэтому он не изменяется: возвращается
+    новая строка из UPDATE ... RETURNING.
+    """
+
     logger.debug("update_password: %s", user)
 
-    user.hashed_password = pwd_context.hash(new_password)
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == user.id)
+        .values(
+            hashed_password=hashed_password,
+            token_version=models.User.token_version + 1)
+        .returning(models.User))
+
+    updated_user = result.scalars().one()
 
-    db.add(user)
+    await _revoke_refresh_tokens(db, models.RefreshToken.user_id == user.id)
 
     await db.commit()
-    await db.refresh(user)
 
-    return user
+    user_cache.invalidate(user.id)
+
+    return updated_user
+
+@timed(DB_QUERY_LATENCY)
+async def rehash_password(db: AsyncSession, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """ Заменяет хеш пароля на посчитанный под текущие настройки хеширования
+
+    Хеш заменяется, только если он не изменился с момента входа (иначе пароль
+    успели сменить). Версия токенов не меняется: пароль остался прежним.
+    """
+
+    logger.debug("rehash_password: user_id=%d", user_id)
+
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.hashed_password == old_hash)
+        .values(hashed_password=new_hash))
+
+    await db.commit()
+
+    user_cache.invalidate(user_id)
+
+    return result.rowcount > 0
+
+def _hash_refresh_token(token: str) -> str:
+    """ sha256 refresh токена
+
+    Токен — 256 случайных бит, поэтому медленный хеш с солью не нужен:
+    подобрать токен по хешу невозможно, а проверка не тратит CPU.
+    """
+
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def _revoke_refresh_tokens(db: AsyncSession, *conditions) -> None:
+    """ Отзывает неотозванные refresh токены по условиям (без commit) """
+
+    await db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.revoked_at.is_(None), *conditions)
+        .values(revoked_at=func.now()))
+
+@timed(DB_QUERY_LATENCY)
+async def create_refresh_token(db: AsyncSession, user_id: int, family_id: str | None = None) -> str:
+    """ Создает refresh токен (нового семейства, если family_id не передан) """
+
+    logger.debug("create_refresh_token: user_id=%d", user_id)
+
+    token = secrets.token_urlsafe(32)
+
+    db.add(models.RefreshToken(
+        user_id=user_id,
+        token_hash=_hash_refresh_token(token),
+        family_id=family_id or uuid.uuid4().hex,
+        expires_at=datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)))
+
+    await db.commit()
+
+    return token
+
+@timed(DB_QUERY_LATENCY)
+async def rotate_refresh_token(db: AsyncSession, token: str) -> tuple[int, str] | None:
+    """ Обменивает refresh токен на новый из того же семейства
+
+    Возвращает (user_id, новый токен) или None для неизвестного, истекшего или
+    отозванного токена. Если токен уже был использован, отзывает все семейство
+    и выбрасывает RefreshTokenReused.
+    """
+
+    logger.debug("rotate_refresh_token")
+
+    token_hash = _hash_refresh_token(token)
+
+    # Условный UPDATE: из двух одновременных обновлений одним токеном пройдет одно
+    result = await db.execute(
+        update(models.RefreshToken)
+        .where(
+            models.RefreshToken.token_hash == token_hash,
+            models.RefreshToken.used_at.is_(None),
+            models.RefreshToken.revoked_at.is_(None),
+            models.RefreshToken.expires_at > func.now())
+        .values(used_at=func.now())
+        .returning(models.RefreshToken.user_id, models.RefreshToken.family_id))
+
+    row = result.first()
+
+    if row is not None:
+        return row.user_id, await create_refresh_token(db, row.user_id, row.family_id)
+
+    result = await db.execute(
+        select(models.RefreshToken.family_id)
+        .where(
+            models.RefreshToken.token_hash == token_hash,
+            models.RefreshToken.used_at.is_not(None),
+            models.RefreshToken.revoked_at.is_(None)))
+
+    family_id = result.scalar()
+
+    if family_id is None:
+        await db.rollback()
+
+        return None
+
+    await _revoke_refresh_tokens(db, models.RefreshToken.family_id == family_id)
+    await db.commit()
+
+    raise RefreshTokenReused(family_id)
+
+@timed(DB_QUERY_LATENCY)
+async def revoke_refresh_token(db: AsyncSession, token: str) -> bool:
+    """ Отзывает семейство refresh токена (выход). False, если токен неизвестен """
+
+    logger.debug("revoke_refresh_token")
+
+    result = await db.execute(
+        select(models.RefreshToken.family_id)
+        .where(models.RefreshToken.token_hash == _hash_refresh_token(token)))
+
+    family_id = result.scalar()
+
+    if family_id is None:
+        return False
+
+    await _revoke_refresh_tokens(db, models.RefreshToken.family_id == family_id)
+    await db.commit()
+
+    return True
+
+@timed(DB_QUERY_LATENCY)
+async def delete_expired_refresh_tokens(db: AsyncSession) -> int:
+    """ Удаляет истекшие refresh токены и возвращает их число """
+
+    result = await db.execute(
+        delete(models.RefreshToken).where(models.RefreshToken.expires_at <= func.now()))
+
+    await db.commit()
+
+    return result.rowcount
@@ -1,17 +1,100 @@
 """ Модуль для работы с базой данных """
 
+import time
 from typing import AsyncGenerator
 
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from .env import DATABASE_URL
+from .env import (
+    DATABASE_URL,
+    DB_ECHO,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_CACHE_SIZE)
 from .logger import logger
 
 
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """ Пул соединений, который считает время получения соединения и таймауты """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def connect(self):
+        # Свободных соединений нет: придется ждать возврата или открывать новое
+        waited = self.checkedin() == 0
+        start = time.perf_counter()
+
+        try:
+            return super().connect()
+
+        except exc.TimeoutError:
+            self.timeouts += 1
+
+            raise
+
+        finally:
+            elapsed = time.perf_counter() - start
+
+            self.checkouts += 1
+            self.waits += waited
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def stats(self) -> dict:
+        """ Текущее состояние пула и накопленные счетчики """
+
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_time_total": round(self.wait_time, 6),
+            "wait_time_max": round(self.max_wait_time, 6),
+            "timeouts": self.timeouts,
+        }
+
+def _connect_args() -> dict:
+    """ Параметры подключения драйвера """
+
+    if make_url(DATABASE_URL).get_driver_name() != "asyncpg":
+        return {}
+
+    # prepared_statement_cache_size — кеш подготовленных запросов SQLAlchemy,
+    # statement_cache_size — собственный кеш asyncpg. 0 отключает оба (нужно за pgbouncer)
+    return {
+        "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+    }
+
 logger.debug("Create async engine to url: %s", DATABASE_URL)
 
-async_engine = create_async_engine(DATABASE_URL, echo=True)
+async_engine = create_async_engine(
+    DATABASE_URL,
+    echo=DB_ECHO,
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args=_connect_args())
 
 AsyncSessionLocal = sessionmaker(
     async_engine, expire_on_commit=False, class_=AsyncSession
@@ -22,3 +105,8 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
     async with AsyncSessionLocal() as session:
         yield session
+
+def pool_stats() -> dict:
+    """ Счетчики пула соединений с базой """
+
+    return async_engine.pool.stats()
@@ -14,12 +14,90 @@ DATABASE_URL = os.getenv("AUTH_DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM  = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Срок жизни refresh токена (продлевается при каждом обновлении) и период
+# удаления истекших токенов в секундах (0 отключает удаление)
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REFRESH_TOKEN_CLEANUP_INTERVAL = float(os.getenv("REFRESH_TOKEN_CLEANUP_INTERVAL", "3600"))
+
+# Ключи для асимметричных алгоритмов (RS256, ES256 и т.д.)
+JWT_PRIVATE_KEY_PATH = os.getenv("JWT_PRIVATE_KEY_PATH")
+JWT_PUBLIC_KEY_PATH = os.getenv("JWT_PUBLIC_KEY_PATH")
+JWT_PREVIOUS_PUBLIC_KEY_PATHS = [
+    path for path in os.getenv("JWT_PREVIOUS_PUBLIC_KEY_PATHS", "").split(",") if path]
 
 IS_DEBUG = os.getenv("IS_DEBUG", "0").lower() in ["true", "1"]
 
+# Пул соединений с базой: размер, сколько соединений открывать сверх него,
+# сколько секунд ждать свободного соединения и через сколько секунд
+# переоткрывать соединение (-1 — никогда)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Проверять соединение запросом перед выдачей из пула (лишний round trip)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0").lower() in ["true", "1"]
+# Размер кеша подготовленных запросов на соединение (0 — для pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Писать в лог все SQL запросы
+DB_ECHO = os.getenv("DB_ECHO", "0").lower() in ["true", "1"]
+
+# Логи: формат ("text" или "json"), ротация ("size", "time" или "none"),
+# размер очереди записей и сколько записей INFO/DEBUG в секунду пропускать
+# для каждого шаблона сообщения (0 отключает ограничение)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0"))
+
+# Кеш пользователей по id для get_current_user (0 отключает кеш)
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+# Отклонять токены, выданные до смены пароля (claim "ver")
+TOKEN_VERSION_CHECK = os.getenv("TOKEN_VERSION_CHECK", "1").lower() in ["true", "1"]
+
+# Пул для хеширования паролей: "process" (по умолчанию) или "thread"
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "process").lower()
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+# Сколько задач может ждать свободного воркера сверх HASH_WORKERS
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "64"))
+
+# Схема хеширования паролей: "bcrypt" или "argon2" (нужен пакет argon2-cffi).
+# Стоимость подбирается под HASH_TARGET_MS при старте (HASH_CALIBRATE) или
+# берется из файла калибровки (python -m app.manage calibrate-hashing), но не
+# ниже минимальной. BCRYPT_ROUNDS / ARGON2_TIME_COST задают ее явно
+HASH_SCHEME = os.getenv("HASH_SCHEME", "bcrypt").lower()
+HASH_TARGET_MS = float(os.getenv("HASH_TARGET_MS", "250"))
+HASH_CALIBRATE = os.getenv("HASH_CALIBRATE", "1").lower() in ["true", "1"]
+HASH_CALIBRATION_FILE = os.getenv("HASH_CALIBRATION_FILE", "")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "0"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "12"))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", "16"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "0"))
+ARGON2_MIN_TIME_COST = int(os.getenv("ARGON2_MIN_TIME_COST", "2"))
+ARGON2_MEMORY_KIB = int(os.getenv("ARGON2_MEMORY_KIB", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
 
 if not DATABASE_URL:
     raise ValueError("DATA_BASE_URL не установлена в переменных окружения")
 
-if not SECRET_KEY:
+if HASH_EXECUTOR not in ["process", "thread"]:
+    raise ValueError("HASH_EXECUTOR должна быть 'process' или 'thread'")
+
+if HASH_SCHEME not in ["bcrypt", "argon2"]:
+    raise ValueError("HASH_SCHEME должна быть 'bcrypt' или 'argon2'")
+
+if ALGORITHM.startswith("HS") and not SECRET_KEY:
     raise ValueError("SECRET_KEY не установлена в переменных окружения")
+
+if not ALGORITHM.startswith("HS") and not JWT_PRIVATE_KEY_PATH:
+    raise ValueError("JWT_PRIVATE_KEY_PATH не установлена в переменных окружения")
+
+if LOG_FORMAT not in ["text", "json"]:
+    raise ValueError("LOG_FORMAT должна быть 'text' или 'json'")
+
+if LOG_ROTATION not in ["size", "time", "none"]:
+    raise ValueError("LOG_ROTATION должна быть 'size', 'time' или 'none'")
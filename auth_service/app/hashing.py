@@ -0,0 +1,256 @@
+""" Модуль хеширования паролей вне event loop """
+
+import asyncio
+import json
+import math
+import statistics
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from passlib.hash import argon2
+
+from .logger import logger
+from .metrics import PASSWORD_HASH_LATENCY, timed
+from .env import (
+    HASH_EXECUTOR,
+    HASH_WORKERS,
+    HASH_QUEUE_SIZE,
+    HASH_SCHEME,
+    HASH_TARGET_MS,
+    HASH_CALIBRATE,
+    HASH_CALIBRATION_FILE,
+    BCRYPT_ROUNDS,
+    BCRYPT_MIN_ROUNDS,
+    BCRYPT_MAX_ROUNDS,
+    ARGON2_TIME_COST,
+    ARGON2_MIN_TIME_COST,
+    ARGON2_MEMORY_KIB,
+    ARGON2_PARALLELISM)
+
+
+# Стоимость bcrypt по умолчанию в passlib
+DEFAULT_BCRYPT_ROUNDS = 12
+
+CALIBRATION_PASSWORD = "calibration-password"
+
+# Заменяется в configure(): до этого используются настройки passlib по умолчанию
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+hash_settings: dict = {"scheme": "bcrypt", "rounds": DEFAULT_BCRYPT_ROUNDS}
+
+_executor: Executor | None = None
+
+# Количество задач, отправленных в пул и еще не завершенных.
+# Изменяется только из event loop, поэтому блокировка не нужна.
+_pending = 0
+
+
+def _hash(password: str) -> str:
+    """ Хеширование пароля (выполняется в воркере пула) """
+
+    return pwd_context.hash(password)
+
+def hash_batch(passwords: list[str]) -> list[str]:
+    """ Хеширование списка паролей (выполняется в воркере пула массового импорта) """
+
+    return [pwd_context.hash(password) for password in passwords]
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    """ Проверка пароля (выполняется в воркере пула) """
+
+    return pwd_context.verify(plain_password, hashed_password)
+
+def build_context(settings: dict) -> CryptContext:
+    """ CryptContext с выбранной схемой и стоимостью
+
+    Стоимость задается как минимальная (min_rounds) без верхней границы:
+    needs_update срабатывает только для более дешевых хешей и для хешей другой
+    схемы. Более дорогие хеши, сделанные узлами помощнее, не трогаются, иначе
+    при входе через разные узлы пароль перехешировался бы каждый раз.
+    """
+
+    if settings["scheme"] == "argon2":
+        return CryptContext(
+            schemes=["argon2", "bcrypt"],
+            deprecated="auto",
+            argon2__time_cost=settings["time_cost"],
+            argon2__memory_cost=settings["memory_cost"],
+            argon2__parallelism=settings["parallelism"],
+            argon2__min_rounds=settings["time_cost"])
+
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=settings["rounds"],
+        bcrypt__min_rounds=settings["rounds"])
+
+def configure(settings: dict) -> None:
+    """ Применяет настройки хеширования (и в воркерах пула через initializer) """
+
+    global pwd_context, hash_settings # pylint: disable=global-statement
+
+    pwd_context = build_context(settings)
+    hash_settings = settings
+
+def _measure_ms(settings: dict, repeat: int = 3) -> float:
+    """ Медианное время хеширования с настройками settings в миллисекундах """
+
+    context = build_context(settings)
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        context.hash(CALIBRATION_PASSWORD)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(times)
+
+def calibrate(target_ms: float = HASH_TARGET_MS) -> dict:
+    """ Подбирает стоимость хеширования под target_ms на этой машине
+
+    Стоимость не опускается ниже минимальной (BCRYPT_MIN_ROUNDS,
+    ARGON2_MIN_TIME_COST), даже если целевое время превышено.
+    """
+
+    if HASH_SCHEME == "argon2":
+        settings = {
+            "scheme": "argon2",
+            "time_cost": ARGON2_MIN_TIME_COST,
+            "memory_cost": ARGON2_MEMORY_KIB,
+            "parallelism": ARGON2_PARALLELISM,
+        }
+
+        # Время argon2 растет линейно с time_cost
+        elapsed = _measure_ms(settings)
+        settings["time_cost"] = max(
+            ARGON2_MIN_TIME_COST, int(ARGON2_MIN_TIME_COST * target_ms / elapsed))
+    else:
+        settings = {"scheme": "bcrypt", "rounds": BCRYPT_MIN_ROUNDS}
+
+        # Каждый следующий round bcrypt удваивает время
+        elapsed = _measure_ms(settings)
+        settings["rounds"] = min(BCRYPT_MAX_ROUNDS, max(
+            BCRYPT_MIN_ROUNDS, BCRYPT_MIN_ROUNDS + math.floor(math.log2(target_ms / elapsed))))
+
+    settings["measured_ms"] = round(_measure_ms(settings), 1)
+    settings["target_ms"] = target_ms
+
+    return settings
+
+def load_settings() -> dict:
+    """ Настройки хеширования
+
+    Порядок: явная стоимость из env (BCRYPT_ROUNDS, ARGON2_TIME_COST), файл
+    калибровки (HASH_CALIBRATION_FILE), калибровка при старте (HASH_CALIBRATE),
+    иначе стоимость по умолчанию, но не ниже минимальной.
+    """
+
+    if HASH_SCHEME == "argon2" and not argon2.has_backend():
+        raise RuntimeError("Для HASH_SCHEME=argon2 нужен пакет argon2-cffi")
+
+    if HASH_SCHEME == "bcrypt" and BCRYPT_ROUNDS:
+        return {"scheme": "bcrypt", "rounds": max(BCRYPT_ROUNDS, BCRYPT_MIN_ROUNDS), "source": "env"}
+
+    if HASH_SCHEME == "argon2" and ARGON2_TIME_COST:
+        return {
+            "scheme": "argon2",
+            "time_cost": max(ARGON2_TIME_COST, ARGON2_MIN_TIME_COST),
+            "memory_cost": ARGON2_MEMORY_KIB,
+            "parallelism": ARGON2_PARALLELISM,
+            "source": "env",
+        }
+
+    if HASH_CALIBRATION_FILE and Path(HASH_CALIBRATION_FILE).exists():
+        settings = json.loads(Path(HASH_CALIBRATION_FILE).read_text(encoding="utf-8"))
+
+        if settings.get("scheme") == HASH_SCHEME:
+            return {**settings, "source": "file"}
+
+        logger.warning("Файл калибровки %s снят для схемы %s, а не %s",
+                       HASH_CALIBRATION_FILE, settings.get("scheme"), HASH_SCHEME)
+
+    if HASH_CALIBRATE:
+        return {**calibrate(), "source": "calibration"}
+
+    if HASH_SCHEME == "argon2":
+        return {
+            "scheme": "argon2",
+            "time_cost": ARGON2_MIN_TIME_COST,
+            "memory_cost": ARGON2_MEMORY_KIB,
+            "parallelism": ARGON2_PARALLELISM,
+            "source": "default",
+        }
+
+    return {"scheme": "bcrypt", "rounds": max(DEFAULT_BCRYPT_ROUNDS, BCRYPT_MIN_ROUNDS), "source": "default"}
+
+def needs_update(hashed_password: str) -> bool:
+    """ Нужно ли перехешировать пароль под текущие настройки """
+
+    return pwd_context.needs_update(hashed_password)
+
+def get_executor() -> Executor:
+    """ Возвращает пул для хеширования, создавая его при первом обращении """
+
+    global _executor # pylint: disable=global-statement
+
+    if _executor is None:
+        logger.debug("Create %s hashing executor: workers=%d", HASH_EXECUTOR, HASH_WORKERS)
+
+        if HASH_EXECUTOR == "thread":
+            _executor = ThreadPoolExecutor(
+                max_workers=HASH_WORKERS,
+                thread_name_prefix="hashing")
+        else:
+            _executor = ProcessPoolExecutor(
+                max_workers=HASH_WORKERS,
+                initializer=configure,
+                initargs=(hash_settings,))
+
+    return _executor
+
+def shutdown_executor() -> None:
+    """ Останавливает пул хеширования """
+
+    global _executor # pylint: disable=global-statement
+
+    if _executor is not None:
+        logger.debug("Shutdown hashing executor")
+
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+async def _submit(func, *args):
+    """ Отправляет задачу в пул, отклоняя ее при переполненной очереди """
+
+    global _pending # pylint: disable=global-statement
+
+    if _pending >= HASH_WORKERS + HASH_QUEUE_SIZE:
+        logger.warning("Очередь хеширования переполнена: %d задач", _pending)
+
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис перегружен, повторите попытку позже",
+            headers={"Retry-After": "1"})
+
+    _pending += 1
+
+    try:
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        _pending -= 1
+
+@timed(PASSWORD_HASH_LATENCY, "hash")
+async def hash_password(password: str) -> str:
+    """ Возвращает хеш пароля """
+
+    return await _submit(_hash, password)
+
+@timed(PASSWORD_HASH_LATENCY, "verify")
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """ Проверяет пароль по хешу """
+
+    return await _submit(_verify, plain_password, hashed_password)
@@ -0,0 +1,74 @@
+""" Модуль ключей подписи JWT """
+
+import base64
+import hashlib
+import json
+
+from jose import jwk
+
+from .env import (
+    ALGORITHM,
+    SECRET_KEY,
+    JWT_PRIVATE_KEY_PATH,
+    JWT_PUBLIC_KEY_PATH,
+    JWT_PREVIOUS_PUBLIC_KEY_PATHS)
+
+
+# Поля JWK, по которым считается отпечаток ключа (RFC 7638)
+THUMBPRINT_MEMBERS = {
+    "RSA": ("e", "kty", "n"),
+    "EC": ("crv", "kty", "x", "y"),
+}
+
+def is_asymmetric() -> bool:
+    """ Используется ли асимметричный алгоритм подписи """
+
+    return not ALGORITHM.startswith("HS")
+
+def _read_key(path: str) -> str:
+    """ Читает PEM-ключ из файла """
+
+    with open(path, encoding="utf-8") as key_file:
+        return key_file.read()
+
+def _public_jwk(pem: str) -> dict:
+    """ Возвращает публичную часть ключа в формате JWK с kid """
+
+    public_key = jwk.construct(pem, ALGORITHM).public_key().to_dict()
+
+    members = THUMBPRINT_MEMBERS[public_key["kty"]]
+    canonical = json.dumps(
+        {name: public_key[name] for name in members},
+        separators=(",", ":"),
+        sort_keys=True)
+    digest = hashlib.sha256(canonical.encode()).digest()
+
+    public_key["kid"] = base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+    public_key["use"] = "sig"
+
+    return public_key
+
+
+if is_asymmetric():
+    signing_key = _read_key(JWT_PRIVATE_KEY_PATH)
+
+    _current_jwk = _public_jwk(
+        _read_key(JWT_PUBLIC_KEY_PATH) if JWT_PUBLIC_KEY_PATH else signing_key)
+
+    verification_key: str | dict = _current_jwk
+    key_id: str | None = _current_jwk["kid"]
+
+    # Предыдущие ключи публикуются, пока не истекут подписанные ими токены
+    _published_jwks = [_current_jwk] + [
+        _public_jwk(_read_key(path)) for path in JWT_PREVIOUS_PUBLIC_KEY_PATHS]
+else:
+    signing_key = SECRET_KEY
+    verification_key = SECRET_KEY
+    key_id = None
+
+    _published_jwks = []
+
+def jwks() -> dict:
+    """ Набор публичных ключей (JWKS) для проверки токенов другими сервисами """
+
+    return {"keys": _published_jwks}
@@ -1,19 +1,176 @@
-""" Модуль логгирования """
+""" Модуль логгирования
 
-import os
+Обработчики запросов только кладут записи в очередь (QueueHandler), а
+форматирование и запись в файл выполняются в фоновом потоке QueueListener.
+"""
+
+import atexit
+import json
 import logging
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from .env import (
+    LOGS_DIR,
+    IS_DEBUG,
+    LOG_FORMAT,
+    LOG_ROTATION,
+    LOG_MAX_BYTES,
+    LOG_ROTATE_WHEN,
+    LOG_BACKUP_COUNT,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATE)
 
-from .env import LOGS_DIR, IS_DEBUG
 
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# id запроса, в рамках которого пишется запись (см. middleware.RequestIdMiddleware)
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+class RequestIdFilter(logging.Filter):
+    """ Добавляет в запись id текущего запроса (в потоке, который пишет лог) """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+
+        return True
+
+class SamplingFilter(logging.Filter):
+    """ Пропускает не больше rate записей в секунду для каждого шаблона сообщения
+
+    Ограничиваются только DEBUG и INFO: предупреждения и ошибки пишутся всегда.
+    Шаблон (record.msg до подстановки аргументов) определяет "источник" записей.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+
+        self.rate = rate
+        self.sampled_out = 0
+
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno > logging.INFO:
+            return True
+
+        key = str(record.msg)
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - updated) * self.rate)
+
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self.sampled_out += 1
+
+                return False
+
+            self._buckets[key] = (tokens - 1, now)
+
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """ QueueHandler с ограниченной очередью: при переполнении запись отбрасывается """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ Подставляет аргументы в сообщение сразу: объекты могут измениться,
+        пока запись ждет в очереди. Остальное форматирование — в фоновом потоке """
+
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """ Запись в виде одной JSON строки """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False)
+
+def _file_handler(log_file: str) -> logging.Handler:
+    """ Обработчик файла с ротацией по размеру, по времени или без нее """
+
+    if LOG_ROTATION == "size":
+        return RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+
+    if LOG_ROTATION == "time":
+        return TimedRotatingFileHandler(log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT)
+
+    return logging.FileHandler(log_file)
+
 logger = logging.getLogger("auth_service")
 logger.setLevel(logging.DEBUG if IS_DEBUG else logging.INFO)
 
 log_file = os.path.join(LOGS_DIR, "auth_service.log")
 
-handler = logging.FileHandler(log_file)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+handler = _file_handler(log_file)
+
+if LOG_FORMAT == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(request_id)s - %(message)s')
+
 handler.setFormatter(formatter)
 
-logger.addHandler(handler)
+sampling_filter = SamplingFilter(LOG_SAMPLE_RATE)
+
+queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+queue_handler.addFilter(sampling_filter)
+queue_handler.addFilter(RequestIdFilter())
+
+logger.addHandler(queue_handler)
+
+listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+listener.start()
+
+def stop_listener() -> None:
+    """ Дописывает оставшиеся в очереди записи и останавливает фоновый поток """
+
+    # В python < 3.12 повторный QueueListener.stop падает
+    if listener._thread is not None:
+        listener.stop()
+
+atexit.register(stop_listener)
+
+def log_stats() -> dict:
+    """ Счетчики очереди логов """
+
+    return {
+        "queued": queue_handler.queue.qsize(),
+        "dropped": queue_handler.dropped,
+        "sampled_out": sampling_filter.sampled_out,
+    }
@@ -1,16 +1,83 @@
 """ Микросервис аутентификации """
 
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Response
 from fastapi.security import OAuth2PasswordRequestForm
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import models, schemas, crud, auth
-from .database import get_db
-from .logger import logger
+from . import models, schemas, crud, auth, hashing, keys, metrics
+from .database import get_db, pool_stats, AsyncSessionLocal
+from .logger import logger, log_stats
+from .middleware import RequestIdMiddleware, MetricsMiddleware
+from .env import REFRESH_TOKEN_CLEANUP_INTERVAL
+
+
+async def cleanup_refresh_tokens_loop() -> None:
+    """ Периодически удаляет истекшие refresh токены """
+
+    while True:
+        await asyncio.sleep(REFRESH_TOKEN_CLEANUP_INTERVAL)
+
+        try:
+            async with AsyncSessionLocal() as db:
+                count = await crud.delete_expired_refresh_tokens(db)
+
+            logger.debug("Удалены истекшие refresh токены: %d", count)
+        except SQLAlchemyError as e:
+            logger.error("Не удалось удалить истекшие refresh токены: %s", e)
+
+async def rehash_password(user_id: int, old_hash: str, password: str) -> None:
+    """ Перехеширование пароля после входа (фоновая задача, вне пути запроса) """
+
+    try:
+        new_hash = await hashing.hash_password(password)
+
+        async with AsyncSessionLocal() as db:
+            if await crud.rehash_password(db, user_id, old_hash, new_hash):
+                logger.info("Пароль пользователя с id=%d перехеширован", user_id)
+    except (SQLAlchemyError, HTTPException) as e:
+        # HTTPException: очередь хеширования переполнена, перехешируем при следующем входе
+        logger.warning("Не удалось перехешировать пароль пользователя с id=%d: %s", user_id, e)
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """ Запуск и остановка ресурсов приложения """
+
+    # Калибровка до создания пула: воркеры получают готовые настройки
+    hashing.configure(hashing.load_settings())
+    logger.info("Настройки хеширования паролей: %s", hashing.hash_settings)
+
+    hashing.get_executor()
+
+    tasks: list[asyncio.Task] = []
+
+    if REFRESH_TOKEN_CLEANUP_INTERVAL > 0:
+        tasks.append(asyncio.create_task(cleanup_refresh_tokens_loop()))
 
+    yield
 
-app = FastAPI(title="Auth Microservice")
+    for task in tasks:
+        task.cancel()
+
+        with suppress(asyncio.CancelledError):
+            await task
+
+    hashing.shutdown_executor()
+
+app = FastAPI(title="Auth Microservice", lifespan=lifespan)
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+metrics.REGISTRY.register(metrics.StatsCollector({
+    "user_cache": crud.user_cache.stats,
+    "db_pool": pool_stats,
+    "logs": log_stats,
+}))
 
 @app.post("/register", response_model=schemas.UserOut)
 async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)) -> models.User:
@@ -19,16 +86,20 @@ async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db))
     logger.debug("register: %s", user.username)
     logger.info("Попытка зарегистрироваться: %s", user.username)
 
-    db_user = await crud.get_user_by_username(db, username=user.username)
+    hashed_password = await hashing.hash_password(user.password)
 
-    if db_user:
+    try:
+        db_user = await crud.create_user(db, user, hashed_password)
+    except crud.UserAlreadyExists as e:
         logger.warning(
-            "Регистрация неудачна: пользователь %s уже существует",
-            db_user.username)
+            "Регистрация неудачна: пользователь %s уже существует (username: %s, email: %s)",
+            user.username, e.username_taken, e.email_taken)
+
+        if e.email_taken and not e.username_taken:
+            raise HTTPException(status_code=400, detail="Email уже используется") from e
 
-        raise HTTPException(status_code=400, detail="Пользователь уже существует")
+        raise HTTPException(status_code=400, detail="Пользователь уже существует") from e
 
-    db_user = await crud.create_user(db, user)
     logger.info("Пользователь зарегистрирован: %s", db_user.username)
 
     return db_user
@@ -51,8 +122,23 @@ async def check_user(user: schemas.Username, db: AsyncSession = Depends(get_db))
 
     return db_user
 
+@app.post("/check-users", response_model=list[schemas.UserFound])
+async def check_users(
+    users: schemas.Usernames,
+    db: AsyncSession = Depends(get_db)) -> list[models.User]:
+    """ Пакетная проверка регистрации пользователей """
+
+    logger.debug("check_users: %d", len(users.usernames))
+
+    db_users = await crud.get_users_by_usernames(db, usernames=list(set(users.usernames)))
+
+    logger.info("Найдено пользователей: %d из %d", len(db_users), len(users.usernames))
+
+    return db_users
+
 @app.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db)):
     """ Аутентификация пользователя для получения токена """
@@ -67,10 +153,69 @@ async def login_for_access_token(
 
         raise HTTPException(status_code=400, detail="Неверные учетные данные")
 
-    access_token = auth.create_access_token(data={"sub": user.id})
+    if hashing.needs_update(user.hashed_password):
+        background_tasks.add_task(rehash_password, user.id, user.hashed_password, form_data.password)
+
+    access_token = auth.create_access_token(
+        data={"sub": user.id, "username": user.username, "ver": user.token_version})
+    refresh_token = await crud.create_refresh_token(db, user.id)
     logger.info("Пользователь вошел в систему: %s", user.username)
 
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(
+    token: schemas.RefreshTokenIn,
+    db: AsyncSession = Depends(get_db)):
+    """ Новый access токен по refresh токену (без проверки пароля)
+
+    Refresh токен одноразовый: в ответе выдается следующий.
+    """
+
+    logger.debug("refresh_access_token")
+
+    credentials_exception = HTTPException(status_code=401, detail="Невалидный refresh токен")
+
+    try:
+        rotated = await crud.rotate_refresh_token(db, token.refresh_token)
+    except crud.RefreshTokenReused as e:
+        logger.warning("Повторное использование refresh токена, семейство %s отозвано", e)
+
+        raise credentials_exception from e
+
+    if rotated is None:
+        logger.warning("Неизвестный, истекший или отозванный refresh токен")
+
+        raise credentials_exception
+
+    user_id, refresh_token = rotated
+
+    # Из базы, а не из кеша: токен должен получить текущую версию
+    user = await crud.get_user(db, user_id)
+
+    if user is None:
+        logger.warning("Пользователь с id=%d не найден", user_id)
+
+        raise credentials_exception
+
+    access_token = auth.create_access_token(
+        data={"sub": user.id, "username": user.username, "ver": user.token_version})
+    logger.info("Токен обновлен для пользователя: %s", user.username)
+
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/token/revoke", status_code=204)
+async def revoke_refresh_token(
+    token: schemas.RefreshTokenIn,
+    db: AsyncSession = Depends(get_db)) -> Response:
+    """ Выход: отзыв refresh токена и всех токенов его семейства """
+
+    logger.debug("revoke_refresh_token")
+
+    if await crud.revoke_refresh_token(db, token.refresh_token):
+        logger.info("Refresh токен отозван")
+
+    return Response(status_code=204)
 
 @app.post("/change-password", response_model=schemas.UserOut)
 async def change_password(
@@ -82,12 +227,17 @@ async def change_password(
     logger.debug("change_password: %s", current_user)
     logger.info("Попытка смены пароля для пользователя: %s", current_user.username)
 
-    if not await crud.verify_password(password_change.old_password, current_user.hashed_password):
+    # Хеш пароля в кеше другого процесса может быть устаревшим: проверяем по базе
+    db_user = await crud.get_user(db, current_user.id)
+
+    if db_user is None or not await crud.verify_password(
+            password_change.old_password, db_user.hashed_password):
         logger.warning("Неудачная попытка смены пароля для пользователя: %s", current_user.username)
 
         raise HTTPException(status_code=400, detail="Неверный текущий пароль")
 
-    updated_user = await crud.update_password(db, current_user, password_change.new_password)
+    hashed_password = await hashing.hash_password(password_change.new_password)
+    updated_user = await crud.update_password(db, db_user, hashed_password)
     logger.info("Пароль изменен для пользователя: %s", current_user.username)
 
     return updated_user
@@ -101,3 +251,32 @@ async def verify(
     logger.info("Пользователь %s верифицирован", current_user.username)
 
     return current_user
+
+@app.get("/.well-known/jwks.json")
+async def jwks(response: Response) -> dict:
+    """ Публичные ключи для локальной проверки токенов """
+
+    logger.debug("jwks")
+
+    response.headers["Cache-Control"] = "public, max-age=300"
+
+    return keys.jwks()
+
+@app.get("/stats")
+async def get_stats() -> dict:
+    """ Настройки хеширования и счетчики кеша пользователей, пула соединений и очереди логов """
+
+    logger.debug("get_stats")
+
+    return {
+        "hashing": hashing.hash_settings,
+        "user_cache": crud.user_cache.stats(),
+        "db_pool": pool_stats(),
+        "logs": log_stats(),
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    """ Метрики в текстовом формате Prometheus """
+
+    return Response(generate_latest(metrics.REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,143 @@
+""" Служебные команды Auth сервиса
+
+Запуск: python -m app.manage <команда> [аргументы]
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from pydantic import ValidationError
+
+from . import crud, hashing, schemas
+from .database import AsyncSessionLocal, async_engine
+from .env import HASH_SCHEME, HASH_TARGET_MS, HASH_CALIBRATION_FILE
+
+
+async def calibrate_hashing(args: argparse.Namespace) -> None:
+    """Подбор стоимости хеширования паролей на этой машине"""
+
+    settings = hashing.calibrate(target_ms=args.target_ms)
+
+    print(json.dumps(settings, ensure_ascii=False))
+
+    if args.output:
+        args.output.write_text(json.dumps(settings, indent=2), encoding="utf-8")
+
+        print(f"Сохранено в {args.output}")
+
+def read_users(path: Path, file_format: str) -> Iterator[tuple[int, dict]]:
+    """Строки файла импорта (номер строки, поля) в CSV с заголовком или NDJSON"""
+
+    with path.open(encoding="utf-8", newline="") as file:
+        if file_format == "csv":
+            # Строка 1 — заголовок
+            yield from enumerate(csv.DictReader(file), start=2)
+            return
+
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                yield line_number, json.loads(line)
+
+async def import_users(args: argparse.Namespace) -> None:
+    """Массовый импорт пользователей: параллельное хеширование и COPY пачками"""
+
+    file_format = args.format or ("csv" if args.path.suffix.lower() == ".csv" else "ndjson")
+    settings = hashing.load_settings()
+
+    print(f"Настройки хеширования: {settings}")
+
+    rows = read_users(args.path, file_format)
+    imported = skipped = invalid = 0
+    start = time.perf_counter()
+
+    loop = asyncio.get_running_loop()
+
+    # Каждый воркер хеширует свою часть пачки с теми же настройками, что и сервис
+    with ProcessPoolExecutor(
+            max_workers=args.workers, initializer=hashing.configure, initargs=(settings,)) as executor:
+        while batch := list(islice(rows, args.batch_size)):
+            users = []
+
+            for line_number, fields in batch:
+                try:
+                    users.append(schemas.UserCreate.model_validate(fields))
+                except ValidationError as e:
+                    invalid += 1
+
+                    print(f"Строка {line_number} пропущена: {e.errors()[0]['msg']}")
+
+            if not users:
+                continue
+
+            chunk_size = -(-len(users) // args.workers)
+            chunks = [
+                [user.password for user in users[i:i + chunk_size]]
+                for i in range(0, len(users), chunk_size)
+            ]
+
+            hashed = await asyncio.gather(*(
+                loop.run_in_executor(executor, hashing.hash_batch, chunk) for chunk in chunks))
+            hashed_passwords = [password for chunk in hashed for password in chunk]
+
+            async with AsyncSessionLocal() as db:
+                count = await crud.import_users(db, [
+                    (user.username, user.email, hashed_password)
+                    for user, hashed_password in zip(users, hashed_passwords)
+                ])
+
+            imported += count
+            skipped += len(users) - count
+
+            elapsed = time.perf_counter() - start
+
+            print(f"Добавлено: {imported}, уже существуют: {skipped}, с ошибками: {invalid} "
+                  f"({imported / elapsed:.0f} пользователей/с)")
+
+def main() -> None:
+    """Разбор аргументов и запуск команды"""
+
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "calibrate-hashing",
+        help=f"подобрать стоимость {HASH_SCHEME} под целевое время хеширования")
+    command.add_argument("--target-ms", type=float, default=HASH_TARGET_MS)
+    command.add_argument(
+        "--output", type=Path, default=Path(HASH_CALIBRATION_FILE) if HASH_CALIBRATION_FILE else None,
+        help="файл калибровки (по умолчанию HASH_CALIBRATION_FILE)")
+    command.set_defaults(handler=calibrate_hashing)
+
+    command = commands.add_parser(
+        "import-users",
+        help="загрузить пользователей (username, email, password) из CSV с заголовком или NDJSON")
+    command.add_argument("path", type=Path)
+    command.add_argument("--format", choices=["csv", "ndjson"],
+                         help="формат файла (по умолчанию по расширению: .csv или NDJSON)")
+    command.add_argument("--batch-size", type=int, default=10000,
+                         help="сколько пользователей загружать одним COPY")
+    command.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                         help="число процессов хеширования (по умолчанию число ядер)")
+    command.set_defaults(handler=import_users)
+
+    args = parser.parse_args()
+
+    async def run() -> None:
+        try:
+            await args.handler(args)
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
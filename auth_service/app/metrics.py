@@ -0,0 +1,102 @@
+""" Метрики Prometheus
+
+Метрики хранятся в памяти процесса и отдаются на GET /metrics. Дочерние
+метрики с постоянными метками создаются один раз при импорте, чтобы на
+горячем пути оставалось только observe().
+"""
+
+import functools
+import time
+from typing import Callable
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, GCCollector, PlatformCollector, ProcessCollector)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+
+# Свой реестр, а не глобальный: так оба сервиса можно запустить в одном
+# процессе (benchmarks/load_test.py) без конфликта имен метрик
+REGISTRY = CollectorRegistry()
+
+ProcessCollector(registry=REGISTRY)
+PlatformCollector(registry=REGISTRY)
+GCCollector(registry=REGISTRY)
+
+# Внутренние этапы запроса короче самого запроса: нужны более мелкие бакеты
+STAGE_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP запроса",
+    ["method", "route", "status"],
+    registry=REGISTRY)
+
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Число HTTP запросов в обработке",
+    ["method"],
+    registry=REGISTRY)
+
+REQUEST_ERRORS = Counter(
+    "http_request_errors_total",
+    "Число HTTP запросов, завершившихся ошибкой сервера (5xx или исключение)",
+    ["method", "route", "status"],
+    registry=REGISTRY)
+
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения функции crud",
+    ["query"],
+    buckets=STAGE_BUCKETS,
+    registry=REGISTRY)
+
+JWT_LATENCY = Histogram(
+    "jwt_duration_seconds",
+    "Время создания и проверки JWT",
+    ["operation"],
+    buckets=STAGE_BUCKETS,
+    registry=REGISTRY)
+
+PASSWORD_HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds",
+    "Время хеширования и проверки пароля (вместе с ожиданием в очереди пула)",
+    ["operation"],
+    buckets=STAGE_BUCKETS,
+    registry=REGISTRY)
+
+def timed(histogram: Histogram, label: str | None = None) -> Callable:
+    """ Декоратор корутины: время выполнения с меткой label (по умолчанию имя функции) """
+
+    def decorator(func: Callable) -> Callable:
+        child = histogram.labels(label or func.__name__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+class StatsCollector(Collector):
+    """ Отдает числовые значения словарей stats() как gauge метрики
+
+    sources: префикс метрики -> функция, возвращающая словарь счетчиков.
+    Значения читаются только в момент запроса /metrics.
+    """
+
+    def __init__(self, sources: dict[str, Callable[[], dict]]):
+        self.sources = sources
+
+    def collect(self):
+        for prefix, stats in self.sources.items():
+            for key, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield GaugeMetricFamily(f"{prefix}_{key}", f"{prefix}: {key}", value=value)
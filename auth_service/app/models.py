@@ -1,6 +1,6 @@
 """ Объявление моделей """
 
-from sqlalchemy import String, DateTime
+from sqlalchemy import ForeignKey, Integer, String, DateTime
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 from sqlalchemy.sql import func
@@ -21,9 +21,35 @@ class User(Base):
     email: Mapped[str] = mapped_column(String(100), unique=True, index=True, nullable=False)
 
     hashed_password: Mapped[str] = mapped_column(String, nullable=False)
+    # Увеличивается при смене пароля: токены с другим "ver" больше не принимаются
+    token_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
     created_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     updated_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
 
     def __repr__(self) -> str:
         return f"User(id={self.id!r}, username={self.username!r}, email={self.email!r})"
+
+class RefreshToken(Base):
+    """ Refresh токен (хранится только sha256 токена)
+
+    Токены одного входа образуют семейство: при обновлении старый токен
+    помечается использованным и выдается новый с тем же family_id.
+    Повторное использование старого токена отзывает все семейство.
+    """
+
+    __tablename__ = "refresh_tokens"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True, nullable=False)
+    token_hash: Mapped[str] = mapped_column(String(64), unique=True, nullable=False)
+    family_id: Mapped[str] = mapped_column(String(32), index=True, nullable=False)
+
+    created_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    expires_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), index=True, nullable=False)
+    used_at: Mapped[DateTime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    revoked_at: Mapped[DateTime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self) -> str:
+        return f"RefreshToken(id={self.id!r}, user_id={self.user_id!r}, family_id={self.family_id!r})"
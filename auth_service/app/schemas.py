@@ -3,7 +3,7 @@
 from typing import Optional
 from datetime import datetime
 
-from pydantic import BaseModel, EmailStr, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 
 class UserCreate(BaseModel):
@@ -40,6 +40,11 @@ class Username(BaseModel):
 
     username: str
 
+class Usernames(BaseModel):
+    """ Схема списка имен пользователей """
+
+    usernames: list[str] = Field(..., min_length=1, max_length=1000)
+
 class UserFound(BaseModel):
     """ Схема найденного пользователя """
 
@@ -52,6 +57,12 @@ class Token(BaseModel):
 
     access_token: str
     token_type: str
+    refresh_token: str
+
+class RefreshTokenIn(BaseModel):
+    """ Схема refresh токена в запросе """
+
+    refresh_token: str
 
 class TokenData(BaseModel):
     """ Схема доп. данных токена """
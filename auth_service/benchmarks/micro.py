@@ -0,0 +1,304 @@
+""" Микробенчмарки горячих путей /token и /verify
+
+- bcrypt: pwd_context.hash и verify при разной стоимости (rounds)
+- JWT: auth.create_access_token и jwt.decode из get_current_user с текущими
+  настройками, а также сравнение алгоритмов (HS256, RS256, ES256, EdDSA) и
+  библиотек (python-jose и PyJWT, если установлена)
+- pydantic: сериализация UserOut и TransactionOut, по одной и списком
+
+Запуск из каталога auth_service (база не нужна, но env Auth сервиса — да):
+
+    AUTH_DATABASE_URL=postgresql+asyncpg://... SECRET_KEY=... \\
+        python -m benchmarks.micro --save-baseline main
+
+    python -m benchmarks.micro --compare main
+
+Результат печатается в stdout в формате JSON. Базовые замеры хранятся в
+benchmarks/baselines/<имя>.json; сравнивать имеет смысл только замеры,
+снятые на одной машине.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jose import jwt
+from pydantic import TypeAdapter
+
+from app import auth, keys, models, schemas
+from app.env import ALGORITHM
+from app.hashing import pwd_context
+
+
+BASELINES_DIR = Path(__file__).resolve().parent / "baselines"
+TRANSACTION_APP_DIR = Path(__file__).resolve().parents[2] / "transaction_service" / "app"
+
+PASSWORD = "bench-password"
+LIST_SIZE = 100
+
+def load_transaction_schemas():
+    """Импортирует схемы сервиса транзакций как trans_app.schemas
+
+    Оба сервиса называют свой пакет app, поэтому пакет сервиса транзакций
+    загружается из файлов под другим именем.
+    """
+
+    spec = importlib.util.spec_from_file_location(
+        "trans_app", TRANSACTION_APP_DIR / "__init__.py",
+        submodule_search_locations=[str(TRANSACTION_APP_DIR)])
+    module = importlib.util.module_from_spec(spec)
+
+    sys.modules["trans_app"] = module
+    spec.loader.exec_module(module)
+
+    return importlib.import_module("trans_app.schemas")
+
+def _pem(private_key) -> tuple[bytes, bytes]:
+    """Закрытый и открытый ключи в PEM"""
+
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    return private_pem, public_pem
+
+def _claims() -> dict:
+    """Поля токена, как в /token"""
+
+    return {
+        "sub": "1",
+        "username": "bench_user",
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=30),
+    }
+
+def bcrypt_benchmarks(costs: list[int]) -> dict[str, Callable]:
+    """Хеширование и проверка пароля при разной стоимости"""
+
+    benchmarks = {}
+
+    for cost in costs:
+        context = pwd_context.copy(bcrypt__rounds=cost)
+        hashed = context.hash(PASSWORD)
+
+        benchmarks[f"bcrypt_hash_{cost}"] = lambda context=context: context.hash(PASSWORD)
+        benchmarks[f"bcrypt_verify_{cost}"] = \
+            lambda hashed=hashed: pwd_context.verify(PASSWORD, hashed)
+
+    return benchmarks
+
+def service_jwt_benchmarks() -> dict[str, Callable]:
+    """Создание и проверка токена с настройками сервиса"""
+
+    token = auth.create_access_token(data={"sub": 1, "username": "bench_user"})
+
+    return {
+        f"create_access_token_{ALGORITHM}": lambda: auth.create_access_token(
+            data={"sub": 1, "username": "bench_user"}),
+        f"get_current_user_decode_{ALGORITHM}": lambda: jwt.decode(
+            token, keys.verification_key, algorithms=[ALGORITHM]),
+    }
+
+def jwt_library_benchmarks() -> tuple[dict[str, Callable], dict[str, str]]:
+    """Сравнение алгоритмов и библиотек JWT на сгенерированных ключах
+
+    Возвращает бенчмарки и причины пропуска недоступных вариантов.
+    """
+
+    secret = "bench-secret-key-with-enough-length-for-hs256"
+    pem_keys = {
+        "HS256": (secret, secret),
+        "RS256": _pem(rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+        "ES256": _pem(ec.generate_private_key(ec.SECP256R1())),
+        "EdDSA": _pem(ed25519.Ed25519PrivateKey.generate()),
+    }
+
+    libraries = {"jose": jwt}
+    skipped = {}
+
+    try:
+        libraries["pyjwt"] = importlib.import_module("jwt")
+    except ImportError:
+        skipped["pyjwt_*"] = "PyJWT не установлена"
+
+    benchmarks = {}
+
+    for name, library in libraries.items():
+        for algorithm, (private_key, public_key) in pem_keys.items():
+            if name == "jose" and algorithm == "EdDSA":
+                skipped[f"{name}_{algorithm}_*"] = "python-jose не поддерживает EdDSA"
+                continue
+
+            claims = _claims()
+            token = library.encode(claims, private_key, algorithm=algorithm)
+
+            benchmarks[f"{name}_{algorithm}_encode"] = \
+                lambda library=library, private_key=private_key, algorithm=algorithm, claims=claims: \
+                library.encode(claims, private_key, algorithm=algorithm)
+            benchmarks[f"{name}_{algorithm}_decode"] = \
+                lambda library=library, public_key=public_key, algorithm=algorithm, token=token: \
+                library.decode(token, public_key, algorithms=[algorithm])
+
+    return benchmarks, skipped
+
+def pydantic_benchmarks() -> dict[str, Callable]:
+    """Сериализация ответов, как в response_model эндпоинтов"""
+
+    trans_schemas = load_transaction_schemas()
+    now = datetime.now(timezone.utc)
+
+    user = models.User(
+        id=1, username="bench_user", email="bench_user@example.com",
+        hashed_password="x", created_at=now)
+    users = [
+        models.User(
+            id=i, username=f"bench_user_{i}", email=f"bench_user_{i}@example.com",
+            hashed_password="x", created_at=now)
+        for i in range(LIST_SIZE)
+    ]
+
+    # Объекты с атрибутами вместо моделей SQLAlchemy сервиса транзакций
+    transactions = [
+        SimpleNamespace(id=i, sender_id=1, receiver_id=2, amount=10.5, timestamp=now)
+        for i in range(LIST_SIZE)
+    ]
+
+    user_list = TypeAdapter(list[schemas.UserOut])
+    transaction_list = TypeAdapter(list[trans_schemas.TransactionOut])
+
+    return {
+        "pydantic_user_out": lambda: schemas.UserOut.model_validate(user).model_dump_json(),
+        f"pydantic_user_out_list_{LIST_SIZE}": lambda: user_list.dump_json(
+            user_list.validate_python(users, from_attributes=True)),
+        "pydantic_transaction_out": lambda: trans_schemas.TransactionOut.model_validate(
+            transactions[0]).model_dump_json(),
+        f"pydantic_transaction_out_list_{LIST_SIZE}": lambda: transaction_list.dump_json(
+            transaction_list.validate_python(transactions, from_attributes=True)),
+    }
+
+def measure(func: Callable, repeat: int) -> dict:
+    """Медианное время одного вызова по repeat замерам (каждый не короче 0.2 секунды)"""
+
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    per_call = statistics.median(total / number for total in timer.repeat(repeat=repeat, number=number))
+
+    return {
+        "per_call_us": round(per_call * 1e6, 3),
+        "calls_per_second": round(1 / per_call, 1),
+        "number": number,
+        "repeat": repeat,
+    }
+
+def git_commit() -> str | None:
+    """Текущий коммит репозитория, если он доступен"""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Добавляет к результатам изменение относительно базовых замеров
+
+    Возвращает имена бенчмарков, замедлившихся больше чем на threshold.
+    """
+
+    regressions = []
+
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+
+        if base is None:
+            continue
+
+        change = result["per_call_us"] / base["per_call_us"] - 1
+
+        result["baseline_us"] = base["per_call_us"]
+        result["change"] = round(change, 4)
+
+        if change > threshold:
+            regressions.append(name)
+
+    return regressions
+
+def main(args: argparse.Namespace) -> int:
+    """Прогоняет бенчмарки, сохраняет и сравнивает базовые замеры"""
+
+    benchmarks = {}
+    benchmarks.update(bcrypt_benchmarks(args.bcrypt_costs))
+    benchmarks.update(service_jwt_benchmarks())
+
+    library_benchmarks, skipped = jwt_library_benchmarks()
+    benchmarks.update(library_benchmarks)
+    benchmarks.update(pydantic_benchmarks())
+
+    results = {}
+
+    for name, func in benchmarks.items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+
+        results[name] = measure(func, args.repeat)
+
+        print(f"{name}: {results[name]['per_call_us']} us", file=sys.stderr, flush=True)
+
+    report = {
+        "benchmark": "auth_micro",
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+        "skipped": skipped,
+    }
+
+    regressions = []
+
+    if args.compare:
+        baseline = json.loads((BASELINES_DIR / f"{args.compare}.json").read_text())
+        regressions = compare(results, baseline, args.threshold)
+
+        report["baseline"] = {"name": args.compare, "commit": baseline.get("commit")}
+        report["regressions"] = regressions
+
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        (BASELINES_DIR / f"{args.save_baseline}.json").write_text(
+            json.dumps(report, indent=2, ensure_ascii=False))
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.micro")
+    parser.add_argument("--bcrypt-costs", type=int, nargs="+", default=[4, 8, 10, 12])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", help="запускать бенчмарки, в имени которых есть подстрока")
+    parser.add_argument("--save-baseline", metavar="NAME", help="сохранить результат как базовый")
+    parser.add_argument("--compare", metavar="NAME", help="сравнить с сохраненным базовым замером")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="замедление (доля), после которого бенчмарк считается регрессией")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="код возврата 1 при регрессиях")
+
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+""" Общие фикстуры тестов сервиса аутентификации
+
+Тесты с базой используют AUTH_DATABASE_URL (база должна быть мигрирована:
+alembic upgrade head) и пропускаются, если база недоступна.
+
+Запуск из каталога auth_service:
+
+    AUTH_DATABASE_URL=postgresql+asyncpg://... python -m pytest
+"""
+
+import os
+import tempfile
+
+# До импорта app: env.py проверяет обязательные переменные при импорте
+os.environ.setdefault("AUTH_DATABASE_URL", "postgresql+asyncpg://test@localhost:1/test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("LOGS_DIR", tempfile.mkdtemp(prefix="auth_service_logs_"))
+
+import httpx
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import crud, models, schemas
+from app.database import AsyncSessionLocal, async_engine
+from app.main import app
+
+
+# Имена и почта тестовых пользователей не пересекаются с реальными
+TEST_USERNAME_PREFIX = "test_user_"
+TEST_EMAIL_DOMAIN = "auth-tests.example.com"
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+@pytest.fixture
+async def db():
+    """Сессия тестовой базы; тестовые пользователи и их токены удаляются после теста"""
+
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+    except (OSError, SQLAlchemyError) as e:
+        await async_engine.dispose()
+
+        pytest.skip(f"База Auth сервиса недоступна: {e}")
+
+    await cleanup()
+
+    async with AsyncSessionLocal() as session:
+        yield session
+
+    await cleanup()
+
+    # Каждый тест идет в своем event loop: соединения пула к нему привязаны
+    await async_engine.dispose()
+
+async def cleanup() -> None:
+    """Удаляет тестовых пользователей и их refresh токены"""
+
+    async with AsyncSessionLocal() as session:
+        users = "(SELECT id FROM users WHERE username LIKE :prefix AND email LIKE :domain)"
+        params = {"prefix": f"{TEST_USERNAME_PREFIX}%", "domain": f"%@{TEST_EMAIL_DOMAIN}"}
+
+        await session.execute(text(f"DELETE FROM refresh_tokens WHERE user_id IN {users}"), params)
+        await session.execute(text(f"DELETE FROM users WHERE id IN {users}"), params)
+        await session.commit()
+
+    crud.user_cache.clear()
+
+@pytest.fixture
+async def user(db) -> models.User:
+    """Тестовый пользователь (хеш пароля не настоящий: тесты не входят по паролю)"""
+
+    username = f"{TEST_USERNAME_PREFIX}0"
+
+    return await crud.create_user(
+        db,
+        schemas.UserCreate(username=username, email=f"{username}@{TEST_EMAIL_DOMAIN}", password="password"),
+        hashed_password="not-a-hash")
+
+@pytest.fixture
+async def client(db):
+    """Клиент сервиса аутентификации"""
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://auth") as test_client:
+        yield test_client
@@ -0,0 +1,76 @@
+""" Refresh токены: ротация, обнаружение повторного использования и отзыв """
+
+import pytest
+from sqlalchemy import select
+
+from app import crud, models
+
+
+pytestmark = pytest.mark.anyio
+
+async def refresh(client, token: str):
+    return await client.post("/token/refresh", json={"refresh_token": token})
+
+async def family_tokens(db, token: str) -> list[models.RefreshToken]:
+    family = select(models.RefreshToken.family_id).where(
+        models.RefreshToken.token_hash == crud._hash_refresh_token(token)).scalar_subquery() # pylint: disable=protected-access
+
+    db.expire_all()
+
+    return (await db.scalars(
+        select(models.RefreshToken)
+        .where(models.RefreshToken.family_id == family)
+        .order_by(models.RefreshToken.id))).all()
+
+async def test_rotation_issues_next_token_of_family(client, db, user):
+    token = await crud.create_refresh_token(db, user.id)
+
+    response = await refresh(client, token)
+
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body["access_token"]
+    assert body["refresh_token"] != token
+
+    old, new = await family_tokens(db, token)
+
+    assert old.token_hash == crud._hash_refresh_token(token) # pylint: disable=protected-access
+    assert old.used_at is not None and old.revoked_at is None
+    assert new.token_hash == crud._hash_refresh_token(body["refresh_token"]) # pylint: disable=protected-access
+    assert new.used_at is None and new.revoked_at is None
+
+    # Следующий токен тоже обменивается
+    assert (await refresh(client, body["refresh_token"])).status_code == 200
+
+async def test_reuse_revokes_family(client, db, user):
+    token = await crud.create_refresh_token(db, user.id)
+    other = await crud.create_refresh_token(db, user.id)
+
+    rotated = (await refresh(client, token)).json()["refresh_token"]
+
+    # Повтор уже использованного токена: отзывается все семейство,
+    # в том числе выданный при ротации токен
+    assert (await refresh(client, token)).status_code == 401
+    assert (await refresh(client, rotated)).status_code == 401
+
+    assert all(row.revoked_at is not None for row in await family_tokens(db, token))
+
+    # Другой вход того же пользователя не затронут
+    assert (await refresh(client, other)).status_code == 200
+
+async def test_revoke_revokes_family(client, db, user):
+    token = await crud.create_refresh_token(db, user.id)
+    rotated = (await refresh(client, token)).json()["refresh_token"]
+
+    response = await client.post("/token/revoke", json={"refresh_token": rotated})
+
+    assert response.status_code == 204
+    assert all(row.revoked_at is not None for row in await family_tokens(db, token))
+
+    assert (await refresh(client, rotated)).status_code == 401
+
+async def test_unknown_token(client, db):
+    assert (await refresh(client, "unknown")).status_code == 401
+    assert (await client.post("/token/revoke", json={"refresh_token": "unknown"})).status_code == 204
+    assert not await crud.revoke_refresh_token(db, "unknown")
@@ -9,6 +9,7 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from alembic import context
 
 from app.models import Base
+from app.partitions import DEFAULT_PARTITION, partition_month
 
 from app.env import DATABASE_URL
 
@@ -23,6 +24,15 @@ target_metadata = Base.metadata
 config.set_main_option('sqlalchemy.url', DATABASE_URL)
 
 
+def include_name(name, type_, _parent_names) -> bool:
+    """Партиции transactions создаются сервисом, а не миграциями."""
+
+    if type_ == "table":
+        return name != DEFAULT_PARTITION and partition_month(name) is None
+
+    return True
+
+
 def run_migrations_offline() -> None:
     """Выполнение миграций в офлайн режиме.
 
@@ -35,6 +45,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -49,6 +60,7 @@ def do_run_migrations(connection: Connection) -> None:
         target_metadata=target_metadata,
         compare_type=True,
         render_as_batch=True,
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -0,0 +1,47 @@
+"""Keyset pagination indexes
+
+Revision ID: 25ca1ff78c35
+Revises: 29802bc96016
+Create Date: 2026-10-18 08:39:45.591993
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '25ca1ff78c35'
+down_revision: Union[str, None] = '29802bc96016'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индексы строятся без блокировки записи в таблицу транзакций
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_transactions_sender_id_timestamp_id',
+            'transactions',
+            ['sender_id', sa.literal_column('timestamp DESC'), sa.literal_column('id DESC')],
+            unique=False,
+            postgresql_concurrently=True)
+        op.create_index(
+            'ix_transactions_receiver_id_timestamp_id',
+            'transactions',
+            ['receiver_id', sa.literal_column('timestamp DESC'), sa.literal_column('id DESC')],
+            unique=False,
+            postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_transactions_receiver_id_timestamp_id',
+            table_name='transactions',
+            postgresql_concurrently=True)
+        op.drop_index(
+            'ix_transactions_sender_id_timestamp_id',
+            table_name='transactions',
+            postgresql_concurrently=True)
@@ -0,0 +1,120 @@
+"""Partition transactions by month
+
+Revision ID: 70ce7a6378db
+Revises: 43dafaffcc8c
+Create Date: 2026-10-18 08:53:57.361810
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '70ce7a6378db'
+down_revision: Union[str, None] = '43dafaffcc8c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Сколько месяцев вперед создаются партиции; дальше их создает сервис
+MONTHS_AHEAD = 3
+
+COLUMNS = "id, sender_id, receiver_id, amount, timestamp, sender_balance_after, receiver_balance_after"
+
+INDEXES = (
+    ("ix_transactions_id", "id"),
+    ("ix_transactions_sender_id_timestamp_id", "sender_id, timestamp DESC, id DESC"),
+    ("ix_transactions_receiver_id_timestamp_id", "receiver_id, timestamp DESC, id DESC"),
+)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def rename_old_table(name: str) -> None:
+    """Освобождает имена таблицы, ее индексов и первичного ключа"""
+
+    op.rename_table('transactions', name)
+    op.execute(f"ALTER TABLE {name} RENAME CONSTRAINT transactions_pkey TO {name}_pkey")
+
+    for index, _columns in INDEXES:
+        op.execute(f"ALTER INDEX {index} RENAME TO {index.replace('transactions', name)}")
+
+
+def create_table(partitioned: bool) -> None:
+    op.execute(f"""
+        CREATE TABLE transactions (
+            id integer NOT NULL DEFAULT nextval('transactions_id_seq'),
+            sender_id integer NOT NULL REFERENCES accounts (id),
+            receiver_id integer NOT NULL REFERENCES accounts (id),
+            amount double precision NOT NULL,
+            timestamp timestamp with time zone NOT NULL DEFAULT clock_timestamp(),
+            sender_balance_after double precision,
+            receiver_balance_after double precision,
+            PRIMARY KEY ({"id, timestamp" if partitioned else "id"})
+        ){" PARTITION BY RANGE (timestamp)" if partitioned else ""}
+    """)
+
+
+def move_rows(old: str) -> None:
+    """Переносит строки и последовательность id в новую таблицу, удаляет старую"""
+
+    op.execute(f"INSERT INTO transactions ({COLUMNS}) SELECT {COLUMNS} FROM {old}")
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    op.drop_table(old)
+
+    for index, columns in INDEXES:
+        op.execute(f"CREATE INDEX {index} ON transactions ({columns})")
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.drop_constraint(batch_op.f('idempotency_keys_transaction_id_fkey'), type_='foreignkey')
+
+    # ### end Alembic commands ###
+
+    # Существующая таблица не может стать секционированной, поэтому строки
+    # переносятся в новую таблицу. Все выполняется в одной транзакции, на время
+    # переноса запись в transactions блокируется
+    rename_old_table('transactions_unpartitioned')
+    create_table(partitioned=True)
+
+    bind = op.get_bind()
+    first = bind.scalar(sa.text(
+        "SELECT date_trunc('month', min(timestamp) AT TIME ZONE 'UTC')::date FROM transactions_unpartitioned"))
+    current = bind.scalar(sa.text("SELECT date_trunc('month', now() AT TIME ZONE 'UTC')::date"))
+
+    month = min(first or current, current)
+
+    # Границы с явным UTC: дата без часового пояса читается в TimeZone сессии
+    while month <= add_months(current, MONTHS_AHEAD):
+        op.execute(
+            f"CREATE TABLE transactions_{month.year:04d}_{month.month:02d} PARTITION OF transactions "
+            f"FOR VALUES FROM ('{month.isoformat()}T00:00:00+00:00') "
+            f"TO ('{add_months(month, 1).isoformat()}T00:00:00+00:00')")
+
+        month = add_months(month, 1)
+
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+
+    move_rows('transactions_unpartitioned')
+
+
+def downgrade() -> None:
+    # Партиции удаляются вместе с секционированной таблицей
+    rename_old_table('transactions_partitioned')
+    create_table(partitioned=False)
+    move_rows('transactions_partitioned')
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.create_foreign_key(batch_op.f('idempotency_keys_transaction_id_fkey'), 'transactions', ['transaction_id'], ['id'])
+
+    # ### end Alembic commands ###
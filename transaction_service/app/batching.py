@@ -0,0 +1,95 @@
+""" Модуль объединения одновременных запросов в пакетные """
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from .logger import logger
+
+
+class MicroBatcher:
+    """ Single-flight и микробатчинг запросов по ключам
+
+    Одинаковые ключи, запрошенные одновременно, ждут один общий future.
+    Разные ключи копятся в течение window секунд (или до max_batch_size)
+    и загружаются одним вызовом load_batch. Ключи, которых нет в ответе
+    load_batch, получают None.
+    """
+
+    def __init__(
+            self,
+            load_batch: Callable[[list[Hashable]], Awaitable[dict[Hashable, Any]]],
+            window: float,
+            max_batch_size: int):
+        self.load_batch = load_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._queue: list[Hashable] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable) -> Any:
+        """ Возвращает значение по ключу, объединяя запрос с одновременными """
+
+        future = self._inflight.get(key)
+
+        if future is None:
+            loop = asyncio.get_running_loop()
+
+            future = loop.create_future()
+
+            self._inflight[key] = future
+            self._queue.append(key)
+
+            if len(self._queue) >= self.max_batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+
+        # shield: отмена одного ожидающего не должна отменять общий future
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        """ Отправляет накопленные ключи одним пакетом """
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        keys, self._queue = self._queue, []
+
+        if not keys:
+            return
+
+        task = asyncio.create_task(self._run(keys))
+
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, keys: list[Hashable]) -> None:
+        """ Загружает пакет и раздает результаты ожидающим """
+
+        logger.debug("MicroBatcher: load %d keys", len(keys))
+
+        values: dict[Hashable, Any] | None = None
+        error: Exception | None = None
+
+        try:
+            values = await self.load_batch(keys)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            error = e
+        finally:
+            for key in keys:
+                future = self._inflight.pop(key)
+
+                if future.done():
+                    continue
+
+                if error is not None:
+                    future.set_exception(error)
+                elif values is None:
+                    # Загрузка была отменена (например, при остановке приложения)
+                    future.cancel()
+                else:
+                    future.set_result(values.get(key))
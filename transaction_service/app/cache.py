@@ -0,0 +1,88 @@
+""" Модуль in-process кеша с ограниченным размером и временем жизни записей """
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+MISSING = object()
+
+class TTLCache:
+    """ LRU кеш, в котором у каждой записи свой срок жизни """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Any:
+        """ Возвращает значение или MISSING, если записи нет или она истекла """
+
+        entry = self._data.get(key)
+
+        if entry is None:
+            self.misses += 1
+
+            return MISSING
+
+        expires_at, value = entry
+
+        if expires_at <= time.monotonic():
+            del self._data[key]
+
+            self.expirations += 1
+            self.misses += 1
+
+            return MISSING
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """ Сохраняет значение на ttl секунд (не дольше максимального ttl кеша) """
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """ Удаляет запись """
+
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """ Удаляет все записи """
+
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """ Счетчики кеша """
+
+        requests = self.hits + self.misses
+
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
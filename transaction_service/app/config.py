@@ -2,3 +2,7 @@
 
 DEFAULT_TRANSACTION_LIMIT = 1000
 DEFAULT_BALANCE = 1000.0
+EXPORT_BATCH_SIZE = 1000
+MAX_BATCH_TRANSFERS = 1000
+IDEMPOTENCY_CLEANUP_BATCH_SIZE = 1000
+DEFAULT_SUMMARY_DAYS = 30
@@ -1,14 +1,35 @@
 """ Модуль CRUD  """
 
+import random
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Sequence
+
+from sqlalchemy import (
+    Date, Float, Integer, Row, ScalarSelect, Select, and_, bindparam, cast, column, delete, func,
+    or_, tuple_, union_all, update, values)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
 
 from . import models, schemas
 from .logger import logger
+from .metrics import DB_QUERY_LATENCY, DB_TRANSACTION_LATENCY, timed
 
-from .config import DEFAULT_BALANCE, DEFAULT_TRANSACTION_LIMIT
+from .config import (
+    DEFAULT_BALANCE,
+    DEFAULT_TRANSACTION_LIMIT,
+    EXPORT_BATCH_SIZE,
+    IDEMPOTENCY_CLEANUP_BATCH_SIZE)
+from .env import IDEMPOTENCY_KEY_TTL
 
 
+class IdempotencyKeyInUse(Exception):
+    """Ключ идемпотентности уже занят другим (завершенным) запросом"""
+
+
+@timed(DB_QUERY_LATENCY)
 async def get_account_by_username(db: AsyncSession, username: str) -> models.Account | None:
     """Возвращает пользователя по username"""
 
@@ -19,6 +40,7 @@ async def get_account_by_username(db: AsyncSession, username: str) -> models.Acc
 
     return result.scalars().first()
 
+@timed(DB_QUERY_LATENCY)
 async def get_account_by_uid(db: AsyncSession, uid: int) -> models.Account | None:
     """Возвращает пользователя по uid """
 
@@ -29,72 +51,852 @@ async def get_account_by_uid(db: AsyncSession, uid: int) -> models.Account | Non
 
     return result.scalars().first()
 
-async def create_account(db: AsyncSession, account: schemas.AccountCreate) -> models.Account:
-    """ Создает пользователя """
+@timed(DB_QUERY_LATENCY)
+async def _fold_shards(db: AsyncSession, account_id: int) -> float:
+    """Переносит части баланса "горячего" аккаунта в основную строку
 
-    logger.debug("create_account: %s", account)
+    Строка accounts должна быть уже заблокирована вызывающим кодом: сначала
+    блокируется аккаунт, затем его части, как и при списании в transfer.
+    """
 
-    db_account = models.Account(
-        uid=account.uid,
-        username=account.username,
-        balance=DEFAULT_BALANCE)
+    moved = await db.execute(
+        delete(models.AccountShard)
+        .where(models.AccountShard.account_id == account_id)
+        .returning(models.AccountShard.balance))
 
-    db.add(db_account)
+    total = sum(moved.scalars().all())
 
-    await db.commit()
-    await db.refresh(db_account)
+    if total:
+        await db.execute(
+            update(models.Account)
+            .where(models.Account.id == account_id)
+            .values(balance=models.Account.balance + total))
 
-    return db_account
+    return total
 
-async def create_transaction(
-        db: AsyncSession,
-        sender: models.Account,
-        receiver: models.Account,
-        amount: float) -> models.Transaction:
-    """Создаёт транзакцию и обновляет балансы"""
+@timed(DB_QUERY_LATENCY)
+async def _debit(db: AsyncSession, account_id: int, amount: float) -> float | None:
+    """Условное списание: новый баланс или None, если средств недостаточно"""
 
-    logger.debug("create_transaction: %s -> %s, %s", sender, receiver, amount)
+    debited = await db.execute(
+        update(models.Account)
+        .where(models.Account.id == account_id, models.Account.balance >= amount)
+        .values(balance=models.Account.balance - amount)
+        .returning(models.Account.balance))
 
-    if sender.balance < amount:
-        logger.error("ValueError: Недостаточно средств у пользователя %s", sender.username)
+    return debited.scalar_one_or_none()
 
-        raise ValueError("Недостаточно средств")
+@timed(DB_QUERY_LATENCY)
+async def _credit(db: AsyncSession, account_id: int, shard_count: int, amount: float) -> float | None:
+    """Зачисление: в основную строку или в случайную часть "горячего" аккаунта
 
-    # Создание транзакции
-    transaction = models.Transaction(
-        sender_id=sender.id,
-        receiver_id=receiver.id,
-        amount=amount
-    )
+    Возвращает новый баланс или None для "горячего" аккаунта.
+    """
 
-    db.add(transaction)
+    if shard_count <= 1:
+        return await db.scalar(
+            update(models.Account)
+            .where(models.Account.id == account_id)
+            .values(balance=models.Account.balance + amount)
+            .returning(models.Account.balance))
 
-    # Обновление балансов
-    sender.balance -= amount
-    receiver.balance += amount
+    shard = insert(models.AccountShard).values(
+        account_id=account_id,
+        shard=random.randrange(shard_count),
+        balance=amount)
 
-    logger.debug("updating sender: %s", sender)
-    logger.debug("updating receiver: %s", receiver)
+    await db.execute(
+        shard.on_conflict_do_update(
+            index_elements=[models.AccountShard.account_id, models.AccountShard.shard],
+            set_={"balance": models.AccountShard.balance + shard.excluded.balance}))
 
-    await db.commit()
-    await db.refresh(transaction)
+    return None
+
+@timed(DB_QUERY_LATENCY)
+async def _add_daily_totals(
+        db: AsyncSession,
+        transactions: list[models.Transaction],
+        shard_counts: dict[int, int]) -> None:
+    """Добавляет переводы в дневные итоги отправителей и получателей
+
+    Строки итогов обычного аккаунта и отправителя защищены блокировкой
+    строки accounts. Для "горячего" получателя итоги пишутся в случайную
+    из shard_count строк, как и зачисления.
+    """
+
+    totals: dict[tuple[int, date, int], list] = defaultdict(lambda: [0.0, 0, 0.0, 0])
+
+    for transaction in transactions:
+        day = transaction.timestamp.astimezone(timezone.utc).date()
+        shard_count = shard_counts[transaction.receiver_id]
+
+        sent = totals[transaction.sender_id, day, 0]
+        sent[0] += transaction.amount
+        sent[1] += 1
+
+        received = totals[
+            transaction.receiver_id,
+            day,
+            random.randrange(shard_count) if shard_count > 1 else 0]
+        received[2] += transaction.amount
+        received[3] += 1
+
+    rows = insert(models.DailyAccountTotal).values([
+        {
+            "account_id": account_id,
+            "day": day,
+            "shard": shard,
+            "sent_amount": sent_amount,
+            "sent_count": sent_count,
+            "received_amount": received_amount,
+            "received_count": received_count,
+        }
+        for (account_id, day, shard), (sent_amount, sent_count, received_amount, received_count)
+        in sorted(totals.items())
+    ])
+
+    await db.execute(
+        rows.on_conflict_do_update(
+            index_elements=[
+                models.DailyAccountTotal.account_id,
+                models.DailyAccountTotal.day,
+                models.DailyAccountTotal.shard,
+            ],
+            set_={
+                name: getattr(models.DailyAccountTotal, name) + getattr(rows.excluded, name)
+                for name in ("sent_amount", "sent_count", "received_amount", "received_count")
+            }))
+
+@timed(DB_QUERY_LATENCY)
+async def get_idempotency_key(
+        db: AsyncSession,
+        uid: int,
+        key: str) -> Row | None:
+    """Действующий ключ идемпотентности вместе с его транзакцией"""
+
+    logger.debug("get_idempotency_key: %s, %s", uid, key)
+
+    result = await db.execute(
+        select(models.IdempotencyKey, models.Transaction)
+        # Транзакция вставлена в той же транзакции БД, что и ключ, то есть не
+        # раньше created_at: условие отсекает партиции прошлых месяцев
+        .join(models.Transaction, and_(
+            models.IdempotencyKey.transaction_id == models.Transaction.id,
+            models.Transaction.timestamp >= models.IdempotencyKey.created_at))
+        .where(
+            models.IdempotencyKey.uid == uid,
+            models.IdempotencyKey.key == key,
+            models.IdempotencyKey.expires_at > func.now()))
+
+    return result.first()
+
+@timed(DB_QUERY_LATENCY)
+async def _claim_idempotency_key(
+        db: AsyncSession,
+        uid: int,
+        key: str,
+        request_hash: str) -> None:
+    """Занимает ключ в текущей транзакции БД
+
+    Параллельный запрос с тем же ключом ждет на уникальном индексе, пока
+    первый не завершится, и после его COMMIT получает IdempotencyKeyInUse.
+    Истекший, но еще не удаленный ключ занимается заново.
+    """
+
+    claim = insert(models.IdempotencyKey).values(
+        uid=uid,
+        key=key,
+        request_hash=request_hash,
+        expires_at=func.now() + timedelta(seconds=IDEMPOTENCY_KEY_TTL))
+
+    claimed = await db.scalar(
+        claim.on_conflict_do_update(
+            index_elements=[models.IdempotencyKey.uid, models.IdempotencyKey.key],
+            set_={
+                "request_hash": claim.excluded.request_hash,
+                "transaction_id": None,
+                "created_at": func.now(),
+                "expires_at": claim.excluded.expires_at,
+            },
+            where=models.IdempotencyKey.expires_at <= func.now(),
+        ).returning(models.IdempotencyKey.key))
+
+    if claimed is None:
+        raise IdempotencyKeyInUse(key)
+
+@timed(DB_TRANSACTION_LATENCY)
+async def transfer(
+        db: AsyncSession,
+        sender: schemas.AccountCreate,
+        receiver: schemas.AccountCreate,
+        amount: float,
+        idempotency_key: str | None = None,
+        request_hash: str | None = None) -> models.Transaction:
+    """Проводит перевод в одной транзакции БД
+
+    1. Недостающие аккаунты создаются через INSERT ... ON CONFLICT DO NOTHING.
+    2. Аккаунты блокируются в порядке id, чтобы встречные переводы не приводили
+       к взаимоблокировкам. "Горячий" получатель не блокируется: зачисление
+       идет в одну из его частей (account_shards).
+    3. Списание выполняется условным UPDATE ... WHERE balance >= amount,
+       поэтому баланс не может уйти в минус даже при нескольких воркерах.
+       Если основной строки не хватает, в нее сворачиваются части баланса.
+    4. Зачисление и запись транзакции выполняются отдельными выражениями
+       с RETURNING, без повторного чтения объектов.
+
+    С idempotency_key ключ занимается первым выражением и связывается
+    с транзакцией перед COMMIT; если ключ уже занят, то IdempotencyKeyInUse.
+    """
+
+    logger.debug("transfer: %s -> %s, %s", sender, receiver, amount)
+
+    try:
+        if idempotency_key is not None:
+            await _claim_idempotency_key(db, sender.uid, idempotency_key, request_hash)
+
+        accounts = {account.uid: account for account in (sender, receiver)}
+
+        # Строки вставляются в порядке uid: встречные первые переводы A -> B и
+        # B -> A ждут друг друга на уникальных индексах в одном порядке, без deadlock
+        await db.execute(
+            insert(models.Account).values([
+                {"uid": account.uid, "username": account.username, "balance": DEFAULT_BALANCE}
+                for account in sorted(accounts.values(), key=lambda account: account.uid)
+            ]).on_conflict_do_nothing())
+
+        account_query = select(
+            models.Account.uid,
+            models.Account.id,
+            models.Account.shard_count)
+
+        # FOR NO KEY UPDATE не конфликтует с блокировками, которые берут
+        # проверки внешних ключей при вставке в transactions и account_shards
+        locked = await db.execute(
+            account_query
+            .where(
+                models.Account.uid.in_(accounts),
+                or_(models.Account.uid == sender.uid, models.Account.shard_count <= 1))
+            .order_by(models.Account.id)
+            .with_for_update(key_share=True))
+
+        rows = {row.uid: row for row in locked.all()}
+
+        if receiver.uid not in rows:
+            hot = await db.execute(account_query.where(models.Account.uid == receiver.uid))
+            rows.update({row.uid: row for row in hot.all()})
+
+        if len(rows) != len(accounts):
+            raise ValueError("Аккаунт не найден")
+
+        sender_row, receiver_row = rows[sender.uid], rows[receiver.uid]
+
+        sender_balance = await _debit(db, sender_row.id, amount)
+
+        if sender_balance is None and await _fold_shards(db, sender_row.id):
+            sender_balance = await _debit(db, sender_row.id, amount)
+
+        if sender_balance is None:
+            logger.warning("Недостаточно средств у пользователя %s", sender.username)
+
+            raise ValueError("Недостаточно средств")
+
+        receiver_balance = await _credit(db, receiver_row.id, receiver_row.shard_count, amount)
+
+        # Перевод самому себе: итоговый баланс тот же, что и до перевода
+        if sender_row.id == receiver_row.id:
+            sender_balance = receiver_balance
+        elif sender_row.shard_count > 1:
+            sender_balance = None
+
+        transaction = await db.scalar(
+            insert(models.Transaction)
+            .values(
+                sender_id=sender_row.id,
+                receiver_id=receiver_row.id,
+                amount=amount,
+                sender_balance_after=sender_balance,
+                receiver_balance_after=receiver_balance)
+            .returning(models.Transaction))
+
+        await _add_daily_totals(db, [transaction], {receiver_row.id: receiver_row.shard_count})
+
+        if idempotency_key is not None:
+            await db.execute(
+                update(models.IdempotencyKey)
+                .where(
+                    models.IdempotencyKey.uid == sender.uid,
+                    models.IdempotencyKey.key == idempotency_key)
+                .values(transaction_id=transaction.id))
+
+        await db.commit()
+
+    except BaseException:
+        await db.rollback()
+
+        raise
 
     return transaction
 
+@timed(DB_QUERY_LATENCY)
+async def _credit_many(db: AsyncSession, credits: list[tuple[int, int, float]]) -> None:
+    """Зачисления по нескольким аккаунтам: (account_id, shard_count, amount)
+
+    Обычные аккаунты обновляются одним UPDATE ... FROM (VALUES ...), части
+    "горячих" аккаунтов одним многострочным INSERT ... ON CONFLICT.
+    """
+
+    plain: dict[int, float] = defaultdict(float)
+    shards: dict[tuple[int, int], float] = defaultdict(float)
+
+    for account_id, shard_count, amount in credits:
+        if shard_count <= 1:
+            plain[account_id] += amount
+        else:
+            shards[account_id, random.randrange(shard_count)] += amount
+
+    if plain:
+        amounts = values(
+            column("id", Integer),
+            column("amount", Float),
+            name="credits",
+        ).data(list(plain.items()))
+
+        await db.execute(
+            update(models.Account)
+            .where(models.Account.id == amounts.c.id)
+            .values(balance=models.Account.balance + amounts.c.amount)
+            .execution_options(synchronize_session=False))
+
+    if shards:
+        # В одном INSERT ... ON CONFLICT строка не может обновляться дважды,
+        # поэтому суммы по одной части уже сложены выше. Строки идут в порядке
+        # ключа, чтобы параллельные пачки блокировали их в одном порядке
+        shard = insert(models.AccountShard).values([
+            {"account_id": account_id, "shard": index, "balance": amount}
+            for (account_id, index), amount in sorted(shards.items())
+        ])
+
+        await db.execute(
+            shard.on_conflict_do_update(
+                index_elements=[models.AccountShard.account_id, models.AccountShard.shard],
+                set_={"balance": models.AccountShard.balance + shard.excluded.balance}))
+
+@timed(DB_TRANSACTION_LATENCY)
+async def transfer_batch(
+        db: AsyncSession,
+        sender: schemas.AccountCreate,
+        items: list[tuple[schemas.AccountCreate, float]],
+        atomic: bool = True) -> list[models.Transaction | None]:
+    """Проводит пачку переводов одного отправителя в одной транзакции БД
+
+    Аккаунты создаются и блокируются одним запросом каждый (в порядке id),
+    списание выполняется одним UPDATE на общую сумму, а транзакции
+    записываются одним многострочным INSERT.
+
+    atomic=True: при нехватке средств не проводится ни один перевод
+    (ValueError). atomic=False: переводы проводятся по порядку, пока хватает
+    средств; для отклоненных в результате стоит None.
+    """
+
+    logger.debug("transfer_batch: %s, %d переводов, atomic=%s", sender, len(items), atomic)
+
+    try:
+        accounts = {sender.uid: sender}
+        accounts.update({receiver.uid: receiver for receiver, _amount in items})
+
+        # Строки вставляются в порядке uid: встречные первые переводы A -> B и
+        # B -> A ждут друг друга на уникальных индексах в одном порядке, без deadlock
+        await db.execute(
+            insert(models.Account).values([
+                {"uid": account.uid, "username": account.username, "balance": DEFAULT_BALANCE}
+                for account in sorted(accounts.values(), key=lambda account: account.uid)
+            ]).on_conflict_do_nothing())
+
+        account_query = select(
+            models.Account.uid,
+            models.Account.id,
+            models.Account.shard_count,
+            models.Account.balance)
+
+        locked = await db.execute(
+            account_query
+            .where(
+                models.Account.uid.in_(accounts),
+                or_(models.Account.uid == sender.uid, models.Account.shard_count <= 1))
+            .order_by(models.Account.id)
+            .with_for_update(key_share=True))
+
+        rows = {row.uid: row for row in locked.all()}
+
+        hot_uids = [uid for uid in accounts if uid not in rows]
+
+        if hot_uids:
+            hot = await db.execute(account_query.where(models.Account.uid.in_(hot_uids)))
+            rows.update({row.uid: row for row in hot.all()})
+
+        if len(rows) != len(accounts):
+            raise ValueError("Аккаунт не найден")
+
+        sender_row = rows[sender.uid]
+        balance = sender_row.balance
+
+        # Части баланса сворачиваются, только если основной строки не хватает
+        if balance < sum(amount for _receiver, amount in items):
+            balance += await _fold_shards(db, sender_row.id)
+
+        opening_balance = balance
+        accepted: list[bool] = []
+
+        for _receiver, amount in items:
+            accepted.append(balance >= amount)
+
+            if accepted[-1]:
+                balance -= amount
+
+        if atomic and not all(accepted):
+            logger.warning("Недостаточно средств у пользователя %s", sender.username)
+
+            raise ValueError("Недостаточно средств")
+
+        approved = [item for item, ok in zip(items, accepted) if ok]
+        transactions: list[models.Transaction] = []
+
+        if approved:
+            total = sum(amount for _receiver, amount in approved)
+
+            # Строка отправителя заблокирована, условие лишь страхует от ухода в минус
+            if await _debit(db, sender_row.id, total) is None:
+                raise ValueError("Недостаточно средств")
+
+            await _credit_many(db, [
+                (rows[receiver.uid].id, rows[receiver.uid].shard_count, amount)
+                for receiver, amount in approved
+            ])
+
+            # Балансы после каждого перевода считаются по порядку пачки от
+            # заблокированных значений; у "горячих" аккаунтов их нет
+            balances = {row.id: row.balance for row in rows.values() if row.shard_count <= 1}
+
+            if sender_row.id in balances:
+                balances[sender_row.id] = opening_balance
+
+            ledger = []
+
+            for receiver, amount in approved:
+                receiver_id = rows[receiver.uid].id
+
+                if sender_row.id in balances:
+                    balances[sender_row.id] -= amount
+
+                if receiver_id in balances:
+                    balances[receiver_id] += amount
+
+                ledger.append({
+                    "sender_id": sender_row.id,
+                    "receiver_id": receiver_id,
+                    "amount": amount,
+                    "sender_balance_after": balances.get(sender_row.id),
+                    "receiver_balance_after": balances.get(receiver_id),
+                })
+
+            created = await db.scalars(
+                insert(models.Transaction).returning(
+                    models.Transaction,
+                    sort_by_parameter_order=True),
+                ledger)
+
+            transactions = created.all()
+
+            await _add_daily_totals(db, transactions, {row.id: row.shard_count for row in rows.values()})
+
+        await db.commit()
+
+    except BaseException:
+        await db.rollback()
+
+        raise
+
+    created_iter = iter(transactions)
+
+    return [next(created_iter) if ok else None for ok in accepted]
+
+def _current_balance(account_id: int) -> ScalarSelect:
+    """Подзапрос текущего баланса аккаунта (NULL, если аккаунта нет)"""
+
+    shards = select(func.coalesce(func.sum(models.AccountShard.balance), 0.0)).where(
+        models.AccountShard.account_id == account_id).scalar_subquery()
+
+    return select(models.Account.balance + shards).where(
+        models.Account.id == account_id).scalar_subquery()
+
+@timed(DB_QUERY_LATENCY)
+async def get_account_balance(db: AsyncSession, account_id: int) -> float | None:
+    """Текущий баланс аккаунта с учетом частей "горячего" аккаунта"""
+
+    logger.debug("get_account_balance: %s", account_id)
+
+    return await db.scalar(select(_current_balance(account_id)))
+
+@timed(DB_QUERY_LATENCY)
+async def get_transactions_summary(
+        db: AsyncSession,
+        account_id: int,
+        date_from: date,
+        date_to: date,
+        granularity: str = "day") -> Sequence[Row]:
+    """Итоги переводов аккаунта по дням, неделям или месяцам за [date_from, date_to]
+
+    Читаются только дневные итоги, поэтому стоимость запроса зависит от
+    числа дней в периоде, а не от числа транзакций.
+    """
+
+    logger.debug("get_transactions_summary: account_id=%s, from=%s, to=%s, granularity=%s",
+                 account_id, date_from, date_to, granularity)
+
+    totals = models.DailyAccountTotal
+    # Одно и то же выражение в SELECT и GROUP BY: единица усечения подставляется
+    # в текст запроса, а не параметром, иначе Postgres сочтет выражения разными
+    unit = bindparam("granularity", granularity, literal_execute=True)
+    period = cast(func.date_trunc(unit, totals.day), Date).label("period")
+
+    result = await db.execute(
+        select(
+            period,
+            func.sum(totals.sent_amount).label("sent_amount"),
+            func.sum(totals.sent_count).label("sent_count"),
+            func.sum(totals.received_amount).label("received_amount"),
+            func.sum(totals.received_count).label("received_count"))
+        .where(
+            totals.account_id == account_id,
+            totals.day >= date_from,
+            totals.day <= date_to)
+        .group_by(period)
+        .order_by(period))
+
+    return result.all()
+
+def _net_flow(account_id: int, *conditions) -> ScalarSelect:
+    """Подзапрос: зачисления минус списания аккаунта по переводам, подходящим под conditions
+
+    Переводы самому себе баланс не меняют и не учитываются.
+    """
+
+    def branch(sign: int, *side) -> Select:
+        return select((sign * models.Transaction.amount).label("flow")).where(*side, *conditions)
+
+    flows = union_all(
+        branch(-1,
+               models.Transaction.sender_id == account_id,
+               models.Transaction.receiver_id != account_id),
+        branch(1,
+               models.Transaction.receiver_id == account_id,
+               models.Transaction.sender_id != account_id),
+    ).subquery()
+
+    return select(func.coalesce(func.sum(flows.c.flow), 0.0)).scalar_subquery()
+
+@timed(DB_QUERY_LATENCY)
+async def get_balance_at(db: AsyncSession, account_id: int, at: datetime) -> float | None:
+    """Баланс аккаунта с учетом переводов не позже at
+
+    Берется последний снимок sender_balance_after / receiver_balance_after
+    не позже at (по одному поиску в индексах истории), к нему добавляются
+    переводы без снимка между ним и at, которые бывают только у "горячих"
+    аккаунтов. Если снимка нет, баланс восстанавливается от текущего.
+    """
+
+    logger.debug("get_balance_at: %s, %s", account_id, at)
+
+    def branch(balance_after, *conditions) -> Select:
+        return (
+            select(
+                models.Transaction.timestamp,
+                models.Transaction.id,
+                balance_after.label("balance"))
+            .where(*conditions, models.Transaction.timestamp <= at, balance_after.is_not(None))
+            .order_by(models.Transaction.timestamp.desc(), models.Transaction.id.desc())
+            .limit(1))
+
+    snapshots = union_all(
+        branch(models.Transaction.sender_balance_after,
+               models.Transaction.sender_id == account_id),
+        branch(models.Transaction.receiver_balance_after,
+               models.Transaction.receiver_id == account_id,
+               models.Transaction.sender_id != account_id),
+    ).subquery()
+
+    snapshot = (await db.execute(
+        select(snapshots)
+        .order_by(snapshots.c.timestamp.desc(), snapshots.c.id.desc())
+        .limit(1))).first()
+
+    if snapshot is None:
+        # Текущий баланс и переводы после at читаются одним запросом (одним
+        # снимком данных): перевод, зафиксированный между двумя отдельными
+        # запросами, учитывался бы только в одном из них
+        return await db.scalar(select(
+            _current_balance(account_id) - _net_flow(account_id, models.Transaction.timestamp > at)))
+
+    return snapshot.balance + await db.scalar(select(_net_flow(
+        account_id,
+        models.Transaction.timestamp >= snapshot.timestamp,
+        tuple_(models.Transaction.timestamp, models.Transaction.id) > tuple_(snapshot.timestamp, snapshot.id),
+        models.Transaction.timestamp <= at)))
+
+@timed(DB_QUERY_LATENCY)
+async def get_statement_transactions(
+        db: AsyncSession,
+        account_id: int,
+        date_from: datetime,
+        date_to: datetime,
+        limit: int = DEFAULT_TRANSACTION_LIMIT) -> list[models.Transaction]:
+    """Транзакции аккаунта с date_from < timestamp <= date_to от старых к новым"""
+
+    logger.debug("get_statement_transactions: account_id=%s, from=%s, to=%s, limit=%s",
+                 account_id, date_from, date_to, limit)
+
+    def branch(*conditions) -> Select:
+        return (
+            select(models.Transaction)
+            .where(
+                *conditions,
+                models.Transaction.timestamp > date_from,
+                models.Transaction.timestamp <= date_to)
+            .order_by(models.Transaction.timestamp, models.Transaction.id)
+            .limit(limit))
+
+    transaction = aliased(models.Transaction, union_all(
+        branch(models.Transaction.sender_id == account_id),
+        branch(
+            models.Transaction.receiver_id == account_id,
+            models.Transaction.sender_id != account_id),
+    ).subquery())
+
+    result = await db.execute(
+        select(transaction).order_by(transaction.timestamp, transaction.id).limit(limit))
+
+    return result.scalars().all()
+
+@timed(DB_TRANSACTION_LATENCY)
+async def set_shard_count(db: AsyncSession, username: str, shard_count: int) -> models.Account | None:
+    """Включает (shard_count > 1) или выключает (shard_count = 1) режим "горячего" аккаунта"""
+
+    logger.debug("set_shard_count: %s, %s", username, shard_count)
+
+    try:
+        account = await db.scalar(
+            select(models.Account)
+            .where(models.Account.username == username)
+            .with_for_update(key_share=True))
+
+        if account is None:
+            return None
+
+        account.shard_count = shard_count
+
+        if shard_count <= 1:
+            await _fold_shards(db, account.id)
+
+        await db.commit()
+
+    except BaseException:
+        await db.rollback()
+
+        raise
+
+    return account
+
+@timed(DB_TRANSACTION_LATENCY)
+async def compact_shards(db: AsyncSession) -> int:
+    """Сворачивает части балансов всех аккаунтов в основные строки
+
+    Каждый аккаунт сворачивается в своей транзакции, чтобы блокировки
+    держались как можно меньше. Возвращает число обработанных аккаунтов.
+    """
+
+    logger.debug("compact_shards")
+
+    account_ids = (await db.scalars(
+        select(models.AccountShard.account_id).distinct())).all()
+
+    for account_id in account_ids:
+        try:
+            await db.execute(
+                select(models.Account.id)
+                .where(models.Account.id == account_id)
+                .with_for_update(key_share=True))
+
+            await _fold_shards(db, account_id)
+
+            await db.commit()
+
+        except BaseException:
+            await db.rollback()
+
+            raise
+
+    return len(account_ids)
+
+@timed(DB_QUERY_LATENCY)
+async def delete_expired_idempotency_keys(db: AsyncSession) -> int:
+    """Удаляет истекшие ключи идемпотентности пачками по IDEMPOTENCY_CLEANUP_BATCH_SIZE
+
+    Каждая пачка удаляется в своей транзакции, чтобы не держать долгих
+    блокировок. Возвращает число удаленных ключей.
+    """
+
+    logger.debug("delete_expired_idempotency_keys")
+
+    expired = (
+        select(models.IdempotencyKey.uid, models.IdempotencyKey.key)
+        .where(models.IdempotencyKey.expires_at <= func.now())
+        .limit(IDEMPOTENCY_CLEANUP_BATCH_SIZE))
+
+    deleted = 0
+
+    while True:
+        try:
+            result = await db.execute(
+                delete(models.IdempotencyKey)
+                .where(tuple_(models.IdempotencyKey.uid, models.IdempotencyKey.key).in_(expired)))
+
+            await db.commit()
+
+        except BaseException:
+            await db.rollback()
+
+            raise
+
+        deleted += result.rowcount
+
+        if result.rowcount < IDEMPOTENCY_CLEANUP_BATCH_SIZE:
+            return deleted
+
+def _history(
+        account_id: int,
+        branch_limit: int | None,
+        before: tuple[datetime, int] | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None) -> type[models.Transaction]:
+    """История как UNION двух веток, каждая из которых идет по своему индексу
+
+    Условие sender_id = X OR receiver_id = X не позволяет использовать индекс
+    для сортировки, поэтому отправленные и полученные транзакции выбираются
+    отдельно по индексам (sender_id|receiver_id, timestamp DESC, id DESC).
+
+    Границы по timestamp (date_from, date_to и время из before) позволяют
+    планировщику не читать месячные партиции вне периода.
+    """
+
+    def branch(*conditions) -> Select:
+        query = select(models.Transaction).where(*conditions)
+
+        if before is not None:
+            # Сравнение кортежей партиции не отсекает, поэтому граница по
+            # timestamp дублируется отдельным условием
+            query = query.where(
+                models.Transaction.timestamp <= before[0],
+                tuple_(models.Transaction.timestamp, models.Transaction.id) < tuple_(*before))
+
+        if date_from is not None:
+            query = query.where(models.Transaction.timestamp >= date_from)
+
+        if date_to is not None:
+            query = query.where(models.Transaction.timestamp <= date_to)
+
+        return query.order_by(
+            models.Transaction.timestamp.desc(),
+            models.Transaction.id.desc()).limit(branch_limit)
+
+    history = union_all(
+        branch(models.Transaction.sender_id == account_id),
+        # Перевод самому себе уже попал в первую ветку
+        branch(
+            models.Transaction.receiver_id == account_id,
+            models.Transaction.sender_id != account_id),
+    ).subquery()
+
+    return aliased(models.Transaction, history)
+
+def _newest_first(transaction: type[models.Transaction]) -> tuple:
+    """Порядок выдачи истории: от новых транзакций к старым"""
+
+    return transaction.timestamp.desc(), transaction.id.desc()
+
+@timed(DB_QUERY_LATENCY)
 async def get_user_transactions(
         db: AsyncSession,
         account_id: int,
         skip: int = 0,
-        limit: int = DEFAULT_TRANSACTION_LIMIT) -> list[models.Transaction]:
-    """Возвращает транзакции пользователя"""
+        limit: int = DEFAULT_TRANSACTION_LIMIT,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None) -> list[models.Transaction]:
+    """Возвращает транзакции пользователя (с date_from <= timestamp <= date_to)"""
+
+    logger.debug("get_user_transactions: account_id=%s, skip=%s, limit=%s, from=%s, to=%s",
+                 account_id, skip, limit, date_from, date_to)
 
-    logger.debug("get_user_transactions: account_id=%s, skip=%s, limit=%s",
-                 account_id, skip, limit)
+    transaction = _history(
+        account_id,
+        branch_limit=skip + limit,
+        date_from=date_from,
+        date_to=date_to)
 
     result = await db.execute(
-        select(models.Transaction).where(
-            (models.Transaction.sender_id == account_id) | (models.Transaction.receiver_id == account_id)
-        ).order_by(models.Transaction.timestamp.desc()).offset(skip).limit(limit)
-    )
+        select(transaction).order_by(*_newest_first(transaction)).offset(skip).limit(limit))
 
     return result.scalars().all()
+
+@timed(DB_QUERY_LATENCY)
+async def get_user_transactions_page(
+        db: AsyncSession,
+        account_id: int,
+        before: tuple[datetime, int] | None = None,
+        limit: int = DEFAULT_TRANSACTION_LIMIT,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None) -> list[models.Transaction]:
+    """Возвращает страницу транзакций пользователя, старше (timestamp, id) из before"""
+
+    logger.debug("get_user_transactions_page: account_id=%s, before=%s, limit=%s, from=%s, to=%s",
+                 account_id, before, limit, date_from, date_to)
+
+    transaction = _history(
+        account_id,
+        branch_limit=limit,
+        before=before,
+        date_from=date_from,
+        date_to=date_to)
+
+    result = await db.execute(
+        select(transaction).order_by(*_newest_first(transaction)).limit(limit))
+
+    return result.scalars().all()
+
+async def stream_user_transactions(
+        db: AsyncSession,
+        account_id: int,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None) -> AsyncIterator[Sequence[Row]]:
+    """Отдает историю пользователя пачками по EXPORT_BATCH_SIZE строк
+
+    Строки читаются через серверный курсор, поэтому в памяти одновременно
+    находится не больше одной пачки, а не вся история.
+    """
+
+    logger.debug("stream_user_transactions: account_id=%s, from=%s, to=%s",
+                 account_id, date_from, date_to)
+
+    transaction = _history(account_id, branch_limit=None, date_from=date_from, date_to=date_to)
+
+    query = select(
+        transaction.id,
+        transaction.sender_id,
+        transaction.receiver_id,
+        transaction.amount,
+        transaction.timestamp,
+    ).order_by(*_newest_first(transaction)).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    result = await db.stream(query)
+
+    async for partition in result.partitions():
+        yield partition
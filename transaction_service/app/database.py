@@ -1,21 +1,266 @@
 # transaction_service/app/database.py
 
+import asyncio
+import time
 from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from .env import DATABASE_URL
+from .env import (
+    DATABASE_URL,
+    REPLICA_DATABASE_URL,
+    REPLICA_MAX_LAG,
+    REPLICA_CHECK_INTERVAL,
+    REPLICA_CHECK_TIMEOUT,
+    DB_ECHO,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_CACHE_SIZE)
 from .logger import logger
 
-logger.debug("Create async engine by URL: %s", DATABASE_URL)
 
-async_engine = create_async_engine(DATABASE_URL, echo=True)
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул соединений, который считает время получения соединения и таймауты"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def connect(self):
+        # Свободных соединений нет: придется ждать возврата или открывать новое
+        waited = self.checkedin() == 0
+        start = time.perf_counter()
+
+        try:
+            return super().connect()
+
+        except exc.TimeoutError:
+            self.timeouts += 1
+
+            raise
+
+        finally:
+            elapsed = time.perf_counter() - start
+
+            self.checkouts += 1
+            self.waits += waited
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def stats(self) -> dict:
+        """Текущее состояние пула и накопленные счетчики"""
+
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_time_total": round(self.wait_time, 6),
+            "wait_time_max": round(self.max_wait_time, 6),
+            "timeouts": self.timeouts,
+        }
+
+def _connect_args(url: str) -> dict:
+    """Параметры подключения драйвера"""
+
+    if make_url(url).get_driver_name() != "asyncpg":
+        return {}
+
+    # prepared_statement_cache_size — кеш подготовленных запросов SQLAlchemy,
+    # statement_cache_size — собственный кеш asyncpg. 0 отключает оба (нужно за pgbouncer)
+    return {
+        "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+    }
+
+def _create_engine(url: str) -> AsyncEngine:
+    """Движок с общими настройками пула"""
+
+    logger.debug("Create async engine by URL: %s", url)
+
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=_connect_args(url))
+
+async_engine = _create_engine(DATABASE_URL)
 
 AsyncSessionLocal = sessionmaker(
     async_engine, expire_on_commit=False, class_=AsyncSession
 )
 
+replica_engine = _create_engine(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else None
+
+ReplicaSessionLocal = sessionmaker(
+    replica_engine, expire_on_commit=False, class_=AsyncSession
+) if replica_engine is not None else None
+
+# Отставание реплики в секундах. Если все полученные WAL применены и реплика
+# получает их от основной базы, отставания нет (время последней примененной
+# транзакции при простое основной базы растет без реального отставания).
+# NULL — отставание неизвестно (реплика отключена от основной базы и еще
+# ничего не применила). Не реплика (pg_is_in_recovery() = false) отстает на 0
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+class ReplicaMonitor:
+    """Следит за доступностью и отставанием реплики
+
+    Чтения направляются в реплику, только пока последняя проверка прошла
+    успешно и отставание не больше REPLICA_MAX_LAG.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
+        self.available = False
+        self.lag: float | None = None
+
+        self.checks = 0
+        self.failures = 0
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    @property
+    def healthy(self) -> bool:
+        """Можно ли сейчас читать из реплики"""
+
+        return self.available and self.lag is not None and self.lag <= REPLICA_MAX_LAG
+
+    async def measure_lag(self) -> float | None:
+        """Отставание реплики в секундах (None — неизвестно)"""
+
+        async with self.engine.connect() as connection:
+            lag = (await connection.execute(REPLICA_LAG_QUERY)).scalar()
+
+        return float(lag) if lag is not None else None
+
+    async def check(self) -> None:
+        """Измеряет отставание реплики и решает, куда направлять чтения"""
+
+        was_healthy = self.healthy
+        self.checks += 1
+
+        try:
+            async with asyncio.timeout(REPLICA_CHECK_TIMEOUT):
+                lag = await self.measure_lag()
+
+        except (OSError, TimeoutError, exc.SQLAlchemyError) as e:
+            self.failures += 1
+            self.mark_unavailable(e)
+
+            return
+
+        self.available = True
+        self.lag = lag
+
+        if was_healthy and not self.healthy:
+            logger.warning("Реплика отстает на %s с, чтения идут в основную базу", self.lag)
+        elif not was_healthy and self.healthy:
+            logger.info("Чтения идут в реплику (отставание %.3f с)", self.lag)
+
+    def mark_unavailable(self, error: Exception) -> None:
+        """Переключает чтения на основную базу до следующей успешной проверки"""
+
+        if self.available:
+            logger.warning("Реплика недоступна, чтения идут в основную базу: %s", error)
+
+        self.available = False
+        self.lag = None
+
+    async def run_check_loop(self) -> None:
+        """Периодически проверяет реплику"""
+
+        while True:
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+            await self.check()
+
+    def stats(self) -> dict:
+        """Состояние реплики и число чтений из реплики и из основной базы"""
+
+        return {
+            "available": int(self.available),
+            "healthy": int(self.healthy),
+            "lag": self.lag,
+            "checks": self.checks,
+            "failures": self.failures,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "pool": self.engine.pool.stats(),
+        }
+
+replica_monitor = ReplicaMonitor(replica_engine) if replica_engine is not None else None
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """Генератор сессии для зависимостей"""
     async with AsyncSessionLocal() as session:
         yield session
+
+def read_session() -> AsyncSession:
+    """Сессия для чтений, допускающих отставание: реплика, если она в порядке, иначе основная база"""
+
+    if replica_monitor is None:
+        return AsyncSessionLocal()
+
+    if not replica_monitor.healthy:
+        replica_monitor.primary_reads += 1
+
+        return AsyncSessionLocal()
+
+    replica_monitor.replica_reads += 1
+
+    return ReplicaSessionLocal()
+
+def is_replica(session: AsyncSession) -> bool:
+    """Читает ли сессия из реплики"""
+
+    return replica_engine is not None and session.bind is replica_engine
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """Генератор сессии для зависимостей эндпоинтов чтения истории
+
+    Если запрос к реплике упал из-за соединения, следующие запросы идут в
+    основную базу, не дожидаясь проверки отставания.
+    """
+    async with read_session() as session:
+        try:
+            yield session
+        except (OSError, exc.DBAPIError) as e:
+            disconnected = isinstance(e, OSError) or e.connection_invalidated
+
+            if disconnected and is_replica(session):
+                replica_monitor.mark_unavailable(e)
+
+            raise
+
+def pool_stats() -> dict:
+    """Счетчики пула соединений с базой"""
+
+    return async_engine.pool.stats()
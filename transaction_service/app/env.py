@@ -10,13 +10,97 @@ load_dotenv(dotenv_path=env_path)
 # Переменные окружения
 LOGS_DIR = os.getenv("LOGS_DIR", "/app/logs")
 DATABASE_URL = os.getenv("TRANS_DATABASE_URL")
+# Реплика для чтения истории (не задана — все запросы идут в основную базу)
+REPLICA_DATABASE_URL = os.getenv("TRANS_REPLICA_DATABASE_URL", "")
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL")
 
 IS_DEBUG = os.getenv("IS_DEBUG", "0").lower() in ["true", "1"]
 
+# Пул соединений с базой: размер, сколько соединений открывать сверх него,
+# сколько секунд ждать свободного соединения и через сколько секунд
+# переоткрывать соединение (-1 — никогда)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Проверять соединение запросом перед выдачей из пула (лишний round trip)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0").lower() in ["true", "1"]
+# Размер кеша подготовленных запросов на соединение (0 — для pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Писать в лог все SQL запросы
+DB_ECHO = os.getenv("DB_ECHO", "0").lower() in ["true", "1"]
+
+# Реплика: максимальное отставание (в секундах), после которого чтения идут
+# в основную базу, как часто проверять отставание и таймаут проверки
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+REPLICA_CHECK_TIMEOUT = float(os.getenv("REPLICA_CHECK_TIMEOUT", "1"))
+
+# Логи: формат ("text" или "json"), ротация ("size", "time" или "none"),
+# размер очереди записей и сколько записей INFO/DEBUG в секунду пропускать
+# для каждого шаблона сообщения (0 отключает ограничение)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0"))
+
+# Пул соединений HTTP клиента к Auth сервису
+AUTH_HTTP_MAX_CONNECTIONS = int(os.getenv("AUTH_HTTP_MAX_CONNECTIONS", "100"))
+AUTH_HTTP_MAX_KEEPALIVE = int(os.getenv("AUTH_HTTP_MAX_KEEPALIVE", "20"))
+AUTH_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AUTH_HTTP_KEEPALIVE_EXPIRY", "30"))
+AUTH_HTTP2 = os.getenv("AUTH_HTTP2", "0").lower() in ["true", "1"]
+AUTH_HTTP_CONNECT_TIMEOUT = float(os.getenv("AUTH_HTTP_CONNECT_TIMEOUT", "2"))
+AUTH_HTTP_READ_TIMEOUT = float(os.getenv("AUTH_HTTP_READ_TIMEOUT", "5"))
+
+# Проверка токенов: "remote" (через /verify) или "local" (по JWKS Auth сервиса)
+JWT_VERIFICATION = os.getenv("JWT_VERIFICATION", "remote").lower()
+JWT_ALGORITHMS = os.getenv("JWT_ALGORITHMS", "RS256").split(",")
+JWKS_URL = os.getenv("JWKS_URL", f"{AUTH_SERVICE_URL}/.well-known/jwks.json")
+JWKS_REFRESH_INTERVAL = float(os.getenv("JWKS_REFRESH_INTERVAL", "300"))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "10"))
+
+# Кеш результатов /verify при удаленной проверке токенов (0 отключает кеш)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_NEGATIVE_CACHE_TTL = float(os.getenv("TOKEN_NEGATIVE_CACHE_TTL", "10"))
+
+# Объединение запросов /check-users: окно сбора (мс) и максимальный размер пакета
+FETCH_USER_BATCH_WINDOW = float(os.getenv("FETCH_USER_BATCH_WINDOW_MS", "5")) / 1000
+FETCH_USER_BATCH_SIZE = int(os.getenv("FETCH_USER_BATCH_SIZE", "100"))
+
+# Кеш получателей переводов: найденные (username -> uid) и несуществующие
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))
+USER_NEGATIVE_CACHE_TTL = float(os.getenv("USER_NEGATIVE_CACHE_TTL", "30"))
+
+# Как часто (в секундах) сворачивать части балансов "горячих" аккаунтов (0 отключает)
+SHARD_COMPACTION_INTERVAL = float(os.getenv("SHARD_COMPACTION_INTERVAL", "60"))
+
+# Ключи идемпотентности /transfer: срок хранения, кеш повторов и период очистки (в секундах)
+IDEMPOTENCY_KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", "300"))
+IDEMPOTENCY_CLEANUP_INTERVAL = float(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL", "600"))
+
+# Партиции транзакций: на сколько месяцев вперед создавать и как часто проверять (в секундах)
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "3"))
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "86400"))
+
 # Проверка обязательных переменных
 if not DATABASE_URL:
     raise ValueError("TRANS_DATABASE_URL не установлена в переменных окружения")
 
 if not AUTH_SERVICE_URL:
     raise ValueError("AUTH_SERVICE_URL не установлена в переменных окружения")
+
+if JWT_VERIFICATION not in ["remote", "local"]:
+    raise ValueError("JWT_VERIFICATION должна быть 'remote' или 'local'")
+
+if LOG_FORMAT not in ["text", "json"]:
+    raise ValueError("LOG_FORMAT должна быть 'text' или 'json'")
+
+if LOG_ROTATION not in ["size", "time", "none"]:
+    raise ValueError("LOG_ROTATION должна быть 'size', 'time' или 'none'")
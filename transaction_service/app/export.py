@@ -0,0 +1,80 @@
+""" Модуль выгрузки истории транзакций в NDJSON и CSV """
+
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, Literal, Sequence
+
+from sqlalchemy import Row
+
+
+ExportFormat = Literal["ndjson", "csv"]
+
+FIELDS = ("id", "sender_id", "receiver_id", "amount", "timestamp")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+def _ndjson(rows: Sequence[Row]) -> bytes:
+    """Пачка строк в NDJSON"""
+
+    return "".join(
+        json.dumps({
+            "id": row.id,
+            "sender_id": row.sender_id,
+            "receiver_id": row.receiver_id,
+            "amount": row.amount,
+            "timestamp": row.timestamp.isoformat(),
+        }) + "\n"
+        for row in rows
+    ).encode()
+
+def _csv(rows: Sequence[Row], header: bool) -> bytes:
+    """Пачка строк в CSV"""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if header:
+        writer.writerow(FIELDS)
+
+    writer.writerows(
+        (row.id, row.sender_id, row.receiver_id, row.amount, row.timestamp.isoformat())
+        for row in rows)
+
+    return buffer.getvalue().encode()
+
+async def encode_transactions(
+        batches: AsyncIterator[Sequence[Row]],
+        export_format: ExportFormat,
+        compress: bool) -> AsyncIterator[bytes]:
+    """Кодирует пачки строк в выбранный формат, при необходимости сжимая gzip"""
+
+    # wbits=31: поток в формате gzip, а не «голый» zlib
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    first = True
+
+    async for rows in batches:
+        if export_format == "csv":
+            chunk = _csv(rows, header=first)
+        else:
+            chunk = _ndjson(rows)
+
+        first = False
+
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+
+        if chunk:
+            yield chunk
+
+    if export_format == "csv" and first:
+        chunk = _csv([], header=True)
+
+        yield compressor.compress(chunk) if compressor is not None else chunk
+
+    if compressor is not None:
+        yield compressor.flush()
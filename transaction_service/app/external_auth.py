@@ -1,68 +1,261 @@
 """ Модуль для работы с Auth сервисом """
 
+import hashlib
+import time
+
 import httpx
 
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
 
 from . import schemas
+from .batching import MicroBatcher
+from .cache import TTLCache, MISSING
+from .http_client import get_client
+from .jwks import jwks_cache
 from .logger import logger
-from .env import AUTH_SERVICE_URL
+from .metrics import JWT_LATENCY, OUTBOUND_LATENCY
+from .env import (
+    JWT_VERIFICATION,
+    JWT_ALGORITHMS,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+    TOKEN_NEGATIVE_CACHE_TTL,
+    FETCH_USER_BATCH_WINDOW,
+    FETCH_USER_BATCH_SIZE,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    USER_NEGATIVE_CACHE_TTL)
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-async def valid_token( token: str = Depends(oauth2_scheme)) -> schemas.User:
-    """Запрос к Auth сервису для верификации токена """
+jwt_decode_latency = JWT_LATENCY.labels("decode")
+verify_latency = OUTBOUND_LATENCY.labels("verify")
+check_users_latency = OUTBOUND_LATENCY.labels("check_users")
+
+# Результаты /verify по sha256 токена: schemas.User или None для отклоненных токенов
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+async def valid_token(token: str = Depends(oauth2_scheme)) -> schemas.User:
+    """Верификация токена локально или через Auth сервис """
 
     logger.debug("valid_token")
 
+    if JWT_VERIFICATION == "local":
+        return await verify_token_locally(token)
+
+    return await verify_token_remotely(token)
+
+async def verify_token_locally(token: str) -> schemas.User:
+    """Проверка подписи токена по публичным ключам Auth сервиса """
+
+    logger.debug("verify_token_locally")
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Невалидный токен",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    try:
+        header = jwt.get_unverified_header(token)
+
+        key = await jwks_cache.get_key(header.get("kid"))
+
+        if key is None:
+            logger.warning("Неизвестный kid токена: %s", header.get("kid"))
+
+            raise credentials_exception
+
+        with jwt_decode_latency.time():
+            payload = jwt.decode(token, key, algorithms=JWT_ALGORITHMS)
+
+        return schemas.User(uid=int(payload["sub"]), username=payload["username"])
+
+    except (JWTError, KeyError, ValueError) as e:
+        logger.warning("Ошибка проверки JWT: %s", e)
+
+        raise credentials_exception from e
+
+def _token_ttl(token: str) -> float:
+    """Сколько секунд осталось до истечения токена (exp) """
+
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        exp = None
+
+    if exp is None:
+        return TOKEN_CACHE_TTL
+
+    return float(exp) - time.time()
+
+def _user_not_found() -> HTTPException:
+    """Ошибка для пользователя, не найденного Auth сервисом """
+
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Пользователь не найден")
+
+def _auth_unavailable(error: httpx.HTTPError) -> HTTPException:
+    """Ошибка для недоступного Auth сервиса (таймаут, обрыв соединения, 5xx) """
+
+    logger.error("Auth сервис недоступен: %r", error)
+
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервис аутентификации недоступен")
+
+async def verify_token_remotely(token: str) -> schemas.User:
+    """Запрос к Auth сервису для верификации токена (с кешированием) """
+
+    logger.debug("verify_token_remotely")
+
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(cache_key)
+
+    if cached is None:
+        logger.debug("Токен отклонен ранее (из кеша)")
+
+        raise _user_not_found()
+
+    if cached is not MISSING:
+        return cached
+
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(f"{AUTH_SERVICE_URL}/verify", json={}, headers=headers)
-            response.raise_for_status()
+    try:
+        with verify_latency.time():
+            response = await get_client().post("/verify", json={}, headers=headers)
+        response.raise_for_status()
 
-            return schemas.User(
-                uid=response.json().get("id"),
-                username=response.json().get("username"))
+        user = schemas.User(
+            uid=response.json().get("id"),
+            username=response.json().get("username"))
 
-        except httpx.HTTPStatusError as e:
-            logger.warning("Не удалось войти по токену")
-            logger.warning("HTTPStatusError: %s", e)
+        token_cache.set(cache_key, user, ttl=_token_ttl(token))
 
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Пользователь не найден") from e
+        return user
 
+    except httpx.HTTPStatusError as e:
+        logger.warning("Не удалось войти по токену")
+        logger.warning("HTTPStatusError: %s", e)
 
-async def fetch_user(username: str) -> int:
-    """Запрос к Auth сервису для получения информации о пользователе """
+        if e.response.status_code == status.HTTP_401_UNAUTHORIZED:
+            token_cache.set(cache_key, None, ttl=TOKEN_NEGATIVE_CACHE_TTL)
 
-    logger.debug("fetch_user: %s", username)
+        raise _user_not_found() from e
+
+    except httpx.RequestError as e:
+        raise _auth_unavailable(e) from e
+
+async def _check_users(usernames: list[str]) -> dict[str, int]:
+    """Пакетный запрос к Auth сервису: username -> uid найденных пользователей """
+
+    logger.debug("_check_users: %d", len(usernames))
 
     headers = {
         "Content-Type": "application/json"
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{AUTH_SERVICE_URL}/check-user",
-                json={"username": username},
-                headers=headers)
+    with check_users_latency.time():
+        response = await get_client().post(
+            "/check-users",
+            json={"usernames": usernames},
+            headers=headers)
+
+    response.raise_for_status()
+
+    return {user["username"]: user["id"] for user in response.json()}
+
+# username -> uid: пользователи почти никогда не переименовываются и не удаляются
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# username, которых нет в Auth сервисе (значение не важно)
+missing_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_NEGATIVE_CACHE_TTL)
+
+user_batcher = MicroBatcher(
+    _check_users,
+    window=FETCH_USER_BATCH_WINDOW,
+    max_batch_size=FETCH_USER_BATCH_SIZE)
+
+async def fetch_user(username: str) -> int:
+    """Запрос к Auth сервису для получения информации о пользователе
+
+    Результаты кешируются, одновременные промахи объединяются в пакетные
+    вызовы /check-users.
+    """
+
+    logger.debug("fetch_user: %s", username)
+
+    uid = user_cache.get(username)
+
+    if uid is not MISSING:
+        return uid
+
+    if missing_user_cache.get(username) is not MISSING:
+        raise _user_not_found()
+
+    try:
+        uid = await user_batcher.load(username)
+    except httpx.HTTPError as e:
+        raise _auth_unavailable(e) from e
+
+    if uid is None:
+        logger.warning("Не удалось найти пользователя %s", username)
+
+        missing_user_cache.set(username, True)
+
+        raise _user_not_found()
+
+    user_cache.set(username, uid)
+
+    return uid
+
+async def fetch_users(usernames: list[str]) -> dict[str, int]:
+    """Проверка нескольких пользователей одним запросом /check-users
+
+    Возвращает username -> uid только для найденных пользователей.
+    """
+
+    logger.debug("fetch_users: %d", len(usernames))
+
+    found: dict[str, int] = {}
+    unknown: list[str] = []
+
+    for username in dict.fromkeys(usernames):
+        uid = user_cache.get(username)
+
+        if uid is not MISSING:
+            found[username] = uid
+        elif missing_user_cache.get(username) is MISSING:
+            unknown.append(username)
+
+    if not unknown:
+        return found
+
+    try:
+        checked = await _check_users(unknown)
+    except httpx.HTTPError as e:
+        raise _auth_unavailable(e) from e
+
+    for username in unknown:
+        if username in checked:
+            user_cache.set(username, checked[username])
+            found[username] = checked[username]
+        else:
+            missing_user_cache.set(username, True)
+
+    return found
 
-            response.raise_for_status()
+def invalidate_user(username: str) -> None:
+    """Сбрасывает закешированный результат проверки пользователя """
 
-            return response.json().get("id")
-        except httpx.HTTPStatusError as e:
-            logger.warning("Не удалось найти пользователя %s", username)
-            logger.warning("HTTPStatusError: %s", e)
+    logger.debug("invalidate_user: %s", username)
 
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Пользователь не найден") from e
+    user_cache.invalidate(username)
+    missing_user_cache.invalidate(username)
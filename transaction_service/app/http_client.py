@@ -0,0 +1,64 @@
+""" Модуль общего HTTP клиента для запросов к Auth сервису """
+
+import httpx
+
+from .logger import logger, request_id
+from .env import (
+    AUTH_SERVICE_URL,
+    AUTH_HTTP_MAX_CONNECTIONS,
+    AUTH_HTTP_MAX_KEEPALIVE,
+    AUTH_HTTP_KEEPALIVE_EXPIRY,
+    AUTH_HTTP2,
+    AUTH_HTTP_CONNECT_TIMEOUT,
+    AUTH_HTTP_READ_TIMEOUT)
+
+
+_client: httpx.AsyncClient | None = None
+
+async def _propagate_request_id(request: httpx.Request) -> None:
+    """ Передает id текущего запроса в Auth сервис для сквозного поиска по логам """
+
+    value = request_id.get()
+
+    if value != "-":
+        request.headers["X-Request-ID"] = value
+
+def init_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """ Создает клиент с пулом соединений (вызывается при старте приложения) """
+
+    global _client # pylint: disable=global-statement
+
+    logger.debug("Create auth HTTP client: http2=%s, max_connections=%d",
+                 AUTH_HTTP2, AUTH_HTTP_MAX_CONNECTIONS)
+
+    _client = httpx.AsyncClient(
+        base_url=AUTH_SERVICE_URL,
+        http2=AUTH_HTTP2,
+        transport=transport,
+        limits=httpx.Limits(
+            max_connections=AUTH_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=AUTH_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=AUTH_HTTP_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(AUTH_HTTP_READ_TIMEOUT, connect=AUTH_HTTP_CONNECT_TIMEOUT),
+        event_hooks={"request": [_propagate_request_id]})
+
+    return _client
+
+def get_client() -> httpx.AsyncClient:
+    """ Возвращает общий клиент """
+
+    if _client is None:
+        return init_client()
+
+    return _client
+
+async def close_client() -> None:
+    """ Закрывает клиент и все соединения пула """
+
+    global _client # pylint: disable=global-statement
+
+    if _client is not None:
+        logger.debug("Close auth HTTP client")
+
+        await _client.aclose()
+        _client = None
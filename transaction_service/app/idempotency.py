@@ -0,0 +1,65 @@
+""" Модуль ключей идемпотентности для /transfer """
+
+import hashlib
+import time
+
+from fastapi import HTTPException
+
+from . import schemas
+from .cache import TTLCache, MISSING
+from .logger import logger
+from .env import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL
+
+
+# (uid, ключ) -> (request_hash, schemas.TransactionOut) недавно проведенных переводов
+idempotency_cache = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_CACHE_TTL)
+
+def request_hash(transaction: schemas.TransactionCreate) -> str:
+    """Отпечаток тела запроса, с которым был использован ключ"""
+
+    return hashlib.sha256(
+        f"{transaction.receiver_username}|{transaction.amount!r}".encode()).hexdigest()
+
+def _key_reused() -> HTTPException:
+    """Ошибка для ключа, уже использованного с другим телом запроса"""
+
+    return HTTPException(
+        status_code=422,
+        detail="Idempotency-Key уже использован с другими параметрами перевода")
+
+def replay(
+        uid: int,
+        key: str,
+        fingerprint: str,
+        stored_hash: str,
+        transaction: schemas.TransactionOut) -> schemas.TransactionOut:
+    """Ответ на повтор запроса: исходная транзакция или 422 при другом теле"""
+
+    if stored_hash != fingerprint:
+        logger.warning("Idempotency-Key %s пользователя %s использован повторно", key, uid)
+
+        raise _key_reused()
+
+    return transaction
+
+def get_cached(uid: int, key: str, fingerprint: str) -> schemas.TransactionOut | None:
+    """Проверка ключа в кеше процесса без обращения к базе"""
+
+    cached = idempotency_cache.get((uid, key))
+
+    if cached is MISSING:
+        return None
+
+    stored_hash, transaction = cached
+
+    return replay(uid, key, fingerprint, stored_hash, transaction)
+
+def remember(
+        uid: int,
+        key: str,
+        fingerprint: str,
+        transaction: schemas.TransactionOut,
+        expires_at: float) -> None:
+    """Сохраняет результат в кеше, но не дольше срока жизни ключа в базе"""
+
+    idempotency_cache.set((uid, key), (fingerprint, transaction), ttl=expires_at - time.time())
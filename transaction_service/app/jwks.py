@@ -0,0 +1,72 @@
+""" Модуль кеша публичных ключей Auth сервиса (JWKS) """
+
+import asyncio
+import time
+
+import httpx
+
+from .http_client import get_client
+from .logger import logger
+from .metrics import OUTBOUND_LATENCY
+from .env import JWKS_URL, JWKS_REFRESH_INTERVAL, JWKS_MIN_REFRESH_INTERVAL
+
+
+class JWKSCache:
+    """ Кеш ключей, обновляемый по таймеру и при появлении неизвестного kid """
+
+    def __init__(self, url: str, refresh_interval: float, min_refresh_interval: float):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+
+        self._keys: dict[str, dict] = {}
+        self._last_attempt = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def refresh(self) -> None:
+        """ Загружает набор ключей из Auth сервиса """
+
+        logger.debug("JWKSCache.refresh: %s", self.url)
+
+        self._last_attempt = time.monotonic()
+
+        with OUTBOUND_LATENCY.labels("jwks").time():
+            response = await get_client().get(self.url)
+        response.raise_for_status()
+
+        self._keys = {key["kid"]: key for key in response.json().get("keys", []) if "kid" in key}
+
+        logger.info("Загружено ключей JWKS: %d", len(self._keys))
+
+    async def get_key(self, kid: str) -> dict | None:
+        """ Возвращает ключ по kid, при необходимости обновляя набор ключей """
+
+        key = self._keys.get(kid)
+
+        if key is not None:
+            return key
+
+        async with self._lock:
+            # Пока ждали блокировку, ключи мог обновить другой запрос
+            if kid not in self._keys and \
+                    time.monotonic() - self._last_attempt >= self.min_refresh_interval:
+                try:
+                    await self.refresh()
+                except httpx.HTTPError as e:
+                    logger.error("Не удалось обновить JWKS: %s", e)
+
+        return self._keys.get(kid)
+
+    async def run_refresh_loop(self) -> None:
+        """ Периодически обновляет ключи, пока задача не будет отменена """
+
+        while True:
+            try:
+                await self.refresh()
+            except httpx.HTTPError as e:
+                logger.error("Не удалось обновить JWKS: %s", e)
+
+            await asyncio.sleep(self.refresh_interval)
+
+
+jwks_cache = JWKSCache(JWKS_URL, JWKS_REFRESH_INTERVAL, JWKS_MIN_REFRESH_INTERVAL)
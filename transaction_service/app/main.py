@@ -1,94 +1,373 @@
 """ Микросервис для проведения транзакций между пользователями """
 
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import time
+from contextlib import asynccontextmanager, suppress
+from datetime import date, datetime, timedelta, timezone
+from typing import Literal
+
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import external_auth, schemas, crud, models
-from .database import get_db
-from .logger import logger
+from . import external_auth, schemas, crud, models, http_client, idempotency, partitions, metrics
+from .database import (
+    get_db,
+    get_read_db,
+    is_replica,
+    pool_stats,
+    replica_monitor,
+    AsyncSessionLocal,
+    ReplicaSessionLocal)
+from .export import ExportFormat, MEDIA_TYPES, encode_transactions
+from .jwks import jwks_cache
+from .logger import logger, log_stats
+from .middleware import RequestIdMiddleware, MetricsMiddleware
+from .pagination import encode_cursor, decode_cursor
+
+from .config import DEFAULT_TRANSACTION_LIMIT, DEFAULT_SUMMARY_DAYS
+from .env import (
+    JWT_VERIFICATION,
+    SHARD_COMPACTION_INTERVAL,
+    IDEMPOTENCY_KEY_TTL,
+    IDEMPOTENCY_CLEANUP_INTERVAL,
+    PARTITIONS_AHEAD,
+    PARTITION_CHECK_INTERVAL)
+
+
+async def compact_shards_loop() -> None:
+    """Периодически сворачивает части балансов "горячих" аккаунтов"""
+
+    while True:
+        await asyncio.sleep(SHARD_COMPACTION_INTERVAL)
+
+        try:
+            async with AsyncSessionLocal() as db:
+                count = await crud.compact_shards(db)
+
+            logger.debug("Свернуты части балансов аккаунтов: %d", count)
+        except SQLAlchemyError as e:
+            logger.error("Не удалось свернуть части балансов: %s", e)
+
+async def cleanup_idempotency_keys_loop() -> None:
+    """Периодически удаляет истекшие ключи идемпотентности"""
+
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_CLEANUP_INTERVAL)
+
+        try:
+            async with AsyncSessionLocal() as db:
+                count = await crud.delete_expired_idempotency_keys(db)
+
+            logger.debug("Удалены истекшие ключи идемпотентности: %d", count)
+        except SQLAlchemyError as e:
+            logger.error("Не удалось удалить истекшие ключи идемпотентности: %s", e)
+
+async def create_partitions() -> None:
+    """Создает недостающие месячные партиции транзакций"""
+
+    try:
+        async with AsyncSessionLocal() as db:
+            created = await partitions.ensure_partitions(db, months_ahead=PARTITIONS_AHEAD)
+
+        logger.debug("Созданы партиции: %s", created)
+    except (SQLAlchemyError, partitions.PartitionError) as e:
+        logger.error("Не удалось создать партиции транзакций: %s", e)
+
+async def create_partitions_loop() -> None:
+    """Периодически создает партиции следующих месяцев"""
+
+    while True:
+        await asyncio.sleep(PARTITION_CHECK_INTERVAL)
+
+        await create_partitions()
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Запуск и остановка фоновых задач приложения"""
+
+    http_client.init_client()
+
+    await create_partitions()
+
+    tasks: list[asyncio.Task] = []
+
+    if replica_monitor is not None:
+        # До первой проверки все чтения идут в основную базу
+        await replica_monitor.check()
+        tasks.append(asyncio.create_task(replica_monitor.run_check_loop()))
+
+    if JWT_VERIFICATION == "local":
+        tasks.append(asyncio.create_task(jwks_cache.run_refresh_loop()))
+
+    if SHARD_COMPACTION_INTERVAL > 0:
+        tasks.append(asyncio.create_task(compact_shards_loop()))
+
+    if IDEMPOTENCY_CLEANUP_INTERVAL > 0:
+        tasks.append(asyncio.create_task(cleanup_idempotency_keys_loop()))
+
+    if PARTITION_CHECK_INTERVAL > 0:
+        tasks.append(asyncio.create_task(create_partitions_loop()))
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+
+        with suppress(asyncio.CancelledError):
+            await task
+
+    await http_client.close_client()
+
+app = FastAPI(title="Transaction Microservice", lifespan=lifespan)
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+metrics.REGISTRY.register(metrics.StatsCollector({
+    "token_cache": external_auth.token_cache.stats,
+    "user_cache": external_auth.user_cache.stats,
+    "missing_user_cache": external_auth.missing_user_cache.stats,
+    "idempotency_cache": idempotency.idempotency_cache.stats,
+    "db_pool": pool_stats,
+    "logs": log_stats,
+}))
+
+if replica_monitor is not None:
+    metrics.REGISTRY.register(metrics.StatsCollector({
+        "db_replica": replica_monitor.stats,
+        "db_replica_pool": replica_monitor.engine.pool.stats,
+    }))
+
+def as_utc(moment: datetime) -> datetime:
+    """Время без часового пояса считается временем в UTC"""
+
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+async def get_read_account(db: AsyncSession, username: str) -> models.Account | None:
+    """Аккаунт для чтения истории
+
+    Если чтение идет из реплики, а она еще не получила только что созданный
+    аккаунт, аккаунт ищется в основной базе.
+    """
+
+    account = await crud.get_account_by_username(db, username=username)
+
+    if account is None and is_replica(db):
+        async with AsyncSessionLocal() as primary:
+            account = await crud.get_account_by_username(primary, username=username)
+
+    return account
+
+async def stored_transfer(
+        db: AsyncSession,
+        uid: int,
+        key: str,
+        fingerprint: str) -> schemas.TransactionOut | None:
+    """Транзакция, уже проведенная с этим ключом идемпотентности"""
+
+    stored = await crud.get_idempotency_key(db, uid, key)
+
+    if stored is None:
+        return None
 
-from .config import DEFAULT_TRANSACTION_LIMIT
+    transaction = schemas.TransactionOut.model_validate(stored.Transaction)
 
+    idempotency.remember(
+        uid, key, stored.IdempotencyKey.request_hash, transaction,
+        expires_at=stored.IdempotencyKey.expires_at.timestamp())
 
-app = FastAPI(title="Transaction Microservice")
+    return idempotency.replay(uid, key, fingerprint, stored.IdempotencyKey.request_hash, transaction)
 
 @app.post("/transfer", response_model=schemas.TransactionOut)
 async def transfer_funds(
     transaction: schemas.TransactionCreate,
+    response: Response,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
     current_user: schemas.User = Depends(external_auth.valid_token),
     db: AsyncSession = Depends(get_db)
 ) -> schemas.TransactionOut:
-    """Проведение перевода средств"""
+    """Проведение перевода средств
 
-    logger.debug("transfer_funds: %s", transaction)
+    С заголовком Idempotency-Key повтор запроса не проводит перевод заново,
+    а возвращает исходную транзакцию (заголовок ответа Idempotent-Replayed).
+    """
+
+    logger.debug("transfer_funds: %s, idempotency_key=%s", transaction, idempotency_key)
     logger.info("Пользователь %s хочет перевести %s пользователю %s",
                 current_user.username,
                 transaction.amount,
                 transaction.receiver_username)
 
-    # Проверка регистрации получателя
-    reciver_uid = await external_auth.fetch_user(transaction.receiver_username)
+    fingerprint = idempotency.request_hash(transaction)
 
-    # Проверка существования отправителя
-    current_account: models.Account | None = await crud.get_account_by_username(
-        db,
-        username=current_user.username)
+    if idempotency_key is not None:
+        replayed = idempotency.get_cached(current_user.uid, idempotency_key, fingerprint) \
+            or await stored_transfer(db, current_user.uid, idempotency_key, fingerprint)
 
-    if not current_account:
-        logger.info("Создание аккаунта пользователю %s", current_user.username)
+        if replayed is not None:
+            logger.info("Повтор перевода пользователя %s по ключу %s",
+                        current_user.username, idempotency_key)
 
-        current_account = await crud.create_account(db, schemas.AccountCreate(
-                                    uid=current_user.uid,
-                                    username=current_user.username))
+            response.headers["Idempotent-Replayed"] = "true"
 
-    # Проверка существования получателя
-    receiver: models.Account | None = await crud.get_account_by_username(
-        db,
-        username=transaction.receiver_username)
+            return replayed
 
-    if not receiver:
-        logger.info("Создание аккаунта пользователю %s", receiver.username)
+    # Проверка регистрации получателя
+    receiver_uid = await external_auth.fetch_user(transaction.receiver_username)
 
-        receiver = await crud.create_account(db, schemas.AccountCreate(
-                                    uid=reciver_uid,
-                                    username=transaction.receiver_username))
+    # Создание аккаунтов, проверка средств и перевод в одной транзакции БД
+    try:
+        new_transaction = await crud.transfer(
+            db,
+            sender=schemas.AccountCreate(uid=current_user.uid, username=current_user.username),
+            receiver=schemas.AccountCreate(
+                uid=receiver_uid,
+                username=transaction.receiver_username),
+            amount=transaction.amount,
+            idempotency_key=idempotency_key,
+            request_hash=fingerprint)
 
-    # Проверка достаточности средств
-    if current_account.balance < transaction.amount:
-        logger.warning(
-            "Перевод неудачен: недостаточно средств у пользователя %s",
-            current_user.username)
+    except crud.IdempotencyKeyInUse:
+        # Параллельный запрос с тем же ключом успел провести перевод
+        replayed = await stored_transfer(db, current_user.uid, idempotency_key, fingerprint)
 
-        raise HTTPException(status_code=400, detail="Недостаточно средств")
+        if replayed is None:
+            raise HTTPException(
+                status_code=409,
+                detail="Перевод с этим Idempotency-Key уже выполняется") from None
 
-    # Проведение транзакции
-    new_transaction = await crud.create_transaction(
-        db,
-        sender=current_account,
-        receiver=receiver,
-        amount=transaction.amount)
+        response.headers["Idempotent-Replayed"] = "true"
+
+        return replayed
+
+    except ValueError as e:
+        logger.warning(
+            "Перевод неудачен: %s (пользователь %s)",
+            e, current_user.username)
+
+        raise HTTPException(status_code=400, detail=str(e)) from e
 
     logger.info(
         "Пользователь %s перевёл %s пользователю %s",
-        current_account.username, transaction.amount, receiver.username)
+        current_user.username, transaction.amount, transaction.receiver_username)
+
+    if idempotency_key is not None:
+        idempotency.remember(
+            current_user.uid, idempotency_key, fingerprint,
+            schemas.TransactionOut.model_validate(new_transaction),
+            expires_at=time.time() + IDEMPOTENCY_KEY_TTL)
 
     return new_transaction
 
-@app.get("/transactions", response_model=list[schemas.TransactionOut])
+@app.post("/transfers/batch", response_model=schemas.TransferBatchOut)
+async def transfer_funds_batch(
+    batch: schemas.TransferBatch,
+    current_user: schemas.User = Depends(external_auth.valid_token),
+    db: AsyncSession = Depends(get_db)
+) -> schemas.TransferBatchOut:
+    """Проведение пачки переводов одного отправителя
+
+    atomic=true: проводятся все переводы или ни одного (ошибка 400/404).
+    atomic=false: результат и ошибка возвращаются для каждого перевода.
+    """
+
+    logger.debug("transfer_funds_batch: %d переводов, atomic=%s", len(batch.items), batch.atomic)
+    logger.info("Пользователь %s хочет провести %d переводов",
+                current_user.username,
+                len(batch.items))
+
+    # Проверка всех получателей одним запросом к Auth сервису
+    receivers = await external_auth.fetch_users([item.receiver_username for item in batch.items])
+
+    missing = [item.receiver_username for item in batch.items if item.receiver_username not in receivers]
+
+    if missing and batch.atomic:
+        logger.warning("Получатели не найдены: %s", missing)
+
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    items = [item for item in batch.items if item.receiver_username in receivers]
+
+    try:
+        transactions = await crud.transfer_batch(
+            db,
+            sender=schemas.AccountCreate(uid=current_user.uid, username=current_user.username),
+            items=[
+                (schemas.AccountCreate(
+                    uid=receivers[item.receiver_username],
+                    username=item.receiver_username), item.amount)
+                for item in items
+            ],
+            atomic=batch.atomic) if items else []
+
+    except ValueError as e:
+        logger.warning(
+            "Пачка переводов неудачна: %s (пользователь %s)",
+            e, current_user.username)
+
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    # transactions идут в порядке items, то есть найденных получателей
+    created = iter(transactions)
+    results = []
+
+    for item in batch.items:
+        transaction = next(created) if item.receiver_username in receivers else None
+
+        if item.receiver_username not in receivers:
+            error = "Пользователь не найден"
+        elif transaction is None:
+            error = "Недостаточно средств"
+        else:
+            error = None
+
+        results.append(schemas.TransferResult(
+            receiver_username=item.receiver_username,
+            amount=item.amount,
+            transaction=transaction,
+            error=error))
+
+    logger.info(
+        "Пользователь %s провел %d из %d переводов",
+        current_user.username,
+        sum(result.error is None for result in results),
+        len(results))
+
+    return schemas.TransferBatchOut(results=results)
+
+@app.get(
+    "/transactions",
+    response_model=list[schemas.TransactionOut] | schemas.TransactionPage)
 async def get_transactions(
     skip: int = 0,
     limit: int = DEFAULT_TRANSACTION_LIMIT,
+    pagination: Literal["offset", "cursor"] = "offset",
+    cursor: str | None = None,
+    date_from: datetime | None = Query(None, alias="from"),
+    date_to: datetime | None = Query(None, alias="to"),
     current_user: schemas.User = Depends(external_auth.valid_token),
-    db: AsyncSession = Depends(get_db)
-) -> list[schemas.TransactionOut]:
-    """Получение истории транзакций"""
+    db: AsyncSession = Depends(get_read_db)
+) -> list[schemas.TransactionOut] | schemas.TransactionPage:
+    """Получение истории транзакций
+
+    pagination=offset: список транзакций, пагинация через skip и limit.
+    pagination=cursor (или передан cursor): страница с next_cursor для
+    запроса следующей страницы.
+    from и to ограничивают период (включительно): запрос читает только
+    партиции этого периода.
+    """
+
+    logger.debug("get_transactions: skip=%s, limit=%s, pagination=%s, cursor=%s, from=%s, to=%s, user=%s",
+                 skip, limit, pagination, cursor, date_from, date_to, current_user)
 
-    logger.debug("get_transactions: skip=%s, limit=%s, user=%s",
-                 skip, limit, current_user)
+    date_from = as_utc(date_from) if date_from is not None else None
+    date_to = as_utc(date_to) if date_to is not None else None
     logger.info("Пользователь %s запросил историю транзакций", current_user.username)
 
     # Проверка существования пользователя
-    current_account: models.Account | None = await crud.get_account_by_username(
+    current_account: models.Account | None = await get_read_account(
         db,
         username=current_user.username)
     if not current_account:
@@ -96,12 +375,261 @@ async def get_transactions(
 
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    transactions: list[models.Transaction] = await crud.get_user_transactions(
+    if pagination == "cursor" or cursor is not None:
+        # Запрашиваем на одну транзакцию больше, чтобы узнать, есть ли следующая страница
+        transactions: list[models.Transaction] = await crud.get_user_transactions_page(
+            db,
+            account_id=current_account.id,
+            before=decode_cursor(cursor) if cursor else None,
+            limit=limit + 1,
+            date_from=date_from,
+            date_to=date_to)
+
+        page = schemas.TransactionPage(
+            items=transactions[:limit],
+            next_cursor=encode_cursor(transactions[limit - 1]) if 0 < limit < len(transactions) else None)
+
+        logger.info("Отправили пользователю %s страницу истории транзакций", current_account.username)
+
+        return page
+
+    transactions = await crud.get_user_transactions(
         db,
         account_id=current_account.id,
         skip=skip,
-        limit=limit)
+        limit=limit,
+        date_from=date_from,
+        date_to=date_to)
 
     logger.info("Отправили пользователю %s историю транзакций", current_account.username)
 
     return transactions
+
+def statement_lines(
+        account_id: int,
+        opening_balance: float,
+        transactions: list[models.Transaction]) -> list[schemas.StatementLine]:
+    """Строки выписки с балансом после каждого перевода
+
+    Баланс берется из снимка транзакции, а где его нет ("горячий" аккаунт),
+    вычисляется нарастающим итогом от предыдущей строки.
+    """
+
+    balance = opening_balance
+    lines = []
+
+    for transaction in transactions:
+        if transaction.sender_id == transaction.receiver_id:
+            direction, counterparty_id, snapshot = "self", account_id, transaction.sender_balance_after
+        elif transaction.sender_id == account_id:
+            direction, counterparty_id, snapshot = "out", transaction.receiver_id, transaction.sender_balance_after
+            balance -= transaction.amount
+        else:
+            direction, counterparty_id, snapshot = "in", transaction.sender_id, transaction.receiver_balance_after
+            balance += transaction.amount
+
+        if snapshot is not None:
+            balance = snapshot
+
+        lines.append(schemas.StatementLine(
+            id=transaction.id,
+            direction=direction,
+            counterparty_id=counterparty_id,
+            amount=transaction.amount,
+            balance_after=balance,
+            timestamp=transaction.timestamp))
+
+    return lines
+
+@app.get("/balance", response_model=schemas.Balance)
+async def get_balance(
+    at: datetime | None = None,
+    current_user: schemas.User = Depends(external_auth.valid_token),
+    db: AsyncSession = Depends(get_db)
+) -> schemas.Balance:
+    """Текущий баланс или баланс на момент at (с учетом переводов не позже at)"""
+
+    logger.debug("get_balance: at=%s, user=%s", at, current_user)
+    logger.info("Пользователь %s запросил баланс", current_user.username)
+
+    current_account: models.Account | None = await crud.get_account_by_username(
+        db,
+        username=current_user.username)
+    if not current_account:
+        logger.warning("Пользователь %s не найден", current_user.username)
+
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    if at is None:
+        balance = await crud.get_account_balance(db, current_account.id)
+    else:
+        balance = await crud.get_balance_at(db, current_account.id, as_utc(at))
+
+    return schemas.Balance(balance=balance, at=at)
+
+@app.get("/statement", response_model=schemas.Statement)
+async def get_statement(
+    date_from: datetime = Query(..., alias="from"),
+    date_to: datetime | None = Query(None, alias="to"),
+    limit: int = DEFAULT_TRANSACTION_LIMIT,
+    current_user: schemas.User = Depends(external_auth.valid_token),
+    db: AsyncSession = Depends(get_read_db)
+) -> schemas.Statement:
+    """Выписка за период (from, to]: балансы на начало и конец и переводы
+
+    Без to выписка строится по текущий момент. Переводов в выписке не больше limit.
+    """
+
+    logger.debug("get_statement: from=%s, to=%s, limit=%s, user=%s",
+                 date_from, date_to, limit, current_user)
+    logger.info("Пользователь %s запросил выписку", current_user.username)
+
+    date_from = as_utc(date_from)
+    date_to = as_utc(date_to) if date_to is not None else datetime.now(timezone.utc)
+
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="Некорректный период")
+
+    current_account: models.Account | None = await get_read_account(
+        db,
+        username=current_user.username)
+    if not current_account:
+        logger.warning("Пользователь %s не найден", current_user.username)
+
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    opening_balance = await crud.get_balance_at(db, current_account.id, date_from)
+    closing_balance = await crud.get_balance_at(db, current_account.id, date_to)
+
+    transactions = await crud.get_statement_transactions(
+        db,
+        account_id=current_account.id,
+        date_from=date_from,
+        date_to=date_to,
+        limit=limit)
+
+    logger.info("Отправили пользователю %s выписку", current_account.username)
+
+    return schemas.Statement(
+        date_from=date_from,
+        date_to=date_to,
+        opening_balance=opening_balance,
+        closing_balance=closing_balance,
+        lines=statement_lines(current_account.id, opening_balance, transactions))
+
+@app.get("/transactions/summary", response_model=schemas.Summary)
+async def get_transactions_summary(
+    date_from: date | None = Query(None, alias="from"),
+    date_to: date | None = Query(None, alias="to"),
+    granularity: Literal["day", "week", "month"] = "day",
+    current_user: schemas.User = Depends(external_auth.valid_token),
+    db: AsyncSession = Depends(get_read_db)
+) -> schemas.Summary:
+    """Итоги переводов (суммы и количество) по дням, неделям или месяцам
+
+    Период [from, to] включительно, даты по UTC. По умолчанию последние
+    DEFAULT_SUMMARY_DAYS дней. Неделя начинается с понедельника.
+    """
+
+    logger.debug("get_transactions_summary: from=%s, to=%s, granularity=%s, user=%s",
+                 date_from, date_to, granularity, current_user)
+    logger.info("Пользователь %s запросил итоги переводов", current_user.username)
+
+    date_to = date_to or datetime.now(timezone.utc).date()
+    date_from = date_from or date_to - timedelta(days=DEFAULT_SUMMARY_DAYS - 1)
+
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="Некорректный период")
+
+    current_account: models.Account | None = await get_read_account(
+        db,
+        username=current_user.username)
+    if not current_account:
+        logger.warning("Пользователь %s не найден", current_user.username)
+
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    periods = await crud.get_transactions_summary(
+        db,
+        account_id=current_account.id,
+        date_from=date_from,
+        date_to=date_to,
+        granularity=granularity)
+
+    return schemas.Summary(
+        granularity=granularity,
+        date_from=date_from,
+        date_to=date_to,
+        periods=periods)
+
+@app.get("/transactions/export", response_class=StreamingResponse)
+async def export_transactions(
+    export_format: ExportFormat = Query("ndjson", alias="format"),
+    compress: bool = Query(False, alias="gzip"),
+    date_from: datetime | None = Query(None, alias="from"),
+    date_to: datetime | None = Query(None, alias="to"),
+    current_user: schemas.User = Depends(external_auth.valid_token),
+    db: AsyncSession = Depends(get_read_db)
+) -> StreamingResponse:
+    """Выгрузка истории транзакций потоком в NDJSON или CSV (весь период или from–to)"""
+
+    logger.debug("export_transactions: format=%s, gzip=%s, from=%s, to=%s, user=%s",
+                 export_format, compress, date_from, date_to, current_user)
+
+    date_from = as_utc(date_from) if date_from is not None else None
+    date_to = as_utc(date_to) if date_to is not None else None
+    logger.info("Пользователь %s запросил выгрузку истории транзакций", current_user.username)
+
+    current_account: models.Account | None = await get_read_account(
+        db,
+        username=current_user.username)
+    if not current_account:
+        logger.warning("Пользователь %s не найден", current_user.username)
+
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    account_id = current_account.id
+
+    async def body():
+        # Сессия зависимости закрывается до отправки ответа,
+        # поэтому поток читается в своей сессии (из той же базы)
+        async with (ReplicaSessionLocal() if is_replica(db) else AsyncSessionLocal()) as session:
+            batches = crud.stream_user_transactions(
+                session,
+                account_id=account_id,
+                date_from=date_from,
+                date_to=date_to)
+
+            async for chunk in encode_transactions(batches, export_format, compress):
+                yield chunk
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="transactions.{export_format}"',
+    }
+
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[export_format], headers=headers)
+
+@app.get("/stats")
+async def get_stats() -> dict:
+    """Счетчики внутренних кешей сервиса"""
+
+    logger.debug("get_stats")
+
+    return {
+        "token_cache": external_auth.token_cache.stats(),
+        "user_cache": external_auth.user_cache.stats(),
+        "missing_user_cache": external_auth.missing_user_cache.stats(),
+        "idempotency_cache": idempotency.idempotency_cache.stats(),
+        "db_pool": pool_stats(),
+        "db_replica": replica_monitor.stats() if replica_monitor is not None else None,
+        "logs": log_stats(),
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    """Метрики в текстовом формате Prometheus"""
+
+    return Response(generate_latest(metrics.REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,108 @@
+""" Служебные команды сервиса транзакций
+
+Запуск: python -m app.manage <команда> [аргументы]
+"""
+
+import argparse
+import asyncio
+from datetime import date
+from pathlib import Path
+
+from . import crud, partitions
+from .database import AsyncSessionLocal, async_engine
+from .env import PARTITIONS_AHEAD
+
+
+async def hot_account(args: argparse.Namespace) -> None:
+    """Настройка режима "горячего" аккаунта"""
+
+    async with AsyncSessionLocal() as db:
+        account = await crud.set_shard_count(db, args.username, args.shards)
+
+    if account is None:
+        print(f"Аккаунт {args.username} не найден")
+    else:
+        print(f"Аккаунт {account.username}: shard_count={account.shard_count}")
+
+async def compact_shards(_args: argparse.Namespace) -> None:
+    """Сворачивание частей балансов в основные строки"""
+
+    async with AsyncSessionLocal() as db:
+        count = await crud.compact_shards(db)
+
+    print(f"Свернуто аккаунтов: {count}")
+
+async def create_partitions(args: argparse.Namespace) -> None:
+    """Создание месячных партиций транзакций"""
+
+    async with AsyncSessionLocal() as db:
+        created = await partitions.ensure_partitions(db, months_ahead=args.months_ahead)
+
+    print(f"Создано партиций: {len(created)}", *created, sep="\n")
+
+async def archive_partitions(args: argparse.Namespace) -> None:
+    """Выгрузка и удаление партиций транзакций за месяцы до --before"""
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    async with AsyncSessionLocal() as db:
+        names = [
+            name for name in await partitions.list_partitions(db)
+            if (month := partitions.partition_month(name)) is not None
+            and partitions.add_months(month, 1) <= args.before
+        ]
+
+        for name in names:
+            if args.dry_run:
+                print(f"{name}: будет выгружена")
+                continue
+
+            path = await partitions.archive_partition(db, name, args.output_dir)
+
+            print(f"{name}: выгружена в {path}")
+
+def main() -> None:
+    """Разбор аргументов и запуск команды"""
+
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "hot-account",
+        help='включить (--shards > 1) или выключить (--shards 1) режим "горячего" аккаунта')
+    command.add_argument("username")
+    command.add_argument("--shards", type=int, required=True)
+    command.set_defaults(handler=hot_account)
+
+    command = commands.add_parser(
+        "compact-shards",
+        help="свернуть части балансов в основные строки аккаунтов")
+    command.set_defaults(handler=compact_shards)
+
+    command = commands.add_parser(
+        "create-partitions",
+        help="создать партиции транзакций на текущий и следующие месяцы")
+    command.add_argument("--months-ahead", type=int, default=PARTITIONS_AHEAD)
+    command.set_defaults(handler=create_partitions)
+
+    command = commands.add_parser(
+        "archive-partitions",
+        help="отсоединить партиции месяцев, закончившихся до --before, выгрузить в CSV (gzip) и удалить")
+    command.add_argument("--before", type=date.fromisoformat, required=True, help="дата ГГГГ-ММ-ДД")
+    command.add_argument("--output-dir", type=Path, default=Path("archive"))
+    command.add_argument("--dry-run", action="store_true", help="только показать партиции")
+    command.set_defaults(handler=archive_partitions)
+
+    args = parser.parse_args()
+
+    async def run() -> None:
+        try:
+            await args.handler(args)
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+""" ASGI middleware сервиса """
+
+import time
+import uuid
+
+from .logger import request_id
+from .metrics import REQUEST_LATENCY, REQUESTS_IN_PROGRESS, REQUEST_ERRORS
+
+
+class RequestIdMiddleware:
+    """ Назначает запросу id (из заголовка X-Request-ID или новый)
+
+    id доступен логгеру через contextvar и возвращается в заголовке ответа.
+    Чистый ASGI, без BaseHTTPMiddleware: не создает лишних задач на запрос.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+
+            return
+
+        value = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64] \
+            or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-request-id", value.encode("latin-1")),
+                ]
+
+            await send(message)
+
+        token = request_id.set(value)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id.reset(token)
+
+class MetricsMiddleware:
+    """ Время ответа по маршрутам и статусам, запросы в обработке и ошибки
+
+    Метка route — шаблон пути маршрута (например, /transactions), а не сам путь,
+    чтобы число временных рядов не зависело от параметров запросов.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+
+        start = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status_code = 500
+
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+
+            in_progress.dec()
+
+            # Router кладет найденный маршрут в scope; для неизвестных путей его нет
+            route = getattr(scope.get("route"), "path", "unmatched")
+            status = str(status_code)
+
+            REQUEST_LATENCY.labels(method, route, status).observe(elapsed)
+
+            if status_code >= 500:
+                REQUEST_ERRORS.labels(method, route, status).inc()
@@ -1,8 +1,8 @@
 """ Модели данных для работы с транзакциями и аккаунтами пользователей """
 
-from datetime import datetime
+from datetime import date, datetime
 
-from sqlalchemy import Float, ForeignKey, DateTime, String
+from sqlalchemy import Date, Float, ForeignKey, DateTime, String, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.sql import func
@@ -18,13 +18,28 @@ class Transaction(Base):
 
     __tablename__ = "transactions"
 
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    # Таблица секционирована по месяцам (см. partitions.py), поэтому ключ
+    # партиционирования timestamp входит в первичный ключ
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, index=True)
 
     sender_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), nullable=False)
     receiver_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), nullable=False)
 
     amount: Mapped[float] = mapped_column(Float, nullable=False)
-    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    # clock_timestamp(), а не now(): время берется в момент вставки, уже после
+    # блокировки аккаунтов, поэтому порядок (timestamp, id) по каждому аккаунту
+    # совпадает с порядком изменения его баланса
+    timestamp: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        server_default=func.clock_timestamp())
+
+    # Балансы сторон сразу после перевода. NULL для "горячего" аккаунта:
+    # зачисления в его части идут без блокировки и не упорядочены
+    sender_balance_after: Mapped[float | None] = mapped_column(Float)
+    receiver_balance_after: Mapped[float | None] = mapped_column(Float)
 
     sender: Mapped["Account"] = relationship("Account", foreign_keys=[sender_id])
     receiver: Mapped["Account"] = relationship("Account", foreign_keys=[receiver_id])
@@ -38,6 +53,19 @@ class Transaction(Base):
             f"amount={self.amount!r})"
         )
 
+# Индексы для истории транзакций: по одному на каждую ветку UNION в
+# crud.get_user_transactions, порядок совпадает с сортировкой выдачи
+Index(
+    "ix_transactions_sender_id_timestamp_id",
+    Transaction.sender_id,
+    Transaction.timestamp.desc(),
+    Transaction.id.desc())
+Index(
+    "ix_transactions_receiver_id_timestamp_id",
+    Transaction.receiver_id,
+    Transaction.timestamp.desc(),
+    Transaction.id.desc())
+
 class Account(Base):
     """ Модель аккаунта пользователя c балансом """
 
@@ -50,6 +78,10 @@ class Account(Base):
 
     balance: Mapped[float] = mapped_column(default=0.0, nullable=False)
 
+    # Число частей баланса для "горячих" аккаунтов: при shard_count > 1 зачисления
+    # идут в случайную строку account_shards, а не в эту строку
+    shard_count: Mapped[int] = mapped_column(default=1, server_default="1", nullable=False)
+
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
@@ -58,3 +90,72 @@ class Account(Base):
 
     def __repr__(self) -> str:
         return f"User(id={self.id!r}, username={self.username!r}, balance={self.balance!r})"
+
+class AccountShard(Base):
+    """ Часть баланса "горячего" аккаунта """
+
+    __tablename__ = "account_shards"
+
+    account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), primary_key=True)
+    shard: Mapped[int] = mapped_column(primary_key=True)
+
+    balance: Mapped[float] = mapped_column(default=0.0, nullable=False)
+
+    def __repr__(self) -> str:
+        return (
+            "AccountShard("
+            f"account_id={self.account_id!r}, "
+            f"shard={self.shard!r}, "
+            f"balance={self.balance!r})"
+        )
+
+class IdempotencyKey(Base):
+    """ Ключ идемпотентности перевода (заголовок Idempotency-Key) """
+
+    __tablename__ = "idempotency_keys"
+
+    # Ключ уникален в пределах отправителя: uid из Auth сервиса известен
+    # до создания аккаунта, поэтому ссылка идет не на accounts
+    uid: Mapped[int] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+
+    # sha256 тела запроса: повтор ключа с другим телом отклоняется
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Без внешнего ключа: id секционированной таблицы transactions уникален
+    # только вместе с timestamp
+    transaction_id: Mapped[int | None] = mapped_column()
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, nullable=False)
+
+    def __repr__(self) -> str:
+        return (
+            "IdempotencyKey("
+            f"uid={self.uid!r}, "
+            f"key={self.key!r}, "
+            f"transaction_id={self.transaction_id!r})"
+        )
+
+class DailyAccountTotal(Base):
+    """ Дневные итоги переводов аккаунта (по UTC) """
+
+    __tablename__ = "daily_account_totals"
+
+    account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    # Часть итогов "горячего" получателя, как в account_shards; иначе 0
+    shard: Mapped[int] = mapped_column(primary_key=True, default=0)
+
+    sent_amount: Mapped[float] = mapped_column(default=0.0, nullable=False)
+    sent_count: Mapped[int] = mapped_column(default=0, nullable=False)
+    received_amount: Mapped[float] = mapped_column(default=0.0, nullable=False)
+    received_count: Mapped[int] = mapped_column(default=0, nullable=False)
+
+    def __repr__(self) -> str:
+        return (
+            "DailyAccountTotal("
+            f"account_id={self.account_id!r}, "
+            f"day={self.day!r}, "
+            f"sent_amount={self.sent_amount!r}, "
+            f"received_amount={self.received_amount!r})"
+        )
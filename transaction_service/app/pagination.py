@@ -0,0 +1,31 @@
+""" Модуль курсоров для постраничной выдачи истории транзакций """
+
+import base64
+import binascii
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+from . import models
+
+
+def encode_cursor(transaction: models.Transaction) -> str:
+    """Непрозрачный курсор из (timestamp, id) последней выданной транзакции"""
+
+    raw = f"{transaction.timestamp.isoformat()}|{transaction.id}"
+
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Разбирает курсор, выданный encode_cursor"""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, transaction_id = raw.split("|")
+
+        return datetime.fromisoformat(timestamp), int(transaction_id)
+
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор") from e
@@ -0,0 +1,200 @@
+""" Модуль месячных партиций таблицы транзакций
+
+Таблица transactions секционирована по RANGE (timestamp): одна партиция
+на календарный месяц (UTC) с именем transactions_ГГГГ_ММ и партиция
+transactions_default для строк вне созданных месяцев.
+"""
+
+import gzip
+import re
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .logger import logger
+
+
+PARENT = "transactions"
+DEFAULT_PARTITION = "transactions_default"
+
+class PartitionError(Exception):
+    """Не удалось создать одну или несколько партиций"""
+
+_PARTITION_NAME = re.compile(r"^transactions_(\d{4})_(\d{2})$")
+
+# Создание и отсоединение партиций блокируют родительскую таблицу. Если
+# блокировку не удалось быстро получить, лучше повторить позже, чем
+# останавливать все переводы в очереди за ней
+LOCK_TIMEOUT = "5s"
+
+def add_months(month: date, months: int) -> date:
+    """Первое число месяца, отстоящего от month на months месяцев"""
+
+    index = month.year * 12 + month.month - 1 + months
+
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    """Имя партиции месяца"""
+
+    return f"{PARENT}_{month.year:04d}_{month.month:02d}"
+
+def month_start(month: date) -> str:
+    """Начало месяца в UTC как литерал timestamptz
+
+    Граница без часового пояса ('2026-10-01') Postgres читает в часовом поясе
+    сессии, и при TimeZone не UTC партиции сдвигаются относительно месяцев UTC.
+    """
+
+    return f"{month.isoformat()}T00:00:00+00:00"
+
+def partition_month(name: str) -> date | None:
+    """Месяц партиции по ее имени или None для других таблиц"""
+
+    match = _PARTITION_NAME.match(name)
+
+    if match is None:
+        return None
+
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+async def list_partitions(db: AsyncSession) -> list[str]:
+    """Имена партиций таблицы транзакций"""
+
+    result = await db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :parent "
+        "ORDER BY child.relname"), {"parent": PARENT})
+
+    return list(result.scalars())
+
+async def create_partition(db: AsyncSession, month: date) -> None:
+    """Создает партицию месяца
+
+    Если в transactions_default уже есть строки этого месяца, CREATE TABLE ...
+    PARTITION OF не пройдет проверку default партиции. Тогда в одной транзакции
+    default партиция отсоединяется, строки месяца переносятся в новую партицию
+    и default подключается обратно. На это время запись в transactions
+    блокируется, но строк в default обычно немного.
+    """
+
+    name = partition_name(month)
+    start, end = month_start(month), month_start(add_months(month, 1))
+    bounds = f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    in_month = f"timestamp >= '{start}' AND timestamp < '{end}'"
+
+    try:
+        await db.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+
+        stray = await db.scalar(text(f"SELECT count(*) FROM {DEFAULT_PARTITION} WHERE {in_month}"))
+
+        if not stray:
+            await db.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT} {bounds}"))
+        else:
+            logger.warning("В %s есть строки за %s (%d), переносим в %s",
+                           DEFAULT_PARTITION, month, stray, name)
+
+            await db.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}"))
+            await db.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT} {bounds}"))
+            await db.execute(text(f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}"))
+            await db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}"))
+            await db.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+        await db.commit()
+
+    except BaseException:
+        await db.rollback()
+
+        raise
+
+async def ensure_partitions(db: AsyncSession, months_ahead: int) -> list[str]:
+    """Создает партиции текущего месяца и months_ahead следующих
+
+    Возвращает имена созданных партиций. Партиции создаются заранее, чтобы
+    переводы не попадали в transactions_default.
+    """
+
+    existing = set(await list_partitions(db))
+    current = datetime.now(timezone.utc).date().replace(day=1)
+    created = []
+    errors = []
+
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        name = partition_name(month)
+
+        if name in existing:
+            continue
+
+        try:
+            await create_partition(db, month)
+
+        except SQLAlchemyError as e:
+            # Остальные месяцы все равно создаются; ошибка видна в логе
+            # и в итоге пробрасывается вызывающему
+            logger.error("Не удалось создать партицию %s: %s", name, e)
+
+            errors.append(name)
+            continue
+
+        logger.info("Создана партиция %s", name)
+
+        created.append(name)
+
+    if errors:
+        raise PartitionError(f"Не удалось создать партиции: {', '.join(errors)}")
+
+    return created
+
+async def archive_partition(db: AsyncSession, name: str, directory: Path) -> Path:
+    """Отсоединяет партицию, выгружает ее в CSV (gzip) и удаляет
+
+    Файл пишется до удаления таблицы; если выгрузка не удалась, партиция
+    остается отсоединенной и ее можно выгрузить повторно или подключить обратно.
+    """
+
+    path = directory / f"{name}.csv.gz"
+
+    if name in await list_partitions(db):
+        try:
+            await db.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            await db.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+            await db.commit()
+
+        except BaseException:
+            await db.rollback()
+
+            raise
+
+        logger.info("Партиция %s отсоединена", name)
+
+    connection = await db.connection()
+    raw = await connection.get_raw_connection()
+
+    # COPY пишет поток строк прямо в файл, не накапливая партицию в памяти
+    with gzip.open(path.with_suffix(".tmp"), "wb") as archive:
+        async def write(chunk: bytes) -> None:
+            archive.write(chunk)
+
+        await raw.driver_connection.copy_from_table(
+            name, output=write, format="csv", header=True)
+
+    path.with_suffix(".tmp").rename(path)
+
+    try:
+        await db.execute(text(f"DROP TABLE {name}"))
+        await db.commit()
+
+    except BaseException:
+        await db.rollback()
+
+        raise
+
+    logger.info("Партиция %s выгружена в %s и удалена", name, path)
+
+    return path
@@ -1,9 +1,12 @@
 """ Модуль схем для валидации данных """
 
-from datetime import datetime
+from datetime import date, datetime
+from typing import Literal
 
 from pydantic import BaseModel, Field
 
+from .config import MAX_BATCH_TRANSFERS
+
 class AccountCreate(BaseModel):
     """Схема пользователя (ограниченная информация)"""
 
@@ -47,6 +50,77 @@ class TransactionOut(BaseModel):
             f"amount={self.amount},"
             f"timestamp={self.timestamp})")
 
+class TransactionPage(BaseModel):
+    """Схема страницы истории транзакций"""
+
+    items: list[TransactionOut]
+    next_cursor: str | None = None
+
+class TransferBatch(BaseModel):
+    """Схема пачки переводов одного отправителя"""
+
+    items: list[TransactionCreate] = Field(..., min_length=1, max_length=MAX_BATCH_TRANSFERS)
+    atomic: bool = Field(True, description="Провести все переводы или ни одного")
+
+class TransferResult(BaseModel):
+    """Схема результата одного перевода из пачки"""
+
+    receiver_username: str
+    amount: float
+    transaction: TransactionOut | None = None
+    error: str | None = None
+
+class TransferBatchOut(BaseModel):
+    """Схема результата пачки переводов (в порядке запроса)"""
+
+    results: list[TransferResult]
+
+class Balance(BaseModel):
+    """Схема баланса аккаунта (текущего или на момент at)"""
+
+    balance: float
+    at: datetime | None = None
+
+class StatementLine(BaseModel):
+    """Схема строки выписки: перевод с точки зрения владельца выписки"""
+
+    id: int
+    direction: Literal["in", "out", "self"]
+    counterparty_id: int
+    amount: float
+    balance_after: float
+    timestamp: datetime
+
+class Statement(BaseModel):
+    """Схема выписки за период (date_from, date_to]"""
+
+    date_from: datetime
+    date_to: datetime
+    opening_balance: float
+    closing_balance: float
+    lines: list[StatementLine]
+
+class SummaryPeriod(BaseModel):
+    """Схема итогов переводов за один период"""
+
+    period: date
+    sent_amount: float
+    sent_count: int
+    received_amount: float
+    received_count: int
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class Summary(BaseModel):
+    """Схема итогов переводов за [date_from, date_to]"""
+
+    granularity: Literal["day", "week", "month"]
+    date_from: date
+    date_to: date
+    periods: list[SummaryPeriod]
+
 class User(BaseModel):
     """Схема пользователя"""
 
@@ -0,0 +1,141 @@
+""" Бенчмарк зачислений на один "горячий" аккаунт
+
+Много отправителей одновременно переводят деньги одному получателю.
+Для каждого значения shard_count замеряется число переводов в секунду.
+
+Запуск из каталога transaction_service (база должна быть мигрирована):
+
+    TRANS_DATABASE_URL=postgresql+asyncpg://... AUTH_SERVICE_URL=http://unused \\
+        python -m benchmarks.hot_account --shards 1 2 4 8 16 --concurrency 32 --processes 4
+
+Результат печатается в stdout в формате JSON, по строке на каждое значение shard_count.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.env import DATABASE_URL
+
+
+# uid тестовых аккаунтов выбраны так, чтобы не пересекаться с реальными пользователями
+RECEIVER_UID = -1
+SENDER_UID_BASE = -1000
+
+RECEIVER = schemas.AccountCreate(uid=RECEIVER_UID, username="bench_hot_receiver")
+
+async def prepare(sessions: sessionmaker, senders: list[schemas.AccountCreate]) -> None:
+    """Создает получателя и отправителей с запасом средств"""
+
+    async with sessions() as db:
+        # Первый перевод создает аккаунты, после чего баланс отправителей пополняется
+        for sender in senders:
+            await crud.transfer(db, sender, RECEIVER, 0.01)
+
+        await db.execute(
+            update(models.Account)
+            .where(models.Account.uid.in_([sender.uid for sender in senders]))
+            .values(balance=1e12))
+        await db.commit()
+
+async def cleanup(sessions: sessionmaker, senders: list[schemas.AccountCreate]) -> None:
+    """Удаляет тестовые аккаунты и их транзакции"""
+
+    uids = [RECEIVER_UID] + [sender.uid for sender in senders]
+
+    async with sessions() as db:
+        ids = select(models.Account.id).where(models.Account.uid.in_(uids))
+
+        await db.execute(delete(models.AccountShard).where(models.AccountShard.account_id.in_(ids)))
+        await db.execute(delete(models.DailyAccountTotal).where(
+            models.DailyAccountTotal.account_id.in_(ids)))
+        await db.execute(delete(models.Transaction).where(
+            models.Transaction.sender_id.in_(ids) | models.Transaction.receiver_id.in_(ids)))
+        await db.execute(delete(models.Account).where(models.Account.uid.in_(uids)))
+        await db.commit()
+
+async def run_workers(senders: list[schemas.AccountCreate], duration: float) -> int:
+    """Каждый отправитель переводит получателю, пока не истечет duration"""
+
+    engine = create_async_engine(DATABASE_URL, pool_size=len(senders), max_overflow=0)
+    sessions = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    deadline = time.perf_counter() + duration
+    done = 0
+
+    async def worker(sender: schemas.AccountCreate) -> None:
+        nonlocal done
+
+        async with sessions() as db:
+            while time.perf_counter() < deadline:
+                await crud.transfer(db, sender, RECEIVER, 1.0)
+                done += 1
+
+    try:
+        await asyncio.gather(*(worker(sender) for sender in senders))
+    finally:
+        await engine.dispose()
+
+    return done
+
+def run_process(senders: list[schemas.AccountCreate], duration: float) -> int:
+    """Точка входа процесса нагрузки: одного event loop не хватает, чтобы упереться в базу"""
+
+    return asyncio.run(run_workers(senders, duration))
+
+async def main(args: argparse.Namespace) -> None:
+    """Прогоняет бенчмарк для каждого значения shard_count"""
+
+    engine = create_async_engine(DATABASE_URL)
+    pool = ProcessPoolExecutor(max_workers=args.processes)
+    sessions = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    senders = [
+        schemas.AccountCreate(uid=SENDER_UID_BASE - i, username=f"bench_sender_{i}")
+        for i in range(args.concurrency)
+    ]
+
+    try:
+        await cleanup(sessions, senders)
+        await prepare(sessions, senders)
+
+        for shard_count in args.shards:
+            async with sessions() as db:
+                await crud.set_shard_count(db, RECEIVER.username, shard_count)
+
+            loop = asyncio.get_running_loop()
+            done = sum(await asyncio.gather(*(
+                loop.run_in_executor(pool, run_process, senders[i::args.processes], args.duration)
+                for i in range(args.processes))))
+
+            print(json.dumps({
+                "benchmark": "hot_account_credit",
+                "shard_count": shard_count,
+                "concurrency": args.concurrency,
+                "processes": args.processes,
+                "duration": args.duration,
+                "transfers": done,
+                "transfers_per_second": round(done / args.duration, 1),
+            }), flush=True)
+    finally:
+        await cleanup(sessions, senders)
+        await engine.dispose()
+
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.hot_account")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--processes", type=int, default=4)
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,342 @@
+""" Нагрузочный тест /token, /transfer и /transactions
+
+Оба приложения запускаются в одном процессе и вызываются через
+httpx.ASGITransport, без сети. Сервис транзакций ходит в Auth сервис тоже
+через ASGITransport: в настоящее приложение (--auth service) или в
+заглушку без bcrypt и базы (--auth stub).
+
+Запуск из каталога transaction_service (обе базы должны быть мигрированы):
+
+    TRANS_DATABASE_URL=postgresql+asyncpg://... AUTH_DATABASE_URL=postgresql+asyncpg://... \\
+    SECRET_KEY=... AUTH_SERVICE_URL=http://auth \\
+        python -m benchmarks.load_test --users 50 --duration 30 --mix token=1,transfer=8,transactions=3
+
+Быстрая проверка (заглушка Auth, 4 пользователя, 3 секунды):
+
+    python -m benchmarks.load_test --smoke
+
+Результат (p50/p95/p99, пропускная способность и доля ошибок по каждой
+операции) печатается в stdout в формате JSON и, с --output, пишется в файл.
+"""
+
+import argparse
+import asyncio
+import importlib
+import importlib.util
+import json
+import random
+import sys
+import time
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+import httpx
+from fastapi import Body, FastAPI, Form, Header, HTTPException
+from sqlalchemy import delete, select, update
+
+from app import http_client, models
+from app.database import AsyncSessionLocal
+from app.env import JWT_VERIFICATION
+from app.main import app as transaction_app
+
+
+AUTH_APP_DIR = Path(__file__).resolve().parents[2] / "auth_service" / "app"
+
+OPERATIONS = ["token", "transfer", "transactions"]
+
+USERNAME_PREFIX = "bench_load_"
+PASSWORD = "bench-password"
+# uid пользователей заглушки не пересекаются с реальными
+STUB_UID_BASE = -100000
+
+def load_auth_app() -> FastAPI:
+    """Импортирует приложение Auth сервиса как пакет auth_app
+
+    Оба сервиса называют свой пакет app, поэтому Auth сервис загружается
+    из файлов под другим именем.
+    """
+
+    spec = importlib.util.spec_from_file_location(
+        "auth_app", AUTH_APP_DIR / "__init__.py", submodule_search_locations=[str(AUTH_APP_DIR)])
+    module = importlib.util.module_from_spec(spec)
+
+    sys.modules["auth_app"] = module
+    spec.loader.exec_module(module)
+
+    return importlib.import_module("auth_app.main").app
+
+def stub_auth_app(usernames: list[str]) -> FastAPI:
+    """Заглушка Auth сервиса: токен — это имя пользователя, пароли не проверяются"""
+
+    uids = {username: STUB_UID_BASE - i for i, username in enumerate(usernames)}
+    stub = FastAPI()
+
+    @stub.post("/register")
+    async def register(user: dict = Body(...)) -> dict:
+        return {"id": uids[user["username"]], "username": user["username"]}
+
+    @stub.post("/token")
+    async def token(username: str = Form(...), password: str = Form(...)) -> dict: # pylint: disable=unused-argument
+        return {"access_token": f"stub:{username}", "token_type": "bearer"}
+
+    @stub.post("/verify")
+    async def verify(authorization: str = Header(...)) -> dict:
+        username = authorization.removeprefix("Bearer stub:")
+
+        if username not in uids:
+            raise HTTPException(status_code=401, detail="Невалидный токен")
+
+        return {"id": uids[username], "username": username}
+
+    @stub.post("/check-users")
+    async def check_users(body: dict = Body(...)) -> list[dict]:
+        return [
+            {"id": uids[username], "username": username}
+            for username in body["usernames"] if username in uids
+        ]
+
+    return stub
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Разбор --mix вида token=1,transfer=8,transactions=3"""
+
+    mix = {}
+
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"неизвестная операция: {name}")
+
+        mix[name] = float(weight or 1)
+
+    return mix
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль q (0..100) отсортированного списка методом ближайшего ранга"""
+
+    if not values:
+        return 0.0
+
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+
+    return values[index]
+
+def summarize(samples: list[tuple[float, bool]], duration: float) -> dict:
+    """Сводка по замерам (задержка в секундах, успех)"""
+
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput": round(len(samples) / duration, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+async def login(auth: httpx.AsyncClient, username: str) -> str:
+    """Токен пользователя"""
+
+    response = await auth.post("/token", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+
+    return response.json()["access_token"]
+
+async def prepare(
+        auth: httpx.AsyncClient,
+        trans: httpx.AsyncClient,
+        usernames: list[str]) -> dict[str, str]:
+    """Регистрирует пользователей, получает токены и пополняет балансы
+
+    Пользователи Auth сервиса не удаляются после теста и переиспользуются
+    (регистрация стоит одного bcrypt на пользователя).
+    """
+
+    limit = asyncio.Semaphore(8)
+
+    async def register(username: str) -> str:
+        async with limit:
+            response = await auth.post("/register", json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": PASSWORD,
+            })
+
+            # 400 — пользователь остался от прошлого запуска
+            if response.status_code not in (200, 400):
+                response.raise_for_status()
+
+            return await login(auth, username)
+
+    tokens = dict(zip(usernames, await asyncio.gather(*(register(name) for name in usernames))))
+
+    # Первый перевод создает аккаунты, после чего баланс пополняется
+    for i, username in enumerate(usernames):
+        response = await trans.post(
+            "/transfer",
+            json={"receiver_username": usernames[(i + 1) % len(usernames)], "amount": 0.01},
+            headers={"Authorization": f"Bearer {tokens[username]}"})
+        response.raise_for_status()
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(models.Account)
+            .where(models.Account.username.in_(usernames))
+            .values(balance=1e12))
+        await db.commit()
+
+    return tokens
+
+async def cleanup(usernames: list[str]) -> None:
+    """Удаляет аккаунты и транзакции тестовых пользователей из базы транзакций"""
+
+    async with AsyncSessionLocal() as db:
+        ids = select(models.Account.id).where(models.Account.username.in_(usernames))
+
+        await db.execute(delete(models.AccountShard).where(models.AccountShard.account_id.in_(ids)))
+        await db.execute(delete(models.DailyAccountTotal).where(
+            models.DailyAccountTotal.account_id.in_(ids)))
+        await db.execute(delete(models.Transaction).where(
+            models.Transaction.sender_id.in_(ids) | models.Transaction.receiver_id.in_(ids)))
+        await db.execute(delete(models.Account).where(models.Account.username.in_(usernames)))
+        await db.commit()
+
+async def run_load(
+        auth: httpx.AsyncClient,
+        trans: httpx.AsyncClient,
+        tokens: dict[str, str],
+        args: argparse.Namespace) -> dict[str, list[tuple[float, bool]]]:
+    """Виртуальные пользователи выполняют операции из --mix до окончания теста"""
+
+    usernames = list(tokens)
+    names, weights = zip(*args.mix.items())
+    samples: dict[str, list[tuple[float, bool]]] = {name: [] for name in names}
+
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    deadline = measure_from + args.duration
+
+    async def virtual_user(index: int) -> None:
+        rng = random.Random(args.seed + index)
+        username = usernames[index % len(usernames)]
+        headers = {"Authorization": f"Bearer {tokens[username]}"}
+
+        while (now := time.perf_counter()) < deadline:
+            operation = rng.choices(names, weights)[0]
+
+            try:
+                if operation == "token":
+                    response = await auth.post(
+                        "/token", data={"username": username, "password": PASSWORD})
+                elif operation == "transfer":
+                    receiver = rng.choice([name for name in usernames if name != username])
+                    response = await trans.post(
+                        "/transfer",
+                        json={"receiver_username": receiver, "amount": 1.0},
+                        headers=headers)
+                else:
+                    response = await trans.get(
+                        "/transactions", params={"limit": 20}, headers=headers)
+
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+
+            if now >= measure_from:
+                samples[operation].append((time.perf_counter() - now, ok))
+
+    await asyncio.gather(*(virtual_user(i) for i in range(args.concurrency)))
+
+    return samples
+
+async def main(args: argparse.Namespace) -> dict:
+    """Запускает приложения, готовит данные, прогоняет нагрузку и собирает отчет"""
+
+    usernames = [f"{USERNAME_PREFIX}{i}" for i in range(args.users)]
+
+    if args.auth == "stub":
+        if JWT_VERIFICATION == "local":
+            raise SystemExit("Заглушка Auth сервиса не подписывает токены: нужен JWT_VERIFICATION=remote")
+
+        auth_app = stub_auth_app(usernames)
+    else:
+        auth_app = load_auth_app()
+
+    async with AsyncExitStack() as stack:
+        await stack.enter_async_context(auth_app.router.lifespan_context(auth_app))
+        await stack.enter_async_context(transaction_app.router.lifespan_context(transaction_app))
+
+        # Запросы сервиса транзакций к Auth сервису тоже идут в процессе
+        await http_client.close_client()
+        http_client.init_client(transport=httpx.ASGITransport(app=auth_app))
+
+        limits = httpx.Limits(max_connections=None)
+        auth = await stack.enter_async_context(httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=auth_app), base_url="http://auth", limits=limits))
+        trans = await stack.enter_async_context(httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=transaction_app), base_url="http://trans", limits=limits))
+
+        await cleanup(usernames)
+
+        try:
+            tokens = await prepare(auth, trans, usernames)
+            samples = await run_load(auth, trans, tokens, args)
+        finally:
+            if not args.keep_data:
+                await cleanup(usernames)
+
+    return {
+        "benchmark": "load_test",
+        "auth": args.auth,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "mix": args.mix,
+        "total": summarize([sample for values in samples.values() for sample in values], args.duration),
+        "operations": {name: summarize(values, args.duration) for name, values in samples.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load_test")
+    parser.add_argument("--auth", choices=["service", "stub"], default="service",
+                        help="настоящий Auth сервис или заглушка без bcrypt и базы")
+    parser.add_argument("--users", type=int, default=20, help="число тестовых пользователей")
+    parser.add_argument("--concurrency", type=int, default=50, help="число виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность замера, секунды")
+    parser.add_argument("--warmup", type=float, default=3.0, help="прогрев без замеров, секунды")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("token=1,transfer=8,transactions=3"),
+                        help="веса операций, например token=1,transfer=8,transactions=3")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-data", action="store_true", help="не удалять аккаунты и транзакции после теста")
+    parser.add_argument("--output", type=Path, help="файл для отчета JSON")
+    parser.add_argument("--smoke", action="store_true",
+                        help="быстрая проверка: заглушка Auth, 4 пользователя, 3 секунды")
+
+    arguments = parser.parse_args()
+
+    if arguments.smoke:
+        arguments.auth = "stub"
+        arguments.users = 4
+        arguments.concurrency = 8
+        arguments.duration = 3.0
+        arguments.warmup = 0.5
+
+    if arguments.users < 2:
+        parser.error("--users должно быть не меньше 2")
+
+    report = asyncio.run(main(arguments))
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if arguments.output:
+        arguments.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
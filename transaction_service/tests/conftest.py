@@ -0,0 +1,110 @@
+""" Общие фикстуры тестов сервиса транзакций
+
+Тесты с базой используют TRANS_DATABASE_URL (база должна быть мигрирована:
+alembic upgrade head) и пропускаются, если база недоступна. Auth сервис
+заменяется заглушкой httpx.MockTransport.
+
+Запуск из каталога transaction_service:
+
+    TRANS_DATABASE_URL=postgresql+asyncpg://... python -m pytest
+"""
+
+import json
+import os
+import tempfile
+
+# До импорта app: env.py проверяет обязательные переменные при импорте
+os.environ.setdefault("TRANS_DATABASE_URL", "postgresql+asyncpg://test@localhost:1/test")
+os.environ.setdefault("AUTH_SERVICE_URL", "http://auth")
+os.environ.setdefault("LOGS_DIR", tempfile.mkdtemp(prefix="transaction_service_logs_"))
+os.environ["JWT_VERIFICATION"] = "remote"
+
+import httpx
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import http_client, idempotency
+from app.database import AsyncSessionLocal, async_engine
+from app.main import app
+
+
+# uid тестовых пользователей не пересекаются с реальными
+TEST_UID_BASE = -500000
+TEST_USERNAME_PREFIX = "test_user_"
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+@pytest.fixture
+async def db():
+    """Сессия тестовой базы; аккаунты и транзакции тестовых пользователей удаляются после теста"""
+
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+    except (OSError, SQLAlchemyError) as e:
+        await async_engine.dispose()
+
+        pytest.skip(f"База транзакций недоступна: {e}")
+
+    await cleanup()
+
+    async with AsyncSessionLocal() as session:
+        yield session
+
+    await cleanup()
+
+    # Каждый тест идет в своем event loop: соединения пула к нему привязаны
+    await async_engine.dispose()
+
+async def cleanup() -> None:
+    """Удаляет данные тестовых пользователей"""
+
+    async with AsyncSessionLocal() as session:
+        accounts = "(SELECT id FROM accounts WHERE uid <= :base AND username LIKE :prefix)"
+        params = {"base": TEST_UID_BASE, "prefix": f"{TEST_USERNAME_PREFIX}%"}
+
+        await session.execute(text("DELETE FROM idempotency_keys WHERE uid <= :base"), params)
+        await session.execute(text(f"DELETE FROM account_shards WHERE account_id IN {accounts}"), params)
+        await session.execute(text(f"DELETE FROM daily_account_totals WHERE account_id IN {accounts}"), params)
+        await session.execute(text(
+            f"DELETE FROM transactions WHERE sender_id IN {accounts} OR receiver_id IN {accounts}"), params)
+        await session.execute(text(
+            "DELETE FROM accounts WHERE uid <= :base AND username LIKE :prefix"), params)
+        await session.commit()
+
+    idempotency.idempotency_cache.clear()
+
+@pytest.fixture
+def users() -> dict[str, int]:
+    """Тестовые пользователи: username -> uid"""
+
+    return {f"{TEST_USERNAME_PREFIX}{i}": TEST_UID_BASE - i for i in range(4)}
+
+@pytest.fixture
+async def client(db, users):
+    """Клиент сервиса транзакций; токен — это имя пользователя"""
+
+    def auth_handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/verify":
+            username = request.headers["Authorization"].removeprefix("Bearer ")
+
+            if username not in users:
+                return httpx.Response(401, json={"detail": "Невалидный токен"})
+
+            return httpx.Response(200, json={"id": users[username], "username": username})
+
+        usernames = json.loads(request.content)["usernames"]
+
+        return httpx.Response(200, json=[
+            {"id": users[username], "username": username} for username in usernames if username in users
+        ])
+
+    http_client.init_client(transport=httpx.MockTransport(auth_handler))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://trans") as test_client:
+        yield test_client
+
+    await http_client.close_client()
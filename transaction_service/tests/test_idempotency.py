@@ -0,0 +1,123 @@
+""" Ключи идемпотентности /transfer: занятие ключа, связь с транзакцией и повторы """
+
+import asyncio
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+from app import crud, idempotency, models, schemas
+
+
+pytestmark = pytest.mark.anyio
+
+SENDER = "test_user_0"
+RECEIVER = "test_user_1"
+
+def headers(username: str, key: str) -> dict:
+    return {"Authorization": f"Bearer {username}", "Idempotency-Key": key}
+
+async def transfer(client, key: str, amount: float = 1.0, receiver: str = RECEIVER):
+    return await client.post(
+        "/transfer",
+        json={"receiver_username": receiver, "amount": amount},
+        headers=headers(SENDER, key))
+
+async def transactions_count(db) -> int:
+    sender = select(models.Account.id).where(models.Account.username == SENDER).scalar_subquery()
+
+    return await db.scalar(
+        select(func.count()).select_from(models.Transaction).where(models.Transaction.sender_id == sender))
+
+async def test_key_is_linked_to_transaction(client, db, users):
+    response = await transfer(client, "key-link")
+
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+
+    key = await db.scalar(select(models.IdempotencyKey).where(
+        models.IdempotencyKey.uid == users[SENDER],
+        models.IdempotencyKey.key == "key-link"))
+
+    assert key.transaction_id == response.json()["id"]
+    assert key.request_hash == idempotency.request_hash(
+        schemas.TransactionCreate(receiver_username=RECEIVER, amount=1.0))
+
+async def test_replay_returns_original_transaction(client, db):
+    first = await transfer(client, "key-replay")
+
+    # Второй повтор идет мимо кеша процесса, через базу
+    cached = await transfer(client, "key-replay")
+    idempotency.idempotency_cache.clear()
+    stored = await transfer(client, "key-replay")
+
+    for response in (cached, stored):
+        assert response.status_code == 200
+        assert response.headers["Idempotent-Replayed"] == "true"
+        assert response.json() == first.json()
+
+    assert await transactions_count(db) == 1
+
+async def test_concurrent_identical_requests_transfer_once(client, db):
+    responses = await asyncio.gather(*(transfer(client, "key-concurrent") for _ in range(8)))
+
+    assert [response.status_code for response in responses] == [200] * 8
+    assert len({response.json()["id"] for response in responses}) == 1
+    assert sum("Idempotent-Replayed" not in response.headers for response in responses) == 1
+
+    assert await transactions_count(db) == 1
+
+@pytest.mark.parametrize("from_cache", [True, False])
+async def test_key_reused_with_different_payload(client, db, from_cache):
+    assert (await transfer(client, "key-payload", amount=1.0)).status_code == 200
+
+    if not from_cache:
+        idempotency.idempotency_cache.clear()
+
+    response = await transfer(client, "key-payload", amount=2.0)
+
+    assert response.status_code == 422
+    assert await transactions_count(db) == 1
+
+async def test_key_in_flight_is_conflict(client, db, users):
+    # Ключ занят запросом, который еще не связал его с транзакцией
+    await crud._claim_idempotency_key(db, users[SENDER], "key-in-flight", "other-request") # pylint: disable=protected-access
+    await db.commit()
+
+    response = await transfer(client, "key-in-flight")
+
+    assert response.status_code == 409
+    assert await transactions_count(db) == 0
+
+async def test_claim_of_live_key_raises(db, users):
+    await crud._claim_idempotency_key(db, users[SENDER], "key-claim", "hash") # pylint: disable=protected-access
+    await db.commit()
+
+    with pytest.raises(crud.IdempotencyKeyInUse):
+        await crud._claim_idempotency_key(db, users[SENDER], "key-claim", "hash") # pylint: disable=protected-access
+
+    await db.rollback()
+
+async def test_expired_key_is_claimed_again(client, db, users):
+    first = await transfer(client, "key-expired")
+
+    await db.execute(
+        update(models.IdempotencyKey)
+        .where(models.IdempotencyKey.uid == users[SENDER], models.IdempotencyKey.key == "key-expired")
+        .values(expires_at=func.now() - timedelta(seconds=1)))
+    await db.commit()
+
+    idempotency.idempotency_cache.clear()
+
+    second = await transfer(client, "key-expired")
+
+    assert second.status_code == 200
+    assert "Idempotent-Replayed" not in second.headers
+    assert second.json()["id"] != first.json()["id"]
+
+    key = await db.scalar(select(models.IdempotencyKey).where(
+        models.IdempotencyKey.uid == users[SENDER],
+        models.IdempotencyKey.key == "key-expired"))
+
+    assert key.transaction_id == second.json()["id"]
+    assert await transactions_count(db) == 2
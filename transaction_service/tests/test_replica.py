@@ -0,0 +1,150 @@
+""" Выбор базы для чтений истории: реплика или основная база """
+
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.env import REPLICA_MAX_LAG
+
+
+pytestmark = pytest.mark.anyio
+
+class StubProbe:
+    """Заглушка замера отставания: возвращает lag или бросает error"""
+
+    def __init__(self):
+        self.lag: float | None = 0.0
+        self.error: Exception | None = None
+
+    async def __call__(self) -> float | None:
+        if self.error is not None:
+            raise self.error
+
+        return self.lag
+
+@pytest.fixture
+async def replica(monkeypatch):
+    """Реплика без базы: движок не подключается, отставание задает StubProbe"""
+
+    engine = create_async_engine("postgresql+asyncpg://test@localhost:1/replica")
+    monitor = database.ReplicaMonitor(engine)
+    probe = StubProbe()
+
+    monkeypatch.setattr(monitor, "measure_lag", probe)
+    monkeypatch.setattr(database, "replica_engine", engine)
+    monkeypatch.setattr(database, "replica_monitor", monitor)
+    monkeypatch.setattr(database, "ReplicaSessionLocal", sessionmaker(
+        engine, expire_on_commit=False, class_=AsyncSession))
+
+    yield monitor, probe
+
+    await engine.dispose()
+
+async def read_db_bind():
+    """Движок сессии, которую выдает зависимость get_read_db"""
+
+    dependency = database.get_read_db()
+    session = await anext(dependency)
+
+    await dependency.aclose()
+
+    return session.bind
+
+async def test_reads_go_to_primary_without_replica(monkeypatch):
+    monkeypatch.setattr(database, "replica_monitor", None)
+
+    assert await read_db_bind() is database.async_engine
+
+async def test_reads_go_to_primary_before_first_check(replica):
+    monitor, _probe = replica
+
+    assert await read_db_bind() is database.async_engine
+
+async def test_reads_go_to_replica_within_max_lag(replica):
+    monitor, probe = replica
+    probe.lag = REPLICA_MAX_LAG / 2
+
+    await monitor.check()
+
+    assert monitor.healthy
+    assert await read_db_bind() is monitor.engine
+    assert monitor.replica_reads == 1
+
+async def test_lagging_replica_falls_back_to_primary(replica):
+    monitor, probe = replica
+
+    await monitor.check()
+    assert await read_db_bind() is monitor.engine
+
+    probe.lag = REPLICA_MAX_LAG + 1
+    await monitor.check()
+
+    assert not monitor.healthy
+    assert await read_db_bind() is database.async_engine
+    assert monitor.primary_reads == 1
+
+    # Догнала — чтения возвращаются в реплику
+    probe.lag = 0.0
+    await monitor.check()
+
+    assert await read_db_bind() is monitor.engine
+
+async def test_unknown_lag_falls_back_to_primary(replica):
+    monitor, probe = replica
+    probe.lag = None
+
+    await monitor.check()
+
+    assert monitor.available
+    assert await read_db_bind() is database.async_engine
+
+@pytest.mark.parametrize("error", [
+    ConnectionRefusedError("connection refused"),
+    TimeoutError(),
+    exc.OperationalError("SELECT 1", {}, Exception("server closed the connection")),
+])
+async def test_unreachable_replica_falls_back_to_primary(replica, error):
+    monitor, probe = replica
+
+    await monitor.check()
+    probe.error = error
+    await monitor.check()
+
+    assert not monitor.available
+    assert monitor.failures == 1
+    assert await read_db_bind() is database.async_engine
+
+async def test_dropped_replica_connection_falls_back_immediately(replica):
+    monitor, _probe = replica
+
+    await monitor.check()
+
+    dependency = database.get_read_db()
+    session = await anext(dependency)
+
+    assert session.bind is monitor.engine
+
+    # Запрос к реплике упал из-за разрыва соединения
+    error = exc.DBAPIError("SELECT 1", {}, Exception("connection was closed"), connection_invalidated=True)
+
+    with pytest.raises(exc.DBAPIError):
+        await dependency.athrow(error)
+
+    assert not monitor.available
+    assert await read_db_bind() is database.async_engine
+
+async def test_query_error_keeps_replica(replica):
+    monitor, _probe = replica
+
+    await monitor.check()
+
+    dependency = database.get_read_db()
+    await anext(dependency)
+
+    # Ошибка в самом запросе, а не в соединении, не переключает чтения
+    with pytest.raises(exc.DBAPIError):
+        await dependency.athrow(exc.DBAPIError("SELECT 1", {}, Exception("syntax error")))
+
+    assert monitor.healthy
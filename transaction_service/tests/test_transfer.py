@@ -0,0 +1,102 @@
+""" Переводы: условное списание и встречные переводы между новыми аккаунтами """
+
+import asyncio
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from app import crud, models, schemas
+from app.config import DEFAULT_BALANCE
+from app.database import AsyncSessionLocal
+
+
+pytestmark = pytest.mark.anyio
+
+async def transfer(client, sender: str, receiver: str, amount: float):
+    return await client.post(
+        "/transfer",
+        json={"receiver_username": receiver, "amount": amount},
+        headers={"Authorization": f"Bearer {sender}"})
+
+async def balance(client, username: str) -> float:
+    response = await client.get("/balance", headers={"Authorization": f"Bearer {username}"})
+
+    return response.json()["balance"]
+
+async def transactions_count(db) -> int:
+    return await db.scalar(select(func.count()).select_from(models.Transaction).join(
+        models.Account, models.Account.id == models.Transaction.sender_id).where(
+        models.Account.username.like("test_user_%"), models.Account.uid < 0))
+
+async def test_insufficient_funds(client, db):
+    assert (await transfer(client, "test_user_0", "test_user_1", 1.0)).status_code == 200
+
+    response = await transfer(client, "test_user_0", "test_user_1", DEFAULT_BALANCE)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Недостаточно средств"
+
+    assert await balance(client, "test_user_0") == DEFAULT_BALANCE - 1
+    assert await transactions_count(db) == 1
+
+async def test_concurrent_debits_never_overdraw(client, db):
+    amount = DEFAULT_BALANCE / 3 + 1
+
+    responses = await asyncio.gather(*(
+        transfer(client, "test_user_0", f"test_user_{i % 3 + 1}", amount) for i in range(6)))
+
+    assert sorted(response.status_code for response in responses) == [200, 200, 400, 400, 400, 400]
+
+    assert await balance(client, "test_user_0") == pytest.approx(DEFAULT_BALANCE - 2 * amount)
+    assert await transactions_count(db) == 2
+
+async def wait_for_lock_waiters(db, count: int) -> None:
+    """Ждет, пока count запросов к базе не встанут в ожидание блокировки"""
+
+    for _ in range(100):
+        waiting = await db.scalar(text(
+            "SELECT count(*) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND wait_event_type = 'Lock'"))
+
+        if waiting >= count:
+            return
+
+        await asyncio.sleep(0.05)
+
+    pytest.fail("Переводы не встали в ожидание блокировки")
+
+@pytest.mark.parametrize("batch", [False, True], ids=["transfer", "transfer_batch"])
+async def test_opposing_first_transfers(db, users, batch):
+    # Встречные первые переводы A -> B и B -> A вставляют оба аккаунта.
+    # Незафиксированная вставка A задерживает обе транзакции, и после ее
+    # отката они вставляют аккаунты одновременно: при разном порядке строк
+    # одна ждала бы другую на A, а другая первую на B
+    low, high = (
+        schemas.AccountCreate(uid=users[username], username=username)
+        for username in sorted(users, key=users.get)[:2])
+
+    async def run(sender: schemas.AccountCreate, receiver: schemas.AccountCreate):
+        async with AsyncSessionLocal() as session:
+            if batch:
+                return (await crud.transfer_batch(session, sender, [(receiver, 1.0)]))[0]
+
+            return await crud.transfer(session, sender, receiver, 1.0)
+
+    async with AsyncSessionLocal() as blocker:
+        await blocker.execute(insert(models.Account).values(
+            uid=low.uid, username=low.username, balance=DEFAULT_BALANCE))
+
+        transfers = [asyncio.create_task(run(low, high)), asyncio.create_task(run(high, low))]
+
+        await wait_for_lock_waiters(db, 2)
+        await blocker.rollback()
+
+    results = await asyncio.gather(*transfers)
+
+    assert all(isinstance(result, models.Transaction) for result in results)
+
+    for account in (low, high):
+        account_id = (await crud.get_account_by_uid(db, account.uid)).id
+
+        assert await crud.get_account_balance(db, account_id) == DEFAULT_BALANCE